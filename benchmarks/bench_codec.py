@@ -0,0 +1,43 @@
+"""
+Encode and decode time of the JSON codecs on calc_prices payloads
+
+    python -m benchmarks.bench_codec [count]
+"""
+import json
+import sys
+import timeit
+
+from cdekapi import CdekApi
+from cdekapi.codec import available_codecs, get_codec
+from benchmarks import fixtures
+
+GOODS = [{'weight': 0.3, 'length': 10, 'width': 7, 'height': 5}] * 3
+
+
+def request():
+    api = CdekApi('login', 'password')
+    data = api._quote_data(44, 137, GOODS, None, 136, [{'id': tariff_id} for tariff_id in (136, 137, 233, 234)],
+                           None, 'RUB', [{'id': 2, 'param': 1000}])
+    return api._sign(data)
+
+
+def main(count=100000):
+    data = request()
+    response = json.dumps(fixtures.CALC_PRICES, ensure_ascii=False).encode('utf-8')
+    cases = {
+        # what run() did before the codec layer
+        'json (legacy)': (lambda: json.dumps(data, ensure_ascii=False).encode('utf8'),
+                          lambda: json.loads(response)),
+    }
+    for name in available_codecs():
+        codec = get_codec(name)
+        cases[name] = (lambda codec=codec: codec.dumps(data), lambda codec=codec: codec.loads(response))
+    print(f'{"codec":<16}{"encode us":>12}{"decode us":>12}')
+    for name, (encode, decode) in cases.items():
+        encode_time = min(timeit.repeat(encode, number=count, repeat=3)) / count
+        decode_time = min(timeit.repeat(decode, number=count, repeat=3)) / count
+        print(f'{name:<16}{encode_time * 1e6:>12.2f}{decode_time * 1e6:>12.2f}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,68 @@
+"""
+Construction time and memory of typed results against the plain dict output
+
+    python -m benchmarks.bench_models [count]
+"""
+import sys
+import timeit
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from cdekapi import CdekApi
+from cdekapi.models import Quote, Pvz
+
+RESULT = {
+    'price': '1050.5',
+    'deliveryPeriodMin': '1',
+    'deliveryPeriodMax': '2',
+    'deliveryDateMin': '2020-01-02',
+    'deliveryDateMax': '2020-01-03',
+    'tariffId': '136',
+    'priceByCurrency': 1050.5,
+    'currency': 'RUB',
+}
+
+PVZ = ET.fromstring(
+    '<Pvz Code="NSK1" Name="Академгородок" CityCode="270" City="Новосибирск" '
+    'Address="Ильича, 6" AddressComment="" Note="" Phone="+7383" '
+    'coordX="83.1" coodrY="54.8" Type="PVZ" AllowedCod="1"/>'
+)
+
+
+def quote_dict():
+    res = {'result': dict(RESULT)}
+    res['result']['price'] = round(float(res['result']['price']), 0)
+    return res
+
+
+def quote_record():
+    return Quote.from_json(RESULT)
+
+
+def pvz_dict():
+    return CdekApi._pvz_dict(PVZ)
+
+
+def pvz_record():
+    return Pvz.from_attrib(PVZ.attrib)
+
+
+def memory(factory, count):
+    tracemalloc.start()
+    items = [factory() for _ in range(count)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del items
+    return size / count
+
+
+def main(count=100000):
+    print(f'{"case":<14}{"us/object":>12}{"bytes/object":>14}')
+    for name, factory in (('quote dict', quote_dict), ('Quote', quote_record),
+                          ('pvz dict', pvz_dict), ('Pvz', pvz_record)):
+        seconds = min(timeit.repeat(factory, number=count, repeat=3))
+        print(f'{name:<14}{seconds / count * 1e6:>12.2f}{memory(factory, count):>14.0f}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
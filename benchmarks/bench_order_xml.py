@@ -0,0 +1,29 @@
+"""
+deliveryrequest build time, ElementTree against the streaming serializer
+
+    python -m benchmarks.bench_order_xml [items] [count]
+"""
+import sys
+import timeit
+
+from cdekapi.order_xml import orders_tree, orders_xml
+from benchmarks import fixtures
+
+
+def main(items=1000, count=50):
+    cases = {
+        '1 package': [fixtures.order(items=items)],
+        '10 packages': [fixtures.order(items=items // 10, packages=10)],
+        '50 orders': [fixtures.order(items=items // 50) for _ in range(50)],
+    }
+    print(f'{items} items')
+    print(f'{"case":<14}{"ElementTree ms":>16}{"streaming ms":>14}{"speedup":>9}')
+    for name, orders in cases.items():
+        assert orders_tree('login', 'password', orders) == orders_xml('login', 'password', orders)
+        tree = min(timeit.repeat(lambda: orders_tree('login', 'password', orders), number=count, repeat=3))
+        stream = min(timeit.repeat(lambda: orders_xml('login', 'password', orders), number=count, repeat=3))
+        print(f'{name:<14}{tree / count * 1e3:>16.2f}{stream / count * 1e3:>14.2f}{tree / stream:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
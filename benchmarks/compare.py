@@ -0,0 +1,59 @@
+"""
+Compare two benchmarks.run result files
+
+    python -m benchmarks.compare baseline.json results.json [--threshold 0.1]
+
+Exits with 1 if a metric got worse by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+# metrics where a bigger value is better, the rest (time, memory) are better smaller
+HIGHER_IS_BETTER = ('calls_per_s',)
+SKIPPED = ('calls', 'concurrency', 'points', 'items', 'bytes')
+
+
+def flatten(results, prefix=''):
+    for key, value in results.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            yield from flatten(value, name + '.')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and key not in SKIPPED:
+            yield name, value
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    :return: list of (metric, baseline, current, change, regressed)
+    """
+    old = dict(flatten(baseline['results']))
+    rows = []
+    for name, value in flatten(current['results']):
+        if name not in old or not old[name]:
+            continue
+        change = value / old[name] - 1
+        worse = -change if name.endswith(HIGHER_IS_BETTER) else change
+        rows.append((name, old[name], value, change, worse > threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed relative regression')
+    args = parser.parse_args(argv)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    rows = compare(baseline, current, args.threshold)
+    print(f'{"metric":<55}{"baseline":>14}{"current":>14}{"change":>9}')
+    for name, old, new, change, regressed in rows:
+        print(f'{name:<55}{old:>14.1f}{new:>14.1f}{change:>+9.1%}{"  !" if regressed else ""}')
+    return 1 if any(row[4] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
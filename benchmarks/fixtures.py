@@ -0,0 +1,100 @@
+"""
+Recorded CDEK responses replayed by the stub server
+"""
+import json
+import random
+
+CALC_PRICE = {
+    'result': {
+        'price': '1050.5',
+        'deliveryPeriodMin': 1,
+        'deliveryPeriodMax': 2,
+        'deliveryDateMin': '2020-01-02',
+        'deliveryDateMax': '2020-01-03',
+        'tariffId': 136,
+        'priceByCurrency': 1050.5,
+        'currency': 'RUB',
+    }
+}
+
+CALC_PRICES = {
+    'result': [
+        {'status': True, 'tariffId': tariff_id,
+         'result': {'price': str(200 + tariff_id), 'deliveryPeriodMin': 2, 'deliveryPeriodMax': 4,
+                    'deliveryDateMin': '2020-01-03', 'deliveryDateMax': '2020-01-05',
+                    'tariffId': tariff_id, 'priceByCurrency': 200 + tariff_id, 'currency': 'RUB'}}
+        for tariff_id in (136, 137, 233, 234, 291, 294)
+    ] + [
+        {'status': False, 'tariffId': tariff_id,
+         'result': {'errors': {'code': 3, 'message': 'Невозможно осуществить доставку по этому направлению'}}}
+        for tariff_id in (59, 11)
+    ]
+}
+
+PVZ = ('<Pvz Code="{code}" PostalCode="630090" Name="Пункт {n}" CityCode="{city}" City="Город {city}" '
+       'WorkTime="Пн-Пт 10:00-20:00, Сб-Вс 10:00-16:00" Address="Улица {n}, {house}" '
+       'FullAddress="Россия, область, Город {city}, Улица {n}, {house}" AddressComment="Вход со двора" '
+       'Phone="+73833000000" Email="pvz{n}@cdek.ru" Note="" coordX="{x:.6f}" coodrY="{y:.6f}" '
+       'Type="{type}" ownerCode="cdek" IsDressingRoom="true" HaveCashless="true" AllowedCod="{cod}" '
+       'NearestStation="" MetroStation="" Site=""/>')
+
+
+def pvz_list(count, cities=1, seed=1):
+    rnd = random.Random(seed)
+    points = ''.join(
+        PVZ.format(code=f'P{n}', n=n, city=270 + n % cities, house=rnd.randint(1, 200),
+                   x=rnd.uniform(30, 130), y=rnd.uniform(43, 70),
+                   type='PVZ' if n % 5 else 'POSTOMAT', cod=n % 2)
+        for n in range(count)
+    )
+    return ('<?xml version="1.0" encoding="UTF-8"?><PvzList>' + points + '</PvzList>').encode('utf-8')
+
+
+NEW_ORDER = ('<?xml version="1.0" encoding="UTF-8"?><response>'
+             '<Order Number="1" DispatchNumber="1105070470"/>'
+             '<Order Msg="Добавлено заказов 1"/></response>').encode('utf-8')
+
+STATUS = ('<?xml version="1.0" encoding="UTF-8"?><StatusReport DateFirst="2020-01-01" DateLast="2020-01-02">'
+          + ''.join(f'<Order ActNumber="" Number="{n}" DispatchNumber="{1000 + n}" DeliveryDate="" RecipientName="">'
+                    f'<Status Date="2020-01-02T10:00:00+07:00" Code="3" Description="Принят на склад отправителя" '
+                    f'CityCode="44" CityName="Москва"/></Order>' for n in range(100))
+          + '</StatusReport>').encode('utf-8')
+
+
+def routes(pvz_count=2):
+    """
+    :param pvz_count: number of points in the pvz_list response
+    :return: path -> (status, content type, body)
+    """
+    return {
+        '/calc_price': (200, 'application/json', json.dumps(CALC_PRICE).encode('utf-8')),
+        '/calc_prices': (200, 'application/json', json.dumps(CALC_PRICES).encode('utf-8')),
+        '/pvz_list': (200, 'application/xml', pvz_list(pvz_count)),
+        '/new_order': (200, 'application/xml', NEW_ORDER),
+        '/status': (200, 'application/xml', STATUS),
+    }
+
+
+def order(items=1, packages=1):
+    return {
+        'number': '1',
+        'sender_city': 44,
+        'receiver_city': 137,
+        'tarifftypecode': 136,
+        'deliveryrecipientcost': 0,
+        'recipientname': 'Иванов Андрей Петрович',
+        'recepientemail': 'a@a.ru',
+        'phone': '5566656595',
+        'address': {'street': 'Ленина', 'house': 1, 'flat': 2},
+        'packages': [
+            {
+                'weight': 1000, 'length': 40, 'width': 30, 'height': 30,
+                'items': [
+                    {'amount': 1, 'warekey': f'АРТ-{p}-{i}', 'cost': 1000, 'payment': 0, 'weight': 100,
+                     'comment': f'Товар "{i}" & <аксессуар>'}
+                    for i in range(items)
+                ],
+            }
+            for p in range(packages)
+        ],
+    }
@@ -0,0 +1,175 @@
+"""
+Offline benchmark suite, every call goes to a local stub replaying recorded CDEK responses
+
+    python -m benchmarks.run [-o results.json] [--quick]
+    python -m benchmarks.compare baseline.json results.json
+"""
+import argparse
+import asyncio
+import gc
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import cdekapi
+from cdekapi import CdekApi
+from cdekapi.stub import StubServer
+from benchmarks import fixtures
+
+GOODS = [{'weight': 0.3, 'length': 10, 'width': 7, 'height': 5}]
+TARIFFS = [{'id': 136}, {'id': 137}, {'id': 233}, {'id': 234}, {'id': 291}, {'id': 294}]
+
+
+def goods(n):
+    # distinct requests, so that identical in-flight calls are not coalesced
+    return [dict(GOODS[0], weight=0.3 + n / 1000)]
+
+
+def latency(fn, count):
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        'calls': count,
+        'mean_us': statistics.mean(timings) * 1e6,
+        'p50_us': timings[len(timings) // 2] * 1e6,
+        'p95_us': timings[int(len(timings) * 0.95)] * 1e6,
+    }
+
+
+def bench_call_overhead(stub, count):
+    """
+    Sequential calls over one keep-alive connection, the stub answers from memory
+    so the time is mostly the client's own overhead
+    """
+    with stub.api(CdekApi) as api:
+        api.calc_price(44, 137, GOODS)
+        return {
+            'calc_price': latency(lambda: api.calc_price(44, 137, GOODS), count),
+            'calc_prices': latency(lambda: api.calc_prices(44, 137, GOODS, tariff_list=TARIFFS), count),
+        }
+
+
+def bench_throughput(stub, count, concurrency):
+    with stub.api(CdekApi) as api:
+        with ThreadPoolExecutor(concurrency) as pool:
+            start = time.perf_counter()
+            list(pool.map(lambda n: api.calc_price(44, 137, goods(n)), range(count)))
+            elapsed = time.perf_counter() - start
+    return {'calls': count, 'concurrency': concurrency, 'calls_per_s': count / elapsed}
+
+
+def bench_async_throughput(stub, count, concurrency):
+    try:
+        from cdekapi.aio import AsyncCdekApi
+        import aiohttp  # noqa: F401
+    except ImportError:
+        return None
+
+    async def run():
+        async with stub.api(AsyncCdekApi) as api:
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def call(n):
+                async with semaphore:
+                    await api.calc_price(44, 137, goods(n))
+
+            start = time.perf_counter()
+            await asyncio.gather(*(call(n) for n in range(count)))
+            return time.perf_counter() - start
+
+    elapsed = asyncio.run(run())
+    return {'calls': count, 'concurrency': concurrency, 'calls_per_s': count / elapsed}
+
+
+def measure(fn):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': elapsed, 'peak_bytes': peak}
+
+
+def bench_pvz(size):
+    with StubServer(fixtures.routes(pvz_count=size), record=False) as stub, stub.api(CdekApi) as api:
+        api.get_pvz_list(270, None)
+        return {
+            'points': size,
+            'get_pvz_list': measure(lambda: api.get_pvz_list(270, None)),
+            'iter_pvz': measure(lambda: sum(1 for _ in api.iter_pvz(270))),
+        }
+
+
+def bench_order_xml(items, count):
+    api = CdekApi('login', 'password')
+    order = fixtures.order(items=items)
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        data = api._order_xml(order)
+        timings.append(time.perf_counter() - start)
+    return {'items': items, 'bytes': len(data), 'mean_us': statistics.mean(timings) * 1e6,
+            'min_us': min(timings) * 1e6}
+
+
+def bench_orders(stub, count):
+    with stub.api(CdekApi) as api:
+        order = fixtures.order(items=10)
+        statuses = [{'order_number': n, 'dispatch_number': 1000 + n} for n in range(100)]
+        return {
+            'new_order': latency(lambda: api.new_order(order), count),
+            'check_orders_status': latency(lambda: api.check_orders_status(statuses), count),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', help='write the results to this json file instead of stdout')
+    parser.add_argument('--quick', action='store_true', help='fewer iterations, for a smoke run')
+    args = parser.parse_args(argv)
+    scale = 10 if args.quick else 1
+    results = {}
+    with StubServer(fixtures.routes(), record=False) as stub:
+        results['call_overhead'] = bench_call_overhead(stub, 2000 // scale)
+        results['throughput'] = {
+            f'threads_{n}': bench_throughput(stub, 4000 // scale, n) for n in (1, 8, 32)
+        }
+        results['async_throughput'] = {
+            f'tasks_{n}': bench_async_throughput(stub, 4000 // scale, n) for n in (8, 32)
+        }
+        results['orders'] = bench_orders(stub, 500 // scale)
+    results['pvz'] = {
+        'small': bench_pvz(2),
+        'country': bench_pvz(20000 // scale),
+    }
+    results['order_xml'] = {
+        f'items_{n}': bench_order_xml(n, 2000 // n // scale or 1) for n in (1, 100, 1000)
+    }
+    report = {
+        'cdekapi': cdekapi.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'quick': args.quick,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+"""
+Serve the recorded CDEK responses of the benchmarks on a fixed port, for profiling against a long-running stub
+
+    python -m benchmarks.stub_server [port]
+"""
+import sys
+
+from cdekapi.stub import StubServer
+from benchmarks import fixtures
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    with StubServer(fixtures.routes(), port=port, record=False) as stub:
+        print('serving on', stub.httpd.server_address)
+        stub.thread.join()
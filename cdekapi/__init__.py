@@ -1,10 +1,25 @@
 import datetime
-import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from hashlib import md5
-import requests
 import xml.etree.ElementTree as ET
 
 from cdekapi import calc_dictionaries
+from cdekapi.exceptions import (CdekAPIException, CdekAPIError, CdekAPIConnectionError, CircuitOpenError,
+                                CdekAPIValidationError)
+from cdekapi.resilience import Resilience
+from cdekapi.transport import HttpTransport
+from cdekapi.bulk import run_bulk
+from cdekapi.models import Pvz, Quote, TariffQuote, Order, OrderResult
+from cdekapi.eligibility import filter_tariffs, dropped_results
+from cdekapi.ranking import TariffRanker
+from cdekapi.cache import request_key
+from cdekapi.singleflight import SingleFlight
+from cdekapi.ratelimit import RateLimiter, BULK, priority
+from cdekapi.instrumentation import Instrumentation, NOOP_SPAN
+from cdekapi.codec import get_codec
+from cdekapi.prepared import PreparedQuote
+from cdekapi.order_xml import orders_xml, status_xml
 
 VERSION = (0, 0, 83)
 
@@ -16,33 +31,33 @@ def get_version():
 __version__ = get_version()
 
 
-class CdekAPIException(Exception):
-    pass
+@lru_cache(maxsize=64)
+def _format_date(date):
+    return f'{date.year}-{date.month}-{date.day}'
 
 
-class CdekAPIError(CdekAPIException):
-    pass
-
-
-class CdekAPIConnectionError(CdekAPIException):
-    pass
-
-
-class CdekApi:
+class BaseCdekApi:
     """
-    Main class
+    Request building and response parsing shared by CdekApi and AsyncCdekApi, no I/O
     """
     login = ''
     password = ''
     version = '1.0'
     dicts = calc_dictionaries
 
-    def __init__(self, login=None, password=None, test_mode=False):
+    def __init__(self, login=None, password=None, test_mode=False, transport=None, cache=None,
+                 resilience=None, instrumentation=None, codec=None, pvz_cache=None, quantizer=None):
         """
-        Create the api instance
-        :param login: cdek login
-        :param password: cdek password
+        Set up the endpoints and the components shared by both clients, see CdekApi.__init__
         """
+        self.transport = transport
+        self.cache = cache
+        self.resilience = resilience or Resilience()
+        self.instrumentation = instrumentation or Instrumentation()
+        self.codec = get_codec(codec)
+        self.pvz_cache = pvz_cache
+        self.quantizer = quantizer
+        self._signatures = {}
         if test_mode:
             self.login = 'z9GRRu7FxmO53CQ9cFfI6qiy32wpfTkd'
             self.password = 'w24JTCv4MnAcuRTx0oHjHLDtyt3I6IBq'
@@ -64,85 +79,138 @@ class CdekApi:
                 'status': 'https://integration.cdek.ru/status_report_h.php',
             }
 
-    def run(self, method, data):
+    def _secure(self, date_execute):
         """
-        Query the CDEK API (POST)
-        :param method:
+        md5 of dateExecute&password, it changes once a day so it is computed once per date
+        """
+        key = (date_execute, self.password)
+        secure = self._signatures.get(key)
+        if secure is None:
+            if len(self._signatures) > 16:
+                self._signatures.clear()
+            secure = self._signatures[key] = md5(f"{date_execute}&{self.password}".encode('utf-8')).hexdigest()
+        return secure
+
+    def _sign(self, data):
+        """
+        Add the auth fields to the calculator request
         :param data: json data
-        :return: json result
+        :return: json data
         """
         if data['dateExecute']:
             data['authLogin'] = self.login
-            data['secure'] = md5(f"{data['dateExecute']}&{self.password}".encode('utf-8')).hexdigest()
+            data['secure'] = self._secure(data['dateExecute'])
+        return data
+
+    def _run_body(self, data, span):
+        """
+        Sign and encode the calculator request of run()
+        :return: (body, headers)
+        """
+        self._sign(data)
         headers = {
             'Content-Type': 'application/json; charset=utf-8'
         }
-        response = requests.post(self.methods[method],
-                                 data=json.dumps(data, ensure_ascii=False).encode('utf8'),
-                                 headers=headers)
+        with span.phase('encode'):
+            body = self.codec.dumps(data)
+        span.set('request_bytes', len(body))
+        return body, headers
+
+    def _run_result(self, response, span):
+        """
+        Decode the calculator response of run()
+        :return: json result
+        """
         if response.status_code != 200:
             raise CdekAPIConnectionError(response)
-        res = response.json()
-        if res.get('error', False):
-            raise CdekAPIError(res)
-        return res
+        with span.phase('decode'):
+            res = self.codec.loads(response.content)
+        return self._check_json(res, span)
 
-    def get_xml(self, method, **kwargs):
+    def _cache_lookup(self, method, data):
         """
-        Query the CDEK API (GET)
-        :param method:
-        :param kwargs: GET parameters
-        :return: xml result
+        Cached calculator result of the request, None on a miss or if the cache is disabled
         """
-        q = ''
-        for key, val in kwargs.items():
-            q += '&' if q > '' else ''
-            q += f'{key}={val}'
-        url = f'{self.methods[method]}?{q}'
-        response = requests.get(url)
+        if self.cache is None:
+            return None
+        res = self.cache.get(method, data)
+        self.instrumentation.event('cache', method=method, hit=res is not None)
+        return res
+
+    @staticmethod
+    def _get_xml_result(response):
         response.encoding = 'utf-8'
         if response.status_code != 200:
             raise CdekAPIConnectionError(response)
         return response.text
 
-    def post_xml(self, method, **kwargs):
+    @staticmethod
+    def _post_xml_data(kwargs, span, decode_bytes=False):
         """
-        Query the CDEK API (POST)
-        :param method:
-        :param kwargs: POST parameters
-        :return: xml result
+        POST parameters of post_xml
+        :param decode_bytes: send bytes values as str, for transports sending bytes as file fields
         """
         data = {}
         for key, val in kwargs.items():
-            data[key] = val
-        url = f'{self.methods[method]}'
-        response = requests.post(url, data=data)
+            data[key] = val.decode('utf-8') if decode_bytes and isinstance(val, bytes) else val
+        span.set('request_bytes', sum(len(val) for val in data.values() if isinstance(val, (str, bytes))))
+        return data
+
+    @staticmethod
+    def _post_xml_result(response):
         if response.status_code != 200:
-            raise CdekAPIConnectionError(response.text)
+            raise CdekAPIConnectionError(response.text, status_code=response.status_code)
         return response.text
 
-    def calc_price(self,
-                   sender_city_id,
-                   receiver_city_id,
-                   goods,
-                   date_execute=None,
-                   tariff_id=136,
-                   tariff_list=None,
-                   mode_id=None,
-                   currency='RUB',
-                   services=None,
-                   decimal_places=0):
+    @staticmethod
+    def _check_json(res, span=NOOP_SPAN):
+        if res.get('error', False):
+            errors = res['error']
+            if isinstance(errors, list) and errors and isinstance(errors[0], dict):
+                span.set_error_code(errors[0].get('code'))
+            raise CdekAPIError(res)
+        return res
+
+    @staticmethod
+    def _record_response(span, response):
+        span.set('status_code', response.status_code)
+        span.set('response_bytes', len(response.content))
+        elapsed = getattr(response, 'elapsed', None)
+        if elapsed is not None:
+            # time to the response headers, the rest of 'upstream' is reading the body
+            span.add_phase('ttfb', elapsed.total_seconds())
+
+    @staticmethod
+    def _query_string(kwargs):
+        q = ''
+        for key, val in kwargs.items():
+            q += '&' if q > '' else ''
+            q += f'{key}={val}'
+        return q
 
+    @staticmethod
+    def _date_execute(date_execute=None):
         if not date_execute:
-            delta = datetime.timedelta(days=1)
-            dt = datetime.date.today() + delta
-            date_execute = f'{dt.year}-{dt.month}-{dt.day}'
-        else:
-            date_execute = f'{date_execute.year}-{date_execute.month}-{date_execute.day}'
+            date_execute = datetime.date.today() + datetime.timedelta(days=1)
+        return _format_date(date_execute)
 
+    def _quote_data(self,
+                    sender_city_id,
+                    receiver_city_id,
+                    goods,
+                    date_execute=None,
+                    tariff_id=136,
+                    tariff_list=None,
+                    mode_id=None,
+                    currency='RUB',
+                    services=None):
+        """
+        Build the calculator request shared by calc_price and calc_prices
+        :return: json data
+        """
         data = {
             'version':  '1.0',
-            'dateExecute':  date_execute,
+            'dateExecute':  self._date_execute(date_execute),
             'senderCityId':  sender_city_id,
             'receiverCityId':  receiver_city_id,
             'goods': goods,
@@ -160,11 +228,386 @@ class CdekApi:
         if mode_id:
             data['modeId'] = mode_id
 
-        res = self.run('calc_price', data)
+        return data
+
+    def _quantized(self, method, data, quantize=None):
+        """
+        Round the goods up to the quantizer buckets
+        :param quantize: Quantizer, False to send the goods as they are, self.quantizer by default
+        """
+        quantizer = self.quantizer if quantize is None else quantize
+        return quantizer.apply(method, data) if quantizer else data
+
+    @staticmethod
+    def _round_price(res, decimal_places=0):
         res['result']['price'] = round(float(res['result']['price']), decimal_places)
+        return res
+
+    @staticmethod
+    def _round_prices(res, decimal_places=0):
+        for r in res['result']:
+            if r['status']:
+                r['result']['price'] = round(float(r['result']['price']), decimal_places)
+        return res
 
+    @staticmethod
+    def _prefilter(goods, tariff_id, tariff_list, delivery_type):
+        """
+        Drop the tariffs calc_dictionaries says can not apply
+        :return: (tariff_list, {tariff id: reason}), tariff_list is [] if nothing is left
+        """
+        candidates = tariff_list or [{'id': tariff_id}]
+        kept, dropped = filter_tariffs(candidates, goods, delivery_type)
+        if tariff_list or not kept:
+            return kept, dropped
+        return None, dropped
+
+    @staticmethod
+    def _merge_dropped(res, dropped):
+        if dropped is not None:
+            res['result'].extend(dropped_results(dropped))
+            res['dropped'] = dropped
         return res
 
+    def _calc_request(self,
+                      method,
+                      sender_city_id,
+                      receiver_city_id,
+                      goods,
+                      date_execute=None,
+                      tariff_id=136,
+                      tariff_list=None,
+                      mode_id=None,
+                      currency='RUB',
+                      services=None,
+                      prefilter=False,
+                      delivery_type=None,
+                      quantize=None):
+        """
+        Build the calc_price/calc_prices request, see calc_prices
+        :return: (json data, None if the prefilter left no tariff to ask for;
+            {tariff id: reason} of the prefiltered tariffs, None without prefilter)
+        """
+        dropped = None
+        if prefilter:
+            tariff_list, dropped = self._prefilter(goods, tariff_id, tariff_list, delivery_type)
+            if tariff_list == []:
+                return None, dropped
+        data = self._quote_data(sender_city_id, receiver_city_id, goods, date_execute,
+                                tariff_id, tariff_list, mode_id, currency, services)
+        return self._quantized(method, data, quantize), dropped
+
+    def _calc_result(self, method, res, decimal_places, dropped):
+        """
+        Round the prices of the calc_price/calc_prices result and report the prefiltered tariffs
+        :param res: json result, None if nothing was sent
+        :return: json result
+        """
+        if method == 'calc_price':
+            if res is None:
+                raise CdekAPIError({'error': [{'code': 3, 'text': '; '.join(dropped.values())}],
+                                    'dropped': dropped})
+            return self._round_price(res, decimal_places)
+        if res is None:
+            return {'result': dropped_results(dropped), 'dropped': dropped}
+        return self._merge_dropped(self._round_prices(res, decimal_places), dropped)
+
+    def prepare_quote(self, sender_city_id, receiver_city_id, **kwargs):
+        """
+        Prepare a route quote, call the result with goods
+            quote = api.prepare_quote(44, 137, tariff_list=[{'id': 136}, {'id': 137}])
+            res = quote(goods)
+        :param kwargs: tariff_id, tariff_list, mode_id, currency, services and decimal_places
+        :return: PreparedQuote
+        """
+        return self.prepared_quote_class(self, sender_city_id, receiver_city_id, **kwargs)
+
+    @staticmethod
+    def _pvz_dict(pvz):
+        return {
+            'id': pvz.attrib.get('Code'),
+            'name': pvz.attrib.get('Name'),
+            'city': pvz.attrib.get('City'),
+            'address': pvz.attrib.get('Address'),
+            'comment': pvz.attrib.get('AddressComment'),
+            'note': pvz.attrib.get('Note'),
+            'phone': pvz.attrib.get('Phone'),
+            'latitude': pvz.attrib.get('coordX'),
+            'longitude': pvz.attrib.get('coodrY'),
+            'type': pvz.attrib.get('Type'),
+            'np_allowed': pvz.attrib.get('AllowedCod'),
+        }
+
+    def _parse_pvz_list(self, res):
+        root = ET.fromstring(res)
+        return [self._pvz_dict(pvz) for pvz in root]
+
+    def _order_xml(self, order):
+        """
+        Build the deliveryrequest document for new_order
+        :param order: see new_order
+        :return: xml bytes
+        """
+        return self._orders_xml([order])
+
+    def _orders_xml(self, orders, number='1', rejected=None):
+        """
+        Build one deliveryrequest document for several orders
+        :param orders: list of orders, see new_order
+        :param number: act number
+        :param rejected: list collecting (order, exception) for orders that can not be built,
+            they are left out of the document; errors are raised if not given
+        :return: xml bytes
+        """
+        return orders_xml(self.login, self.password, orders, number, rejected)
+
+    @staticmethod
+    def _parse_new_order(res, span=NOOP_SPAN):
+        root = ET.fromstring(res)
+        if root[0].get('ErrorCode'):
+            span.set_error_code(root[0].get('ErrorCode'), root[0].get('Msg'))
+            raise CdekAPIError(root[0].get('Msg'), code=root[0].get('ErrorCode'))
+        dispatch_number = root[0].get('DispatchNumber')
+        order_number = root[0].get('Number')
+        return order_number, dispatch_number
+
+    @staticmethod
+    def _parse_new_orders(res, orders):
+        """
+        Map the new_orders.php response back to the submitted orders
+        :param res: xml response
+        :param orders: submitted orders
+        :return: list of OrderResult in the orders order
+        """
+        results = [OrderResult(order) for order in orders]
+        by_number = {}
+        for result in results:
+            by_number.setdefault(result.number, []).append(result)
+        common_error = None
+        for element in ET.fromstring(res):
+            same = by_number.get(element.get('Number'))
+            if same is None:
+                if element.get('ErrorCode') and common_error is None:
+                    common_error = (element.get('ErrorCode'), element.get('Msg'))
+                continue
+            for result in same:
+                if element.get('ErrorCode'):
+                    if result.error_code is None:
+                        result.error_code = element.get('ErrorCode')
+                        result.msg = element.get('Msg')
+                elif element.get('DispatchNumber'):
+                    result.dispatch_number = element.get('DispatchNumber')
+        for result in results:
+            if result.dispatch_number is None and result.error_code is None and common_error:
+                result.error_code, result.msg = common_error
+                result.request_error = True
+        return results
+
+    def _build_orders(self, orders, number, span):
+        """
+        Check and serialize one chunk of new_orders
+        :return: (OrderResult of the refused orders by id, orders to send, xml of the orders to send)
+        """
+        rejected = []
+        results = {}
+        with span.phase('build'):
+            for order in orders:
+                problems = order.problems() if isinstance(order, Order) else None
+                if problems:
+                    results[id(order)] = OrderResult(order, msg='; '.join(problems))
+            valid = [order for order in orders if id(order) not in results]
+            data = self._orders_xml(valid, number, rejected) if valid else None
+        results.update((id(order), OrderResult(order, msg=f'invalid order: {e!r}')) for order, e in rejected)
+        valid = [order for order in valid if id(order) not in results]
+        return results, valid, data
+
+    def _chunk_results(self, orders, results, valid, res, error, span):
+        """
+        OrderResult of every order of a new_orders chunk
+        :param results: OrderResult of the refused orders by id, see _build_orders
+        :param valid: orders sent
+        :param res: xml response, None if the request failed
+        :param error: exception of the failed request
+        :return: list of OrderResult in the orders order
+        """
+        if valid and error is None:
+            try:
+                with span.phase('parse'):
+                    results.update(zip(map(id, valid), self._parse_new_orders(res, valid)))
+            except Exception as e:
+                error = e
+        if error is not None:
+            results.update((id(order), OrderResult(order, msg=str(error), error=error)) for order in valid)
+        return [results[id(order)] for order in orders]
+
+    def _status_xml(self, orders):
+        """
+        Build the statusreport document for check_orders_status
+        :param orders: see check_orders_status
+        :return: xml bytes
+        """
+        return status_xml(self.login, self.password, orders)
+
+    @staticmethod
+    def _parse_status(res, span=NOOP_SPAN):
+        root = ET.fromstring(res)
+        if root.get('ErrorCode'):
+            span.set_error_code(root.get('ErrorCode'), root.get('Msg'))
+            raise CdekAPIError(root.get('Msg'), code=root.get('ErrorCode'))
+        return root
+
+
+class CdekApi(BaseCdekApi):
+    """
+    Main class
+    """
+    prepared_quote_class = PreparedQuote
+
+    def __init__(self, login=None, password=None, test_mode=False, transport=None, cache=None,
+                 resilience=None, limiter=None, instrumentation=None, codec=None, pvz_cache=None,
+                 quantizer=None):
+        """
+        Create the api instance
+        :param login: cdek login
+        :param password: cdek password
+        :param transport: HttpTransport instance, a pooled one is created by default
+        :param cache: QuoteCache for calc_price/calc_prices, disabled by default
+        :param resilience: Resilience with timeouts, retries and circuit breakers
+        :param limiter: RateLimiter with per-endpoint budgets, unlimited by default
+        :param instrumentation: Instrumentation with span hooks, e.g. HistogramCollector
+        :param codec: JsonCodec or its name ('orjson', 'ujson', 'json'), the fastest installed one by default
+        :param pvz_cache: PvzDiskCache for get_pvz_list, disabled by default
+        :param quantizer: Quantizer rounding calc_price/calc_prices goods up to buckets, disabled by default
+        """
+        super().__init__(login, password, test_mode, transport or HttpTransport(), cache, resilience,
+                         instrumentation, codec, pvz_cache, quantizer)
+        self.limiter = limiter or RateLimiter()
+        self.ranker = TariffRanker(self)
+        self.singleflight = SingleFlight()
+
+    def close(self):
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _request(self, http_method, method, query=None, **kwargs):
+        """
+        Send a request to the method endpoint through the transport
+        :param http_method: GET/POST
+        :param method: key of self.methods
+        :param query: raw query string
+        :param kwargs: transport keyword arguments
+        :return: response
+        """
+        url = self.methods[method]
+        if query is not None:
+            url = f'{url}?{query}'
+
+        def send(**send_kwargs):
+            with self.limiter.limit(method):
+                return self.transport.request(**send_kwargs)
+
+        return self.resilience.call(method, send, self.transport.errors,
+                                    http_method=http_method, url=url, **kwargs)
+
+    @staticmethod
+    def _bulk(fn):
+        """
+        Wrap fn to run with the BULK priority in worker threads
+        """
+        def call(*args, **kwargs):
+            with priority(BULK):
+                return fn(*args, **kwargs)
+        return call
+
+    def run(self, method, data):
+        """
+        Query the CDEK API (POST)
+        :param method:
+        :param data: json data
+        :return: json result
+        """
+        with self.instrumentation.span('run', method=method) as span:
+            body, headers = self._run_body(data, span)
+            with span.phase('upstream'):
+                response = self._request('POST', method, data=body, headers=headers)
+                self._record_response(span, response)
+            return self._run_result(response, span)
+
+    def _cached_run(self, method, data):
+        """
+        run() through the quote cache if it is enabled, identical calls in flight share one request
+        """
+        res = self._cache_lookup(method, data)
+        if res is not None:
+            return res
+        return self.singleflight.do(request_key(method, data), self._cache_run, method, data)
+
+    def _cache_run(self, method, data):
+        res = self.run(method, data)
+        if self.cache is not None:
+            self.cache.set(method, data, res)
+        return res
+
+    def get_xml(self, method, **kwargs):
+        """
+        Query the CDEK API (GET)
+        :param method:
+        :param kwargs: GET parameters
+        :return: xml result
+        """
+        with self.instrumentation.span('get_xml', method=method) as span:
+            with span.phase('upstream'):
+                response = self._request('GET', method, query=self._query_string(kwargs))
+                self._record_response(span, response)
+            return self._get_xml_result(response)
+
+    def post_xml(self, method, **kwargs):
+        """
+        Query the CDEK API (POST)
+        :param method:
+        :param kwargs: POST parameters
+        :return: xml result
+        """
+        with self.instrumentation.span('post_xml', method=method) as span:
+            data = self._post_xml_data(kwargs, span)
+            with span.phase('upstream'):
+                response = self._request('POST', method, data=data)
+                self._record_response(span, response)
+            return self._post_xml_result(response)
+
+    def calc_price(self,
+                   sender_city_id,
+                   receiver_city_id,
+                   goods,
+                   date_execute=None,
+                   tariff_id=136,
+                   tariff_list=None,
+                   mode_id=None,
+                   currency='RUB',
+                   services=None,
+                   decimal_places=0,
+                   prefilter=False,
+                   delivery_type=None,
+                   quantize=None):
+        """
+        Calculate the delivery price
+        :param prefilter: skip tariffs over their weight restriction or of another delivery_type
+            without asking CDEK, CdekAPIError code 3 is raised if none is left
+        :param delivery_type: id of dicts.delivery_types or a set of them, see eligibility.DOOR/WAREHOUSE
+        :param quantize: Quantizer rounding the goods up to buckets, False to disable the client one
+        :return: json result
+        """
+        data, dropped = self._calc_request('calc_price', sender_city_id, receiver_city_id, goods, date_execute,
+                                           tariff_id, tariff_list, mode_id, currency, services, prefilter,
+                                           delivery_type, quantize)
+        res = self._cached_run('calc_price', data) if data is not None else None
+        return self._calc_result('calc_price', res, decimal_places, dropped)
+
     def calc_prices(self,
                     sender_city_id,
                     receiver_city_id,
@@ -175,41 +618,67 @@ class CdekApi:
                     mode_id=None,
                     currency='RUB',
                     services=None,
-                    decimal_places=0):
-
-        if not date_execute:
-            delta = datetime.timedelta(days=1)
-            dt = datetime.date.today() + delta
-            date_execute = f'{dt.year}-{dt.month}-{dt.day}'
-        else:
-            date_execute = f'{date_execute.year}-{date_execute.month}-{date_execute.day}'
-
-        data = {
-            'version':  '1.0',
-            'dateExecute':  date_execute,
-            'senderCityId':  sender_city_id,
-            'receiverCityId':  receiver_city_id,
-            'goods': goods,
-            'currency': currency
-        }
-
-        if not tariff_list:
-            data['tariffId'] = tariff_id
-        else:
-            data['tariffList'] = tariff_list
+                    decimal_places=0,
+                    prefilter=False,
+                    delivery_type=None,
+                    quantize=None):
+        """
+        Calculate the delivery price for every tariff
+        :param prefilter: skip tariffs over their weight restriction or of another delivery_type
+            without asking CDEK, they are reported as prefiltered code 3 entries and in res['dropped']
+        :param delivery_type: id of dicts.delivery_types or a set of them, see eligibility.DOOR/WAREHOUSE
+        :param quantize: Quantizer rounding the goods up to buckets, False to disable the client one
+        :return: json result
+        """
+        data, dropped = self._calc_request('calc_prices', sender_city_id, receiver_city_id, goods, date_execute,
+                                           tariff_id, tariff_list, mode_id, currency, services, prefilter,
+                                           delivery_type, quantize)
+        res = self._cached_run('calc_prices', data) if data is not None else None
+        return self._calc_result('calc_prices', res, decimal_places, dropped)
 
-        if services:
-            data['services'] = services
+    def calc_quote(self, sender_city_id, receiver_city_id, goods, **kwargs):
+        """
+        calc_price returning a typed result
+        :param kwargs: calc_price keyword arguments
+        :return: Quote
+        """
+        kwargs.setdefault('decimal_places', 2)
+        res = self.calc_price(sender_city_id, receiver_city_id, goods, **kwargs)
+        return Quote.from_json(res['result'])
 
-        if mode_id:
-            data['modeId'] = mode_id
+    def calc_quotes(self, sender_city_id, receiver_city_id, goods, **kwargs):
+        """
+        calc_prices returning typed results
+        :param kwargs: calc_prices keyword arguments
+        :return: list of TariffQuote
+        """
+        kwargs.setdefault('decimal_places', 2)
+        res = self.calc_prices(sender_city_id, receiver_city_id, goods, **kwargs)
+        return TariffQuote.list_from_json(res)
 
-        res = self.run('calc_prices', data)
-        for r in res['result']:
-            if r['status']:
-                r['result']['price'] = round(float(r['result']['price']), decimal_places)
+    def best_tariff(self, sender_city_id, receiver_city_id, goods, objective='price', delivery_type=None,
+                    provisional=False, limit=None, **kwargs):
+        """
+        Rank the calc_dictionaries tariffs of a route, see TariffRanker.rank
+        :param objective: 'price' (cheapest first) or 'period' (fastest first)
+        :param delivery_type: id of dicts.delivery_types or a set of them, see eligibility.DOOR/WAREHOUSE
+        :param provisional: answer from an expired ranking while it is refreshed in the background
+        :param limit: keep only the first limit tariffs
+        :return: Ranking of TariffQuote, Ranking.best is the winner
+        """
+        return self.ranker.rank(sender_city_id, receiver_city_id, goods, objective, delivery_type,
+                                provisional, limit, **kwargs)
 
-        return res
+    def calc_prices_bulk(self, specs, max_concurrency=8, progress=None, stats=None):
+        """
+        Run calc_prices for many routes in parallel
+        :param specs: iterable of calc_prices keyword arguments dicts
+        :param max_concurrency: number of parallel requests
+        :param progress: callback(BulkStats) after every completed request
+        :param stats: BulkStats to fill
+        :return: generator of BulkResult in completion order
+        """
+        return run_bulk(self._bulk(self.calc_prices), specs, max_concurrency, progress, stats)
 
     def calc_price_num(self,
                        sender_city_id,
@@ -237,31 +706,55 @@ class CdekApi:
         Get the list of pvz for a city
         :param city_id: CDEK City Id
         :param np_allowed: 1/0
-        :return: dict of pvz
+        :return: list of pvz dicts, latitude holds coordX and longitude coodrY, see Pvz for the real axes
         """
-        res = self.get_xml('pvz_list', cityid=city_id, allowedcod=np_allowed)
-        root = ET.fromstring(res)
-        pvz_list = []
-        for pvz in root:
-            pvz_list.append({
-                'id': pvz.attrib.get('Code'),
-                'name': pvz.attrib.get('Name'),
-                'city': pvz.attrib.get('City'),
-                'address': pvz.attrib.get('Address'),
-                'comment': pvz.attrib.get('AddressComment'),
-                'note': pvz.attrib.get('Note'),
-                'phone': pvz.attrib.get('Phone'),
-                'latitude': pvz.attrib.get('coordX'),
-                'longitude': pvz.attrib.get('coodrY'),
-                'type': pvz.attrib.get('Type'),
-                'np_allowed': pvz.attrib.get('AllowedCod'),
-            })
-        return pvz_list
+        key = ('pvz_list', city_id, np_allowed)
+        if self.pvz_cache is not None:
+            return self.pvz_cache.get(key, lambda: self.singleflight.do(key, self._fetch_pvz_list, city_id, np_allowed))
+        return self.singleflight.do(key, self._fetch_pvz_list, city_id, np_allowed)
+
+    def _fetch_pvz_list(self, city_id, np_allowed):
+        with self.instrumentation.span('get_pvz_list') as span:
+            res = self.get_xml('pvz_list', cityid=city_id, allowedcod=np_allowed)
+            with span.phase('parse'):
+                return self._parse_pvz_list(res)
+
+    def iter_pvz(self, city_id=None, np_allowed=None, chunk_size=65536):
+        """
+        Stream the pvz list, parsing the response as it arrives
+        :param city_id: CDEK City Id, the whole list by default
+        :param np_allowed: 1/0
+        :param chunk_size: socket read size
+        :return: generator of Pvz
+        """
+        params = {}
+        if city_id is not None:
+            params['cityid'] = city_id
+        if np_allowed is not None:
+            params['allowedcod'] = np_allowed
+        response = self._request('GET', 'pvz_list', query=self._query_string(params), stream=True)
+        try:
+            if response.status_code != 200:
+                raise CdekAPIConnectionError(response)
+            parser = ET.XMLPullParser(events=('start', 'end'))
+            root = None
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                parser.feed(chunk)
+                for event, element in parser.read_events():
+                    if root is None:
+                        root = element
+                    elif event == 'end' and element.tag == 'Pvz':
+                        yield Pvz.from_attrib(element.attrib)
+                        # drop parsed points so the tree never grows
+                        root.clear()
+            parser.close()
+        finally:
+            response.close()
 
     def new_order(self, order):
         """
         Create new order in cdek
-        :param order: dictionary with fields:
+        :param order: Order, validated before it is sent, or dictionary with fields:
             date
             * number
             * sender_city
@@ -290,56 +783,43 @@ class CdekApi:
                     * comment
         :return:
         """
-        request = ET.Element('deliveryrequest')
-        request.set('account', self.login)
-        request.set('secure', self.password)
-        request.set('date', order.get('date', str(datetime.date.today()))),
-        request.set('number', '1')
-        request.set('ordercount', '1')
-        request_order = ET.SubElement(request, 'order')
-        request_order.set('number', str(order['number']))
-        request_order.set('sendcitycode', str(order['sender_city']))
-        request_order.set('reccitycode', str(order['receiver_city']))
-        request_order.set('tarifftypecode', str(order['tarifftypecode']))
-        request_order.set('deliveryrecipientcost', str(order['deliveryrecipientcost']))
-        request_order.set('recipientname', str(order['recipientname']))
-        request_order.set('recepientemail', str(order['recepientemail']))
-        request_order.set('phone', str(order['phone']))
-        address = ET.SubElement(request_order, 'address')
-        if order['address'].get('street'):
-            address.set('street', order['address'].get('street'))
-        if order['address'].get('house'):
-            address.set('house', str(order['address'].get('house')))
-        if order['address'].get('flat'):
-            address.set('flat', str(order['address'].get('flat')))
-        if order['address'].get('pvzcode'):
-            address.set('pvzcode', order['address'].get('pvzcode'))
-        package_number = 1
-        for order_package in order['packages']:
-            package = ET.SubElement(request_order, 'package')
-            package.set('number', str(package_number))
-            package.set('barcode', str(package_number))
-            package_number += 1
-            package.set('weight', str(order_package['weight']))
-            package.set('sizea', str(order_package['height']))
-            package.set('sizeb', str(order_package['width']))
-            package.set('sizec', str(order_package['length']))
-            for package_item in order_package['items']:
-                item = ET.SubElement(package, 'item')
-                item.set('amount', str(package_item['amount']))
-                item.set('warekey', package_item['warekey'])
-                item.set('cost', str(package_item['cost']))
-                item.set('payment', str(package_item['payment']))
-                item.set('weight', str(package_item['weight']))
-                item.set('comment', package_item['comment'])
-        data = ET.tostring(request, encoding='utf-8')
-        res = self.post_xml('new_order', xml_request=data)
-        root = ET.fromstring(res)
-        if root[0].get('ErrorCode'):
-            raise CdekAPIError(root[0].get('Msg'))
-        dispatch_number = root[0].get('DispatchNumber')
-        order_number = root[0].get('Number')
-        return order_number, dispatch_number
+        with self.instrumentation.span('new_order') as span:
+            with span.phase('build'):
+                if isinstance(order, Order):
+                    order.check()
+                data = self._order_xml(order)
+            res = self.post_xml('new_order', xml_request=data)
+            with span.phase('parse'):
+                return self._parse_new_order(res, span)
+
+    def _submit_orders(self, orders, number='1'):
+        """
+        Send one chunk of new_orders, errors are kept on the OrderResult
+        """
+        with self.instrumentation.span('new_orders', orders=len(orders)) as span:
+            results, valid, data = self._build_orders(orders, number, span)
+            res = error = None
+            if valid:
+                try:
+                    res = self.post_xml('new_order', xml_request=data)
+                except Exception as e:
+                    error = e
+            return self._chunk_results(orders, results, valid, res, error, span)
+
+    def new_orders(self, orders, chunk_size=50, max_concurrency=4):
+        """
+        Create many orders, packing up to chunk_size orders in one deliveryrequest
+        :param orders: list of orders, see new_order
+        :param chunk_size: orders per request
+        :param max_concurrency: parallel requests
+        :return: list of OrderResult in the orders order
+        """
+        orders = list(orders)
+        chunks = [orders[i:i + chunk_size] for i in range(0, len(orders), chunk_size)]
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = [executor.submit(self._bulk(self._submit_orders), chunk, str(i + 1))
+                       for i, chunk in enumerate(chunks)]
+            return [result for future in futures for result in future.result()]
 
     def check_orders_status(self, orders):
         """
@@ -349,24 +829,11 @@ class CdekApi:
                 order_number,
                 dispatch_number
             }
-        :return: list of orders with statuses
-        """
-        request = ET.Element('statusreport')
-        request.set('account', self.login)
-        request.set('secure', self.password)
-        request.set('date', str(datetime.date.today())),
-        for order in orders:
-            request_order = ET.SubElement(request, 'order')
-            request_order.set('number', str(order['order_number']))
-            request_order.set('dispatch_number', str(order['dispatch_number']))
-        data = ET.tostring(request, encoding='utf-8')
-        res = self.post_xml('status', xml_request=data)
-        root = ET.fromstring(res)
-        if root.get('ErrorCode'):
-            raise CdekAPIError(root.get('Msg'))
-        ET.dump(root)
-        for order in root:
-            print('ORDER', order.attrib['Number'], order.attrib['DispatchNumber'])
-            status = order.find('Status')
-            print('STATUS', status.attrib['Date'], status.attrib['Code'], status.attrib['Description'])
-        return root
\ No newline at end of file
+        :return: StatusReport element, see OrderStatus.from_element
+        """
+        with self.instrumentation.span('check_orders_status') as span:
+            with span.phase('build'):
+                data = self._status_xml(orders)
+            res = self.post_xml('status', xml_request=data)
+            with span.phase('parse'):
+                return self._parse_status(res, span)
@@ -0,0 +1,350 @@
+import asyncio
+import json
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+from cdekapi import BaseCdekApi
+from cdekapi.bulk import arun_bulk
+from cdekapi.cache import request_key
+from cdekapi.singleflight import AsyncSingleFlight
+from cdekapi.models import Quote, TariffQuote, Order
+from cdekapi.prepared import AsyncPreparedQuote
+
+
+class AsyncResponse:
+    """
+    Fully read response returned by AsyncHttpTransport
+    """
+    __slots__ = ('status_code', 'content', 'encoding')
+
+    def __init__(self, status_code, content, encoding='utf-8'):
+        self.status_code = status_code
+        self.content = content
+        self.encoding = encoding
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncHttpTransport:
+    """
+    Pooled keep-alive asyncio HTTP transport (aiohttp)
+    """
+    errors = (aiohttp.ClientError, asyncio.TimeoutError) if aiohttp else ()
+
+    def __init__(self, limit=100, limit_per_host=16, timeout=(5, 30), keep_alive=True):
+        """
+        Create the transport, the session is opened on the first request
+        :param limit: total number of open connections
+        :param limit_per_host: max connections per host
+        :param timeout: default (connect, read) timeout, seconds
+        :param keep_alive: reuse connections between calls
+        """
+        if aiohttp is None:
+            raise ImportError('AsyncHttpTransport requires aiohttp: pip install cdekapi[async]')
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.session = None
+
+    @staticmethod
+    def _client_timeout(timeout):
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        return aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+
+    def _session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit,
+                                             limit_per_host=self.limit_per_host,
+                                             force_close=not self.keep_alive)
+            self.session = aiohttp.ClientSession(connector=connector,
+                                                 timeout=self._client_timeout(self.timeout))
+        return self.session
+
+    async def request(self, http_method, url, timeout=None, **kwargs):
+        """
+        Send the request through the pool and read the whole body
+        :param http_method: GET/POST
+        :param url: full url
+        :param timeout: per-call timeout, defaults to the transport one
+        :param kwargs: aiohttp keyword arguments
+        :return: AsyncResponse
+        """
+        if timeout is not None:
+            kwargs['timeout'] = self._client_timeout(timeout)
+        async with self._session().request(http_method, url, **kwargs) as response:
+            content = await response.read()
+            return AsyncResponse(response.status, content, response.charset or 'utf-8')
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class AsyncCdekApi(BaseCdekApi):
+    """
+    asyncio client, payloads and results are the same as in CdekApi
+
+    best_tariff and iter_pvz are sync only, rank the calc_quotes results and use get_pvz_list instead.
+    """
+    prepared_quote_class = AsyncPreparedQuote
+
+    def __init__(self, login=None, password=None, test_mode=False, transport=None, cache=None,
+                 resilience=None, limiter=None, instrumentation=None, codec=None, pvz_cache=None,
+                 quantizer=None):
+        """
+        Create the api instance
+        :param login: cdek login
+        :param password: cdek password
+        :param transport: AsyncHttpTransport instance, a pooled one is created by default
+        :param cache: QuoteCache for calc_price/calc_prices, disabled by default
+        :param resilience: Resilience with timeouts, retries and circuit breakers
+        :param limiter: not supported, the RateLimiter blocks the calling thread
+        :param instrumentation: Instrumentation with span hooks, e.g. HistogramCollector
+        :param codec: JsonCodec or its name ('orjson', 'ujson', 'json'), the fastest installed one by default
+        :param pvz_cache: PvzDiskCache for get_pvz_list, disabled by default
+        :param quantizer: Quantizer rounding calc_price/calc_prices goods up to buckets, disabled by default
+        """
+        if limiter is not None:
+            raise ValueError('RateLimiter is not supported by AsyncCdekApi')
+        super().__init__(login, password, test_mode, transport or AsyncHttpTransport(), cache, resilience,
+                         instrumentation, codec, pvz_cache, quantizer)
+        self.singleflight = AsyncSingleFlight()
+
+    async def close(self):
+        await self.transport.close()
+
+    def __enter__(self):
+        raise TypeError('AsyncCdekApi is closed asynchronously, use async with')
+
+    def __exit__(self, *exc):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _request(self, http_method, method, query=None, **kwargs):
+        url = self.methods[method]
+        if query is not None:
+            url = f'{url}?{query}'
+        return await self.resilience.acall(method, self.transport.request, self.transport.errors,
+                                           http_method=http_method, url=url, **kwargs)
+
+    async def run(self, method, data):
+        """
+        Query the CDEK API (POST)
+        :param method:
+        :param data: json data
+        :return: json result
+        """
+        with self.instrumentation.span('run', method=method) as span:
+            body, headers = self._run_body(data, span)
+            with span.phase('upstream'):
+                response = await self._request('POST', method, data=body, headers=headers)
+                self._record_response(span, response)
+            return self._run_result(response, span)
+
+    async def _cached_run(self, method, data):
+        res = self._cache_lookup(method, data)
+        if res is not None:
+            return res
+        return await self.singleflight.do(request_key(method, data), self._cache_run, method, data)
+
+    async def _cache_run(self, method, data):
+        res = await self.run(method, data)
+        if self.cache is not None:
+            self.cache.set(method, data, res)
+        return res
+
+    async def get_xml(self, method, **kwargs):
+        """
+        Query the CDEK API (GET)
+        :param method:
+        :param kwargs: GET parameters
+        :return: xml result
+        """
+        with self.instrumentation.span('get_xml', method=method) as span:
+            with span.phase('upstream'):
+                response = await self._request('GET', method, query=self._query_string(kwargs))
+                self._record_response(span, response)
+            return self._get_xml_result(response)
+
+    async def post_xml(self, method, **kwargs):
+        """
+        Query the CDEK API (POST)
+        :param method:
+        :param kwargs: POST parameters
+        :return: xml result
+        """
+        with self.instrumentation.span('post_xml', method=method) as span:
+            # aiohttp would send bytes values as multipart file fields
+            data = self._post_xml_data(kwargs, span, decode_bytes=True)
+            with span.phase('upstream'):
+                response = await self._request('POST', method, data=data)
+                self._record_response(span, response)
+            return self._post_xml_result(response)
+
+    async def calc_price(self,
+                         sender_city_id,
+                         receiver_city_id,
+                         goods,
+                         date_execute=None,
+                         tariff_id=136,
+                         tariff_list=None,
+                         mode_id=None,
+                         currency='RUB',
+                         services=None,
+                         decimal_places=0,
+                         prefilter=False,
+                         delivery_type=None,
+                         quantize=None):
+        data, dropped = self._calc_request('calc_price', sender_city_id, receiver_city_id, goods, date_execute,
+                                           tariff_id, tariff_list, mode_id, currency, services, prefilter,
+                                           delivery_type, quantize)
+        res = await self._cached_run('calc_price', data) if data is not None else None
+        return self._calc_result('calc_price', res, decimal_places, dropped)
+
+    async def calc_prices(self,
+                          sender_city_id,
+                          receiver_city_id,
+                          goods,
+                          date_execute=None,
+                          tariff_id=136,
+                          tariff_list=None,
+                          mode_id=None,
+                          currency='RUB',
+                          services=None,
+                          decimal_places=0,
+                          prefilter=False,
+                          delivery_type=None,
+                          quantize=None):
+        data, dropped = self._calc_request('calc_prices', sender_city_id, receiver_city_id, goods, date_execute,
+                                           tariff_id, tariff_list, mode_id, currency, services, prefilter,
+                                           delivery_type, quantize)
+        res = await self._cached_run('calc_prices', data) if data is not None else None
+        return self._calc_result('calc_prices', res, decimal_places, dropped)
+
+    async def calc_quote(self, sender_city_id, receiver_city_id, goods, **kwargs):
+        kwargs.setdefault('decimal_places', 2)
+        res = await self.calc_price(sender_city_id, receiver_city_id, goods, **kwargs)
+        return Quote.from_json(res['result'])
+
+    async def calc_quotes(self, sender_city_id, receiver_city_id, goods, **kwargs):
+        kwargs.setdefault('decimal_places', 2)
+        res = await self.calc_prices(sender_city_id, receiver_city_id, goods, **kwargs)
+        return TariffQuote.list_from_json(res)
+
+    def calc_prices_bulk(self, specs, max_concurrency=8, progress=None, stats=None):
+        """
+        Run calc_prices for many routes concurrently
+            async for result in api.calc_prices_bulk(specs): ...
+        :return: async generator of BulkResult in completion order
+        """
+        return arun_bulk(self.calc_prices, specs, max_concurrency, progress, stats)
+
+    async def calc_price_num(self,
+                             sender_city_id,
+                             receiver_city_id,
+                             goods,
+                             date_execute=None,
+                             tariff_id=136,
+                             tariff_list=None,
+                             mode_id=None,
+                             currency='RUB',
+                             services=None):
+        res = await self.calc_price(sender_city_id,
+                                    receiver_city_id,
+                                    goods,
+                                    date_execute,
+                                    tariff_id,
+                                    tariff_list,
+                                    mode_id,
+                                    currency,
+                                    services)
+        return int(res['result']['price'])
+
+    async def get_pvz_list(self, city_id, np_allowed):
+        """
+        Get the list of pvz for a city
+        :param city_id: CDEK City Id
+        :param np_allowed: 1/0
+        :return: list of pvz dicts, latitude holds coordX and longitude coodrY, see Pvz for the real axes
+        """
+        key = ('pvz_list', city_id, np_allowed)
+        if self.pvz_cache is not None:
+            return await self.pvz_cache.aget(
+                key, lambda: self.singleflight.do(key, self._fetch_pvz_list, city_id, np_allowed))
+        return await self.singleflight.do(key, self._fetch_pvz_list, city_id, np_allowed)
+
+    async def _fetch_pvz_list(self, city_id, np_allowed):
+        with self.instrumentation.span('get_pvz_list') as span:
+            res = await self.get_xml('pvz_list', cityid=city_id, allowedcod=np_allowed)
+            with span.phase('parse'):
+                return self._parse_pvz_list(res)
+
+    async def new_order(self, order):
+        """
+        Create new order in cdek
+        :param order: see CdekApi.new_order
+        :return: order number, dispatch number
+        """
+        with self.instrumentation.span('new_order') as span:
+            with span.phase('build'):
+                if isinstance(order, Order):
+                    order.check()
+                data = self._order_xml(order)
+            res = await self.post_xml('new_order', xml_request=data)
+            with span.phase('parse'):
+                return self._parse_new_order(res, span)
+
+    async def _submit_orders(self, orders, number='1'):
+        with self.instrumentation.span('new_orders', orders=len(orders)) as span:
+            results, valid, data = self._build_orders(orders, number, span)
+            res = error = None
+            if valid:
+                try:
+                    res = await self.post_xml('new_order', xml_request=data)
+                except Exception as e:
+                    error = e
+            return self._chunk_results(orders, results, valid, res, error, span)
+
+    async def new_orders(self, orders, chunk_size=50, max_concurrency=4):
+        """
+        Create many orders, see CdekApi.new_orders
+        :return: list of OrderResult in the orders order
+        """
+        orders = list(orders)
+        chunks = [orders[i:i + chunk_size] for i in range(0, len(orders), chunk_size)]
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def submit(chunk, number):
+            async with semaphore:
+                return await self._submit_orders(chunk, number)
+
+        done = await asyncio.gather(*[submit(chunk, str(i + 1)) for i, chunk in enumerate(chunks)])
+        return [result for results in done for result in results]
+
+    async def check_orders_status(self, orders):
+        """
+        Check orders status
+        :param orders: see CdekApi.check_orders_status
+        :return: list of orders with statuses
+        """
+        with self.instrumentation.span('check_orders_status') as span:
+            with span.phase('build'):
+                data = self._status_xml(orders)
+            res = await self.post_xml('status', xml_request=data)
+            with span.phase('parse'):
+                return self._parse_status(res, span)
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class BulkResult:
+    """
+    Outcome of one spec of a bulk run: either result or error is set
+    """
+    __slots__ = ('spec', 'result', 'error')
+
+    def __init__(self, spec, result=None, error=None):
+        self.spec = spec
+        self.result = result
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return f'BulkResult(spec={self.spec!r}, ok={self.ok})'
+
+
+class BulkStats:
+    """
+    Progress and throughput counters of a bulk run
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.unique = 0
+        self.done = 0
+        self.errors = 0
+        self.started = time.monotonic()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def _complete(self, error):
+        with self._lock:
+            self.done += 1
+            if error is not None:
+                self.errors += 1
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rate(self):
+        """
+        Upstream calls per second
+        """
+        elapsed = self.elapsed
+        return self.done / elapsed if elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'total': self.total,
+            'unique': self.unique,
+            'done': self.done,
+            'errors': self.errors,
+            'elapsed': self.elapsed,
+            'rate': self.rate,
+        }
+
+
+def spec_key(spec):
+    return json.dumps(spec, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def _group(specs, stats):
+    groups = {}
+    for spec in specs:
+        stats.total += 1
+        groups.setdefault(spec_key(spec), []).append(spec)
+    stats.unique = len(groups)
+    return groups
+
+
+def run_bulk(call, specs, max_concurrency=8, progress=None, stats=None):
+    """
+    Run call(**spec) for each spec in a thread pool, yielding results as they complete
+    :param call: function called with the spec as keyword arguments
+    :param specs: iterable of dicts
+    :param max_concurrency: number of worker threads
+    :param progress: callback(stats) after every completed upstream call
+    :param stats: BulkStats to fill, a new one by default
+    :return: generator of BulkResult, duplicate specs share one call
+    """
+    stats = stats if stats is not None else BulkStats()
+    groups = _group(specs, stats)
+
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    futures = {}
+    try:
+        futures = {executor.submit(call, **same[0]): same for same in groups.values()}
+        for future in as_completed(futures):
+            error = future.exception()
+            result = None if error is not None else future.result()
+            stats._complete(error)
+            if progress:
+                progress(stats)
+            for spec in futures[future]:
+                yield BulkResult(spec, result, error)
+    finally:
+        # a consumer that stops early drops the calls not started yet, the running ones are waited for
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+        stats.finished = time.monotonic()
+
+
+async def arun_bulk(call, specs, max_concurrency=8, progress=None, stats=None):
+    """
+    run_bulk for a coroutine function, at most max_concurrency calls are awaited at once
+    :return: async generator of BulkResult, duplicate specs share one call
+    """
+    stats = stats if stats is not None else BulkStats()
+    groups = _group(specs, stats)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def one(same):
+        async with semaphore:
+            try:
+                return same, await call(**same[0]), None
+            except Exception as e:
+                return same, None, e
+
+    tasks = [asyncio.ensure_future(one(same)) for same in groups.values()]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            same, result, error = await next_done
+            stats._complete(error)
+            if progress:
+                progress(stats)
+            for spec in same:
+                yield BulkResult(spec, result, error)
+    finally:
+        # a consumer that stops early cancels the rest of the batch
+        for task in tasks:
+            task.cancel()
+        stats.finished = time.monotonic()
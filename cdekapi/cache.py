@@ -0,0 +1,184 @@
+import copy
+import datetime
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict
+
+
+def request_key(method, data, ignored_fields=('secure', 'authLogin')):
+    """
+    Canonical key of the request dict assembled for run()
+    :param method: key of CdekApi.methods
+    :param data: json data
+    :param ignored_fields: fields left out, the auth ones by default
+    :return: str
+    """
+    fields = {k: v for k, v in data.items() if k not in ignored_fields}
+    return method + ':' + json.dumps(fields, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+
+
+class CacheBackend(ABC):
+    """
+    Storage interface for QuoteCache, implement it for a shared store
+    """
+
+    @abstractmethod
+    def get(self, key):
+        """
+        :param key: str
+        :return: stored value or None if missing or expired
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def set(self, key, value, expires):
+        """
+        :param key: str
+        :param value: json-serializable value
+        :param expires: unix timestamp
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, key):
+        raise NotImplementedError
+
+    @abstractmethod
+    def clear(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def __len__(self):
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    """
+    In-process LRU dict with per-entry expiry
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires):
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class QuoteCache:
+    """
+    Opt-in cache for calc_price/calc_prices results
+    """
+    ignored_fields = ('secure', 'authLogin')
+
+    def __init__(self, backend=None, maxsize=10000, ttl=3600, rollover=True):
+        """
+        Create the cache
+        :param backend: CacheBackend, MemoryBackend(maxsize) by default
+        :param maxsize: LRU size of the default backend
+        :param ttl: entry lifetime, seconds
+        :param rollover: also expire entries at the next midnight, when the default dateExecute moves on
+        """
+        self.backend = backend if backend is not None else MemoryBackend(maxsize)
+        self.ttl = ttl
+        self.rollover = rollover
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.demand = Counter()
+        self._demand_lock = threading.Lock()
+
+    @classmethod
+    def key(cls, method, data):
+        return request_key(method, data, cls.ignored_fields)
+
+    def expires(self, now=None):
+        now = now or time.time()
+        expires = now + self.ttl
+        if self.rollover:
+            tomorrow = datetime.date.fromtimestamp(now) + datetime.timedelta(days=1)
+            midnight = time.mktime(tomorrow.timetuple())
+            expires = min(expires, midnight)
+        return expires
+
+    def get(self, method, data):
+        """
+        :return: copy of the cached result or None
+        """
+        key = self.key(method, data)
+        self._count(key)
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return copy.deepcopy(value)
+
+    def _count(self, key):
+        with self._demand_lock:
+            self.demand[key] += 1
+            if len(self.demand) > 2 * self.maxsize:
+                # forget the long tail, the hot keys keep their counts
+                self.demand = Counter(dict(self.demand.most_common(self.maxsize)))
+
+    def hot(self, limit=None):
+        """
+        Most requested keys, hits and misses alike
+        :param limit: number of keys, all by default
+        :return: list of (method, data, count)
+        """
+        with self._demand_lock:
+            demand = self.demand.most_common(limit)
+        res = []
+        for key, count in demand:
+            method, _, fields = key.partition(':')
+            res.append((method, json.loads(fields), count))
+        return res
+
+    def set(self, method, data, res):
+        self.backend.set(self.key(method, data), copy.deepcopy(res), self.expires())
+
+    def clear(self):
+        self.backend.clear()
+
+    @property
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': len(self.backend),
+        }
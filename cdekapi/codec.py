@@ -0,0 +1,105 @@
+import json
+from abc import ABC, abstractmethod
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+
+class JsonCodec(ABC):
+    """
+    Request/response JSON codec, encodes straight to utf-8 bytes
+    """
+    name = None
+
+    @abstractmethod
+    def dumps(self, data):
+        """
+        :param data: json data
+        :return: utf-8 bytes
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def loads(self, content):
+        """
+        :param content: bytes or str
+        :return: json data
+        """
+        raise NotImplementedError
+
+
+class StdlibCodec(JsonCodec):
+    name = 'json'
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+        self._decoder = json.JSONDecoder()
+
+    def dumps(self, data):
+        return self._encoder.encode(data).encode('utf-8')
+
+    def loads(self, content):
+        if isinstance(content, (bytes, bytearray)):
+            content = content.decode('utf-8')
+        return self._decoder.decode(content)
+
+
+class OrjsonCodec(JsonCodec):
+    name = 'orjson'
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError('OrjsonCodec requires orjson: pip install cdekapi[fast]')
+
+    def dumps(self, data):
+        return orjson.dumps(data)
+
+    def loads(self, content):
+        return orjson.loads(content)
+
+
+class UjsonCodec(JsonCodec):
+    name = 'ujson'
+
+    def __init__(self):
+        if ujson is None:
+            raise ImportError('UjsonCodec requires ujson: pip install ujson')
+
+    def dumps(self, data):
+        return ujson.dumps(data, ensure_ascii=False).encode('utf-8')
+
+    def loads(self, content):
+        return ujson.loads(content)
+
+
+# in order of preference
+CODECS = {
+    'orjson': (OrjsonCodec, orjson),
+    'ujson': (UjsonCodec, ujson),
+    'json': (StdlibCodec, json),
+}
+
+
+def available_codecs():
+    return [name for name, (_, module) in CODECS.items() if module is not None]
+
+
+def get_codec(codec=None):
+    """
+    :param codec: JsonCodec instance, a CODECS name or None for the fastest installed one
+    :return: JsonCodec
+    """
+    if isinstance(codec, JsonCodec):
+        return codec
+    if codec is None:
+        codec = available_codecs()[0]
+    if codec not in CODECS:
+        raise ValueError(f'Unknown JSON codec {codec!r}, choose one of {", ".join(CODECS)}')
+    return CODECS[codec][0]()
@@ -0,0 +1,246 @@
+import asyncio
+import mmap
+import os
+import re
+import tempfile
+import threading
+import time
+import zlib
+
+from cdekapi.codec import get_codec
+
+MAGIC = b'CDEKPVZ1'
+
+FRESH = 'fresh'
+STALE = 'stale'
+EXPIRED = 'expired'
+
+
+class PvzDiskCache:
+    """
+    Cross-process on-disk cache of parsed pvz_list responses
+
+    Every key is a file holding the zlib compressed snapshot of the parsed list, its mtime is the fetch time.
+    Stale snapshots are served while one process refreshes them in the background.
+    """
+
+    def __init__(self, directory, max_age=86400, stale_ttl=7 * 86400, stale_if_error=True, lock_timeout=300,
+                 codec=None, level=6):
+        """
+        Create the cache
+        :param directory: cache directory, shared by the worker processes
+        :param max_age: seconds a snapshot is fresh
+        :param stale_ttl: seconds a snapshot is served while being refreshed, after that callers wait for CDEK
+        :param stale_if_error: serve any snapshot if the download fails
+        :param lock_timeout: seconds after which the refresh lock of a dead process is broken
+        :param codec: JsonCodec or its name
+        :param level: zlib compression level
+        """
+        self.directory = directory
+        self.max_age = max_age
+        self.stale_ttl = stale_ttl
+        self.stale_if_error = stale_if_error
+        self.lock_timeout = lock_timeout
+        self.codec = get_codec(codec)
+        self.level = level
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+        self._memory = {}
+        self._refreshing = set()
+        self._tasks = set()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        name = '-'.join(re.sub(r'[^\w.]', '_', str(part)) for part in key)
+        return os.path.join(self.directory, f'{name}.pvz')
+
+    def load(self, key):
+        """
+        :return: (fetch time, data) or None
+        """
+        path = self.path(key)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+        memo = self._memory.get(key)
+        if memo is not None and memo[0] == mtime:
+            return memo
+        try:
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm[:len(MAGIC)] != MAGIC:
+                    return None
+                with memoryview(mm) as view:
+                    payload = zlib.decompress(view[len(MAGIC):])
+        except (OSError, ValueError, zlib.error):
+            return None
+        memo = self._memory[key] = (mtime, self.codec.loads(payload))
+        return memo
+
+    def store(self, key, data):
+        """
+        Write the snapshot atomically, an unchanged snapshot only gets its fetch time updated
+        """
+        path = self.path(key)
+        payload = self.codec.dumps(data)
+        memo = self._memory.get(key)
+        if memo is not None and self.codec.dumps(memo[1]) == payload and os.path.exists(path):
+            os.utime(path)
+        else:
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(MAGIC)
+                    f.write(zlib.compress(payload, self.level))
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        self._memory[key] = (os.stat(path).st_mtime, data)
+
+    def state(self, entry, now=None):
+        if entry is None:
+            return EXPIRED
+        age = (now or time.time()) - entry[0]
+        if age < self.max_age:
+            return FRESH
+        if age < self.stale_ttl:
+            return STALE
+        return EXPIRED
+
+    def acquire(self, key):
+        """
+        Take the refresh lock of the key, shared with the other processes
+        :return: True if this process should refresh it
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            lock = self.path(key) + '.lock'
+            try:
+                fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    if time.time() - os.stat(lock).st_mtime < self.lock_timeout:
+                        return False
+                    # the process holding it died
+                    os.unlink(lock)
+                    fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                except OSError:
+                    return False
+            os.close(fd)
+            self._refreshing.add(key)
+            return True
+
+    def release(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+            try:
+                os.unlink(self.path(key) + '.lock')
+            except FileNotFoundError:
+                pass
+
+    def refresh(self, key, fetch):
+        """
+        Download and store the key, the caller holds its lock
+        :param fetch: function returning the parsed list
+        """
+        try:
+            data = fetch()
+            self.store(key, data)
+            self.refreshes += 1
+            return data
+        finally:
+            self.release(key)
+
+    def _background(self, key, fetch):
+        try:
+            self.refresh(key, fetch)
+        except Exception:
+            self.errors += 1
+
+    def _copy(self, data):
+        return [dict(pvz) for pvz in data]
+
+    def get(self, key, fetch):
+        """
+        :param key: tuple of the query parameters
+        :param fetch: function downloading and parsing the list
+        :return: list of pvz dicts
+        """
+        entry = self.load(key)
+        state = self.state(entry)
+        if state == STALE and self.acquire(key):
+            threading.Thread(target=self._background, args=(key, fetch), name='cdek-pvz-cache', daemon=True).start()
+        if state != EXPIRED:
+            self.hits += 1
+            return self._copy(entry[1])
+        self.misses += 1
+        locked = self.acquire(key)
+        try:
+            if locked:
+                return self._copy(self.refresh(key, fetch))
+            return fetch()
+        except Exception:
+            self.errors += 1
+            if entry is None or not self.stale_if_error:
+                raise
+            return self._copy(entry[1])
+
+    async def arefresh(self, key, fetch):
+        """
+        refresh() for a coroutine function
+        """
+        try:
+            data = await fetch()
+            await asyncio.get_running_loop().run_in_executor(None, self.store, key, data)
+            self.refreshes += 1
+            return data
+        finally:
+            self.release(key)
+
+    async def _abackground(self, key, fetch):
+        try:
+            await self.arefresh(key, fetch)
+        except Exception:
+            self.errors += 1
+
+    async def aget(self, key, fetch):
+        """
+        get() for a coroutine function, the background refresh runs as a task of the running loop,
+        the snapshot is read and written in the default executor
+        """
+        entry = await asyncio.get_running_loop().run_in_executor(None, self.load, key)
+        state = self.state(entry)
+        if state == STALE and self.acquire(key):
+            task = asyncio.create_task(self._abackground(key, fetch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if state != EXPIRED:
+            self.hits += 1
+            return self._copy(entry[1])
+        self.misses += 1
+        locked = self.acquire(key)
+        try:
+            if locked:
+                return self._copy(await self.arefresh(key, fetch))
+            return await fetch()
+        except Exception:
+            self.errors += 1
+            if entry is None or not self.stale_if_error:
+                raise
+            return self._copy(entry[1])
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            for name in os.listdir(self.directory):
+                if name.endswith('.pvz'):
+                    os.unlink(os.path.join(self.directory, name))
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'refreshes': self.refreshes, 'errors': self.errors}
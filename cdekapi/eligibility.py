@@ -0,0 +1,115 @@
+from bisect import bisect_left
+
+from cdekapi import calc_dictionaries
+
+# receiver side of calc_dictionaries.delivery_types
+DOOR = frozenset((1, 3))
+WAREHOUSE = frozenset((2, 4))
+
+VOLUME_DIVISOR = 5000
+
+# calculator code of a route the tariffs can not deliver on
+NO_DELIVERY_CODES = frozenset((3, '3'))
+
+
+def _build_indexes(tariffs):
+    by_delivery_type = {}
+    by_weight_band = {}
+    for tariff_id, tariff in tariffs.items():
+        by_delivery_type.setdefault(tariff['delivery type'], set()).add(tariff_id)
+        by_weight_band.setdefault(tariff['weight restriction'], set()).add(tariff_id)
+    return ({key: frozenset(ids) for key, ids in by_delivery_type.items()},
+            {key: frozenset(ids) for key, ids in by_weight_band.items()})
+
+
+tariffs_by_delivery_type, tariffs_by_weight_band = _build_indexes(calc_dictionaries.tariffs)
+weight_bands = sorted(tariffs_by_weight_band)
+
+
+def tariffs_for_weight(weight):
+    """
+    :param weight: kg
+    :return: set of tariff ids whose weight restriction allows the weight
+    """
+    res = set()
+    for band in weight_bands[bisect_left(weight_bands, weight):]:
+        res |= tariffs_by_weight_band[band]
+    return res
+
+
+def goods_weight(goods, volume_divisor=VOLUME_DIVISOR):
+    """
+    Total physical and volumetric weight of the calculator goods
+    :param goods: list of {weight, length, width, height} (kg, cm) or {weight, volume} (m3)
+    :param volume_divisor: cm3 per volumetric kg
+    :return: (physical kg, volumetric kg)
+    """
+    physical = 0.0
+    volumetric = 0.0
+    for place in goods:
+        physical += float(place.get('weight') or 0)
+        if place.get('volume'):
+            volumetric += float(place['volume']) * 1000000 / volume_divisor
+        else:
+            volumetric += (float(place.get('length') or 0) * float(place.get('width') or 0)
+                           * float(place.get('height') or 0) / volume_divisor)
+    return physical, volumetric
+
+
+def _delivery_types(delivery_type):
+    if delivery_type is None:
+        return None
+    if isinstance(delivery_type, int):
+        return frozenset((delivery_type,))
+    return frozenset(delivery_type)
+
+
+def filter_tariffs(tariff_list, goods, delivery_type=None, use_volumetric=False):
+    """
+    Drop tariffs that can not be applied before asking the calculator
+    :param tariff_list: list of {'id': ..} as passed to calc_prices
+    :param goods: calculator goods
+    :param delivery_type: id of calc_dictionaries.delivery_types, a set of them, DOOR or WAREHOUSE
+    :param use_volumetric: compare the weight limit with max(physical, volumetric) instead of physical weight
+    :return: (kept tariff_list, {tariff id: reason})
+    """
+    physical, volumetric = goods_weight(goods)
+    weight = max(physical, volumetric) if use_volumetric else physical
+    allowed_weight = tariffs_for_weight(weight)
+    types = _delivery_types(delivery_type)
+    allowed_type = None
+    if types is not None:
+        allowed_type = set().union(*(tariffs_by_delivery_type.get(t, ()) for t in types))
+    kept = []
+    dropped = {}
+    for tariff in tariff_list:
+        tariff_id = int(tariff['id'])
+        info = calc_dictionaries.tariffs.get(tariff_id)
+        if info is None:
+            # unknown tariffs are left for the calculator to decide
+            kept.append(tariff)
+        elif tariff_id not in allowed_weight:
+            dropped[tariff_id] = f"weight {weight:g} kg exceeds the {info['weight restriction']:g} kg restriction"
+        elif allowed_type is not None and tariff_id not in allowed_type:
+            dropped[tariff_id] = (f"delivery type {calc_dictionaries.delivery_types[info['delivery type']]} "
+                                  f"does not match")
+        else:
+            kept.append(tariff)
+    return kept, dropped
+
+
+def dropped_results(dropped):
+    """
+    calc_prices 'result' entries for the dropped tariffs, same shape as a calculator refusal (code 3)
+    """
+    return [{'status': False, 'tariffId': tariff_id, 'prefiltered': True,
+             'result': {'errors': {'code': 3, 'message': reason}}}
+            for tariff_id, reason in dropped.items()]
+
+
+def is_no_delivery(error):
+    """
+    True if the calculator refused because no requested tariff delivers on the route
+    :param error: CdekAPIError
+    """
+    return error.code in NO_DELIVERY_CODES
@@ -0,0 +1,50 @@
+class CdekAPIException(Exception):
+    pass
+
+
+class CdekAPIError(CdekAPIException):
+
+    def __init__(self, *args, code=None):
+        super().__init__(*args)
+        self._code = code
+
+    @property
+    def code(self):
+        """
+        Calculator error code or ErrorCode of the XML response, None if unknown
+        """
+        if self._code is None and self.args and isinstance(self.args[0], dict):
+            errors = self.args[0].get('error')
+            if isinstance(errors, list) and errors and isinstance(errors[0], dict):
+                return errors[0].get('code')
+        return self._code
+
+
+class CdekAPIValidationError(CdekAPIError):
+    """
+    The request was rejected locally, problems lists everything that is wrong with it
+    """
+
+    def __init__(self, problems):
+        super().__init__('; '.join(problems))
+        self.problems = problems
+
+
+class CdekAPIConnectionError(CdekAPIException):
+
+    def __init__(self, *args, status_code=None):
+        super().__init__(*args)
+        self._status_code = status_code
+
+    @property
+    def status_code(self):
+        """
+        HTTP status of the failed response, None if no response was received
+        """
+        if self._status_code is None and self.args:
+            return getattr(self.args[0], 'status_code', None)
+        return self._status_code
+
+
+class CircuitOpenError(CdekAPIConnectionError):
+    pass
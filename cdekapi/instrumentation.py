@@ -0,0 +1,223 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from cdekapi import calc_dictionaries
+
+
+class Span:
+    """
+    One timed operation with per-phase timings and attributes
+    """
+    __slots__ = ('name', 'attributes', 'phases', 'start', 'end', 'error')
+
+    def __init__(self, name, attributes=None):
+        self.name = name
+        self.attributes = attributes or {}
+        self.phases = {}
+        self.start = time.perf_counter()
+        self.end = None
+        self.error = None
+
+    @property
+    def duration(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def set_error_code(self, code, text=None):
+        """
+        Record a CDEK error code, calculator codes are described with calc_dictionaries.errors
+        """
+        self.attributes['error_code'] = code
+        if text is None:
+            try:
+                text = calc_dictionaries.errors.get(int(code))
+            except (TypeError, ValueError):
+                pass
+        if text is not None:
+            self.attributes['error_text'] = text
+
+    def add_phase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, key, value):
+        pass
+
+    def set_error_code(self, code, text=None):
+        pass
+
+    def add_phase(self, name, seconds):
+        pass
+
+    def phase(self, name):
+        return nullcontext()
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Hook:
+    """
+    Instrumentation callbacks, override the ones you need
+    """
+
+    def on_start(self, span):
+        pass
+
+    def on_end(self, span):
+        pass
+
+    def on_event(self, name, attributes):
+        pass
+
+
+class Instrumentation:
+    """
+    Creates spans and passes them to the hooks, costs nothing without hooks
+    """
+
+    def __init__(self, hooks=()):
+        self.hooks = list(hooks)
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+        return hook
+
+    @contextmanager
+    def _span(self, name, attributes):
+        span = Span(name, attributes)
+        for hook in self.hooks:
+            hook.on_start(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = e
+            raise
+        finally:
+            span.end = time.perf_counter()
+            for hook in self.hooks:
+                hook.on_end(span)
+
+    def span(self, name, **attributes):
+        """
+        :param name: operation name
+        :param attributes: initial attributes
+        :return: context manager yielding the Span
+        """
+        if not self.hooks:
+            return nullcontext(NOOP_SPAN)
+        return self._span(name, attributes)
+
+    def event(self, name, **attributes):
+        for hook in self.hooks:
+            hook.on_event(name, attributes)
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q quantile
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts)),
+        }
+
+
+class HistogramCollector(Hook):
+    """
+    In-memory latency/size histograms and counters, read them with snapshot()
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def _histogram(self, key):
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(self.buckets)
+        return histogram
+
+    def _count(self, key):
+        self.counters[key] = self.counters.get(key, 0) + 1
+
+    def on_end(self, span):
+        attributes = span.attributes
+        # run, get_xml and post_xml serve every endpoint, they are split by method
+        name = (span.name, attributes['method']) if attributes.get('method') else (span.name,)
+        with self._lock:
+            self._histogram(name + ('total',)).observe(span.duration)
+            for phase, seconds in span.phases.items():
+                self._histogram(name + (phase,)).observe(seconds)
+            if 'status_code' in attributes:
+                self._count(name + ('status', attributes['status_code']))
+            if 'error_code' in attributes:
+                self._count(name + ('error_code', attributes['error_code']))
+            if span.error is not None:
+                self._count(name + ('exception', type(span.error).__name__))
+            for size in ('request_bytes', 'response_bytes'):
+                if size in attributes:
+                    self._count(name + (size,))
+                    self.counters[name + (size, 'sum')] = (
+                        self.counters.get(name + (size, 'sum'), 0) + attributes[size])
+
+    def on_event(self, name, attributes):
+        with self._lock:
+            self._count((name,) + tuple(f'{k}={v}' for k, v in sorted(attributes.items())))
+
+    def snapshot(self):
+        """
+        :return: {'histograms': {'span.method.phase': {...}}, 'counters': {'key.parts': n}},
+            e.g. 'run.calc_price.upstream', spans without a method have no method part
+        """
+        with self._lock:
+            return {
+                'histograms': {'.'.join(key): h.as_dict() for key, h in self.histograms.items()},
+                'counters': {'.'.join(map(str, key)): n for key, n in self.counters.items()},
+            }
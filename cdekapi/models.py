@@ -0,0 +1,513 @@
+import math
+from collections.abc import Mapping
+
+from cdekapi import calc_dictionaries
+from cdekapi.exceptions import CdekAPIValidationError
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Record(Mapping):
+    """
+    Compact record with a read-only dict view under the CDEK field names
+    """
+    __slots__ = ()
+    fields = {}
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, self.fields[key])
+        except KeyError:
+            raise KeyError(key) from None
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def as_dict(self):
+        return {key: getattr(self, name) for key, name in self.fields.items()}
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.as_dict()!r})'
+
+
+class Quote(Record):
+    """
+    calc_price result
+    """
+    __slots__ = ('price', 'period_min', 'period_max', 'date_min', 'date_max',
+                 'tariff_id', 'price_by_currency', 'currency', 'services')
+    fields = {
+        'price': 'price',
+        'deliveryPeriodMin': 'period_min',
+        'deliveryPeriodMax': 'period_max',
+        'deliveryDateMin': 'date_min',
+        'deliveryDateMax': 'date_max',
+        'tariffId': 'tariff_id',
+        'priceByCurrency': 'price_by_currency',
+        'currency': 'currency',
+        'services': 'services',
+    }
+
+    def __init__(self, price=None, period_min=None, period_max=None, date_min=None, date_max=None,
+                 tariff_id=None, price_by_currency=None, currency=None, services=None):
+        self.price = price
+        self.period_min = period_min
+        self.period_max = period_max
+        self.date_min = date_min
+        self.date_max = date_max
+        self.tariff_id = tariff_id
+        self.price_by_currency = price_by_currency
+        self.currency = currency
+        self.services = services
+
+    @classmethod
+    def from_json(cls, result):
+        """
+        :param result: 'result' object of the calculator response
+        :return: Quote
+        """
+        get = result.get
+        return cls(_float(get('price')), _int(get('deliveryPeriodMin')), _int(get('deliveryPeriodMax')),
+                   get('deliveryDateMin'), get('deliveryDateMax'), _int(get('tariffId')),
+                   _float(get('priceByCurrency')), get('currency'), get('services'))
+
+
+class TariffQuote(Quote):
+    """
+    One calc_prices entry, price fields are None if the tariff is not available
+    """
+    __slots__ = ('status', 'error_code', 'error_message')
+    fields = dict(Quote.fields, status='status', errorCode='error_code', errorMessage='error_message')
+
+    def __init__(self, tariff_id=None, status=False, error_code=None, error_message=None, **kwargs):
+        super().__init__(tariff_id=tariff_id, **kwargs)
+        self.status = status
+        self.error_code = error_code
+        self.error_message = error_message
+
+    @classmethod
+    def from_json(cls, entry):
+        """
+        :param entry: item of the calc_prices 'result' list
+        :return: TariffQuote
+        """
+        result = entry.get('result') or {}
+        if entry.get('status'):
+            quote = Quote.from_json(result)
+            kwargs = {name: getattr(quote, name) for name in Quote.__slots__ if name != 'tariff_id'}
+            return cls(_int(entry.get('tariffId')), True, **kwargs)
+        errors = result.get('errors') or {}
+        if isinstance(errors, list):
+            errors = errors[0] if errors else {}
+        return cls(_int(entry.get('tariffId')), False, _int(errors.get('code')),
+                   errors.get('message') or errors.get('text'))
+
+    @classmethod
+    def list_from_json(cls, res):
+        """
+        :param res: calc_prices response
+        :return: list of TariffQuote
+        """
+        return [cls.from_json(entry) for entry in res['result']]
+
+
+class Pvz(Record):
+    """
+    Pickup point, latitude and longitude in degrees
+
+    Unlike the get_pvz_list dicts, latitude is coodrY and longitude coordX, np_allowed is a bool and city_id is
+    added, as_pvz_dict gives the get_pvz_list dict.
+    """
+    __slots__ = ('id', 'city_id', 'name', 'city', 'address', 'comment', 'note', 'phone',
+                 'latitude', 'longitude', 'type', 'np_allowed')
+    fields = {name: name for name in __slots__}
+
+    def __init__(self, id=None, city_id=None, name=None, city=None, address=None, comment=None,
+                 note=None, phone=None, latitude=None, longitude=None, type=None, np_allowed=None):
+        self.id = id
+        self.city_id = city_id
+        self.name = name
+        self.city = city
+        self.address = address
+        self.comment = comment
+        self.note = note
+        self.phone = phone
+        self.latitude = latitude
+        self.longitude = longitude
+        self.type = type
+        self.np_allowed = np_allowed
+
+    @classmethod
+    def from_attrib(cls, attrib):
+        """
+        :param attrib: attributes of a <Pvz> element
+        :return: Pvz
+        """
+        get = attrib.get
+        return cls(get('Code'), _int(get('CityCode')), get('Name'), get('City'), get('Address'),
+                   get('AddressComment'), get('Note'), get('Phone'), _float(get('coodrY')),
+                   _float(get('coordX')), get('Type'), get('AllowedCod') == '1')
+
+    def as_pvz_dict(self):
+        """
+        The get_pvz_list dict of the point: latitude holds coordX and longitude coodrY, np_allowed is '1'/'0'
+        and the coordinates are strings, formatted by str()
+        """
+        return {
+            'id': self.id,
+            'name': self.name,
+            'city': self.city,
+            'address': self.address,
+            'comment': self.comment,
+            'note': self.note,
+            'phone': self.phone,
+            'latitude': None if self.longitude is None else str(self.longitude),
+            'longitude': None if self.latitude is None else str(self.latitude),
+            'type': self.type,
+            'np_allowed': '1' if self.np_allowed else '0',
+        }
+
+
+class _OrderRecord(Record):
+    """
+    Record of the new_order dict, fields set to None read as missing keys
+    """
+    __slots__ = ()
+    required = ()
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return (key for key, name in self.fields.items() if getattr(self, name) is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data.get(key) for key, name in cls.fields.items()})
+
+    def _missing(self, problems, path):
+        for name in self.required:
+            value = getattr(self, name)
+            if value is None or value == '':
+                problems.append(f'{path}{name}: required')
+
+
+def _is_str(value):
+    return value is None or isinstance(value, str)
+
+
+def _number(problems, path, value, minimum=0, integer=False):
+    """
+    Check that value is a number >= minimum, None is reported by the required check
+    :return: float value or None
+    """
+    if value is None:
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        problems.append(f'{path}: {value!r} is not a number')
+        return None
+    if not math.isfinite(number):
+        problems.append(f'{path}: {value!r} is not a finite number')
+        return None
+    if integer and number != int(number):
+        problems.append(f'{path}: {value!r} is not an integer')
+    elif number < minimum:
+        problems.append(f'{path}: {value!r} is less than {minimum}')
+    return number
+
+
+def _record(cls, data):
+    """
+    :return: cls record of a mapping, anything else as it is for problems() to report
+    """
+    if isinstance(data, Mapping) and not isinstance(data, cls):
+        return cls.from_dict(data)
+    return data
+
+
+def _check(record, cls, problems, path):
+    """
+    Check a nested record
+    :return: its weight, grams, 0 if it is not a cls
+    """
+    if not isinstance(record, cls):
+        problems.append(f'{path}: must be a mapping')
+        return 0
+    return record._check(problems, path + '.')
+
+
+class Item(_OrderRecord):
+    """
+    Package item, weight in grams per unit
+    """
+    __slots__ = ('amount', 'warekey', 'cost', 'payment', 'weight', 'comment')
+    fields = {name: name for name in __slots__}
+    required = __slots__[:-1]
+
+    def __init__(self, amount=None, warekey=None, cost=None, payment=None, weight=None, comment=''):
+        self.amount = amount
+        self.warekey = warekey
+        self.cost = cost
+        self.payment = payment
+        self.weight = weight
+        self.comment = comment
+
+    def _check(self, problems, path):
+        """
+        :return: weight of all units, grams
+        """
+        self._missing(problems, path)
+        amount = _number(problems, path + 'amount', self.amount, 1, integer=True)
+        weight = _number(problems, path + 'weight', self.weight, 0)
+        _number(problems, path + 'cost', self.cost)
+        _number(problems, path + 'payment', self.payment)
+        for name in ('warekey', 'comment'):
+            if not _is_str(getattr(self, name)):
+                problems.append(f'{path}{name}: must be a string')
+        if self.comment is None:
+            problems.append(f'{path}comment: required')
+        return (amount or 0) * (weight or 0)
+
+
+class Package(_OrderRecord):
+    """
+    Order package, weight in grams, sizes in cm
+    """
+    __slots__ = ('weight', 'length', 'width', 'height', 'items')
+    fields = {name: name for name in __slots__}
+    required = ('weight', 'length', 'width', 'height')
+
+    def __init__(self, weight=None, length=None, width=None, height=None, items=()):
+        self.weight = weight
+        self.length = length
+        self.width = width
+        self.height = height
+        self.items = list(items)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('weight'), data.get('length'), data.get('width'), data.get('height'),
+                   [_record(Item, item) for item in data.get('items') or ()])
+
+    def _check(self, problems, path):
+        """
+        :return: package weight, grams
+        """
+        self._missing(problems, path)
+        weight = _number(problems, path + 'weight', self.weight, 1)
+        for name in ('length', 'width', 'height'):
+            _number(problems, path + name, getattr(self, name), 1)
+        items_weight = sum(_check(item, Item, problems, f'{path}items[{i}]') for i, item in enumerate(self.items))
+        if weight is not None and items_weight > weight:
+            problems.append(f'{path}weight: {self.weight} g is less than the {items_weight:g} g of its items')
+        return weight or 0
+
+
+class Address(_OrderRecord):
+    """
+    Delivery address: street and house (flat is optional) or the pvzcode of a pickup point
+    """
+    __slots__ = ('street', 'house', 'flat', 'pvzcode')
+    fields = {name: name for name in __slots__}
+
+    def __init__(self, street=None, house=None, flat=None, pvzcode=None):
+        self.street = street
+        self.house = house
+        self.flat = flat
+        self.pvzcode = pvzcode
+
+    def _check(self, problems, path):
+        if not self.pvzcode and not (self.street and self.house):
+            problems.append(f'{path}: street and house or pvzcode required')
+        for name in ('street', 'pvzcode'):
+            if not _is_str(getattr(self, name)):
+                problems.append(f'{path}.{name}: must be a string')
+
+
+class Order(_OrderRecord):
+    """
+    new_order order, validated in one pass with problems() before anything is sent
+    """
+    __slots__ = ('number', 'sender_city', 'receiver_city', 'tarifftypecode', 'deliveryrecipientcost',
+                 'recipientname', 'recepientemail', 'phone', 'address', 'packages', 'date')
+    fields = {name: name for name in __slots__}
+    required = __slots__[:-3]
+
+    def __init__(self, number=None, sender_city=None, receiver_city=None, tarifftypecode=None,
+                 deliveryrecipientcost=None, recipientname=None, recepientemail=None, phone=None,
+                 address=None, packages=(), date=None):
+        self.number = number
+        self.sender_city = sender_city
+        self.receiver_city = receiver_city
+        self.tarifftypecode = tarifftypecode
+        self.deliveryrecipientcost = deliveryrecipientcost
+        self.recipientname = recipientname
+        self.recepientemail = recepientemail
+        self.phone = phone
+        self.address = address
+        self.packages = list(packages)
+        self.date = date
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        :param data: new_order dict, missing fields are reported by problems()
+        :return: Order
+        """
+        address = data.get('address')
+        if isinstance(address, Mapping) and not isinstance(address, Address):
+            address = Address.from_dict(address)
+        packages = [_record(Package, package) for package in data.get('packages') or ()]
+        return cls(**dict({name: data.get(name) for name in cls.__slots__}, address=address, packages=packages))
+
+    def problems(self):
+        """
+        :return: list of everything that is wrong with the order, empty if it is valid
+        """
+        problems = []
+        self._missing(problems, '')
+        _number(problems, 'sender_city', self.sender_city, 1, integer=True)
+        _number(problems, 'receiver_city', self.receiver_city, 1, integer=True)
+        _number(problems, 'deliveryrecipientcost', self.deliveryrecipientcost)
+        tariff_id = _number(problems, 'tarifftypecode', self.tarifftypecode, 1, integer=True)
+        if self.address is None:
+            problems.append('address: required')
+        elif not isinstance(self.address, Address):
+            problems.append('address: must be an Address')
+        else:
+            self.address._check(problems, 'address')
+        if not self.packages:
+            problems.append('packages: at least one package required')
+        weight = sum(_check(package, Package, problems, f'packages[{i}]') for i, package in enumerate(self.packages))
+        tariff = calc_dictionaries.tariffs.get(int(tariff_id)) if tariff_id is not None else None
+        if tariff is not None and weight / 1000 > tariff['weight restriction']:
+            problems.append(f"tarifftypecode: {weight / 1000:g} kg exceeds the {tariff['weight restriction']:g} kg "
+                            f"restriction of tariff {int(tariff_id)}")
+        return problems
+
+    def check(self):
+        """
+        :raise CdekAPIValidationError: with all the problems if the order is not valid
+        :return: self
+        """
+        problems = self.problems()
+        if problems:
+            raise CdekAPIValidationError(problems)
+        return self
+
+
+class OrderResult:
+    """
+    Outcome of one order of new_orders, request_error is True if the error concerns the whole request,
+    e.g. ERR_AUTH, and not the order itself, error is the exception of a request that failed
+    """
+    __slots__ = ('order', 'dispatch_number', 'error_code', 'msg', 'request_error', 'error')
+
+    def __init__(self, order, dispatch_number=None, error_code=None, msg=None, request_error=False, error=None):
+        self.order = order
+        self.dispatch_number = dispatch_number
+        self.error_code = error_code
+        self.msg = msg
+        self.request_error = request_error
+        self.error = error
+
+    @property
+    def number(self):
+        return str(self.order['number'])
+
+    @property
+    def ok(self):
+        return self.dispatch_number is not None and self.error_code is None
+
+    def __repr__(self):
+        return (f'OrderResult(number={self.number!r}, dispatch_number={self.dispatch_number!r}, '
+                f'error_code={self.error_code!r}, msg={self.msg!r})')
+
+
+class OrderStatus:
+    """
+    Current status of an order from status_report_h.php
+    """
+    __slots__ = ('number', 'dispatch_number', 'code', 'description', 'date', 'city_code', 'city_name')
+
+    def __init__(self, number=None, dispatch_number=None, code=None, description=None, date=None,
+                 city_code=None, city_name=None):
+        self.number = number
+        self.dispatch_number = dispatch_number
+        self.code = code
+        self.description = description
+        self.date = date
+        self.city_code = city_code
+        self.city_name = city_name
+
+    @classmethod
+    def from_element(cls, order):
+        """
+        :param order: <Order> element of the status report
+        :return: OrderStatus
+        """
+        status = order.find('Status')
+        get = status.get if status is not None else {}.get
+        return cls(order.get('Number'), order.get('DispatchNumber'), _int(get('Code')),
+                   get('Description'), get('Date'), _int(get('CityCode')), get('CityName'))
+
+    def __eq__(self, other):
+        if not isinstance(other, OrderStatus):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return (f'OrderStatus(dispatch_number={self.dispatch_number!r}, code={self.code!r}, '
+                f'description={self.description!r}, date={self.date!r})')
+
+
+class Ranking:
+    """
+    Available tariffs of a route sorted by an objective, best first
+    """
+    __slots__ = ('quotes', 'objective', 'fetched', 'provisional')
+
+    def __init__(self, quotes, objective, fetched, provisional=False):
+        self.quotes = quotes
+        self.objective = objective
+        self.fetched = fetched
+        self.provisional = provisional
+
+    @property
+    def best(self):
+        return self.quotes[0] if self.quotes else None
+
+    def __iter__(self):
+        return iter(self.quotes)
+
+    def __len__(self):
+        return len(self.quotes)
+
+    def __getitem__(self, index):
+        return self.quotes[index]
+
+    def __repr__(self):
+        return f'Ranking(objective={self.objective!r}, best={self.best!r}, provisional={self.provisional!r})'
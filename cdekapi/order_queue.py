@@ -0,0 +1,356 @@
+import itertools
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+from cdekapi.exceptions import CdekAPIError, CircuitOpenError
+from cdekapi.models import Order
+
+PENDING = 'pending'
+SENDING = 'sending'
+UNCERTAIN = 'uncertain'
+SENT = 'sent'
+FAILED = 'failed'
+
+# ErrorCode of a StatusReport when none of the looked up orders exist, or of an Order element CDEK does not have
+NOT_FOUND_ERRORS = frozenset(('ERR_ORDERS_NOT_FOUND', 'ERR_ORDER_NOTFIND'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    number TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    dispatch_number TEXT,
+    error_code TEXT,
+    msg TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    lease REAL,
+    not_before REAL NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orders_state ON orders (state, created);
+"""
+
+
+class OrderQueue:
+    """
+    Durable SQLite queue in front of new_order
+
+    Orders are stored before they are sent. One whose outcome is unknown (a crash or a network error
+    after the request may have reached CDEK) becomes uncertain. It is looked up by Number with
+    check_orders_status before it is sent again, so it is never duplicated.
+
+    Several processes can share the database file. A batch is leased to the process sending it, only the
+    orders whose lease expired, i.e. whose sender died, become uncertain.
+
+    An order CDEK did not take, e.g. on ERR_AUTH or an open circuit breaker, waits retry_delay seconds,
+    doubled with every attempt, before it is sent again.
+
+    One worker looks up the uncertain orders every reconcile_interval seconds, the interval doubles up to
+    max_reconcile_interval while CDEK has nothing certain to say about them.
+    """
+
+    def __init__(self, api, path, batch_size=50, workers=2, interval=1.0, max_attempts=5, lease_timeout=300,
+                 retry_delay=5.0, reconcile_interval=5.0, max_reconcile_interval=300.0):
+        """
+        Open the queue, orders left in sending by a dead process become uncertain
+        :param api: CdekApi
+        :param path: sqlite database file
+        :param batch_size: orders per deliveryrequest
+        :param workers: background sender threads
+        :param interval: seconds an idle worker waits before looking for work again
+        :param max_attempts: sends of an order before it is failed
+        :param lease_timeout: seconds a batch stays with its sender, keep it well above the request timeout
+        :param retry_delay: seconds before an order CDEK did not take is sent again, doubled with every attempt
+        :param reconcile_interval: seconds between lookups of the uncertain orders
+        :param max_reconcile_interval: longest interval while orders stay uncertain
+        """
+        self.api = api
+        self.path = path
+        self.batch_size = batch_size
+        self.workers = workers
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.lease_timeout = lease_timeout
+        self.retry_delay = retry_delay
+        self.reconcile_interval = reconcile_interval
+        self.max_reconcile_interval = max_reconcile_interval
+        self._reconcile_delay = None
+        self._reconcile_at = 0.0
+        self.owner = uuid.uuid4().hex
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._threads = []
+        self._acts = itertools.count(1)
+        self.last_error = None
+        db = self._db()
+        db.executescript(SCHEMA)
+        self._expire()
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            # an enqueue or a claim must survive a power loss, or the order is lost or sent twice
+            db.execute('PRAGMA synchronous=FULL')
+        return db
+
+    def enqueue(self, order):
+        """
+        Store the order, an order with a Number already in the queue is ignored
+        :param order: Order, checked before it is stored, or new_order dict
+        :return: True if the order was added
+        """
+        return self.enqueue_many([order]) == 1
+
+    def enqueue_many(self, orders):
+        """
+        Store the orders in one transaction
+        :return: number of orders added
+        """
+        now = time.time()
+        rows = []
+        for order in orders:
+            if isinstance(order, Order):
+                order.check()
+            payload = json.dumps(order, default=dict, ensure_ascii=False)
+            rows.append((str(order['number']), payload, PENDING, now, now))
+        db = self._db()
+        with db:
+            before = db.total_changes
+            db.executemany('INSERT OR IGNORE INTO orders (number, payload, state, created, updated) '
+                           'VALUES (?, ?, ?, ?, ?)', rows)
+            added = db.total_changes - before
+        self._wake.set()
+        return added
+
+    def _expire(self):
+        """
+        Orders whose sender did not finish within the lease become uncertain
+        :return: number of orders
+        """
+        now = time.time()
+        db = self._db()
+        with db:
+            return db.execute('UPDATE orders SET state = ?, owner = NULL, lease = NULL, updated = ? '
+                              'WHERE state = ? AND (lease IS NULL OR lease < ?)',
+                              (UNCERTAIN, now, SENDING, now)).rowcount
+
+    def _claim(self, limit):
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            rows = db.execute('SELECT number, payload FROM orders WHERE state = ? AND not_before <= ? '
+                              'ORDER BY created LIMIT ?', (PENDING, now, limit)).fetchall()
+            db.executemany('UPDATE orders SET state = ?, attempts = attempts + 1, owner = ?, lease = ?, updated = ? '
+                           'WHERE number = ?',
+                           [(SENDING, self.owner, now + self.lease_timeout, now, row['number']) for row in rows])
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        return [json.loads(row['payload']) for row in rows]
+
+    def _update(self, updates, owner=None):
+        """
+        Record the outcomes, an order that was taken over since, e.g. after its lease ran out, is left alone
+        :param updates: list of (number, state, dispatch_number, error_code, msg)
+        :param owner: owner of the claimed orders being sent, None for uncertain orders
+        """
+        now = time.time()
+        current = SENDING if owner else UNCERTAIN
+        # a sent order CDEK did not take backs off, one reconcile found missing goes out at once
+        delay = self.retry_delay if owner else 0
+        db = self._db()
+        with db:
+            db.executemany(
+                'UPDATE orders SET state = CASE WHEN ? = ? AND attempts >= ? THEN ? ELSE ? END, '
+                'dispatch_number = COALESCE(?, dispatch_number), error_code = ?, msg = ?, owner = NULL, lease = NULL, '
+                'not_before = ? + ? * (1 << MIN(MAX(attempts - 1, 0), 10)), '
+                'updated = ? WHERE number = ? AND state = ? AND owner IS ?',
+                [(state, PENDING, self.max_attempts, FAILED, state, dispatch_number, error_code, msg, now, delay, now,
+                  number, current, owner) for number, state, dispatch_number, error_code, msg in updates])
+
+    def _release(self, numbers, msg):
+        """
+        Put claimed orders that were not sent back to pending, the attempt is not counted
+        """
+        now = time.time()
+        db = self._db()
+        with db:
+            db.executemany('UPDATE orders SET state = ?, attempts = attempts - 1, msg = ?, owner = NULL, lease = NULL, '
+                           'not_before = ?, updated = ? WHERE number = ? AND state = ? AND owner IS ?',
+                           [(PENDING, msg, now + self.retry_delay, now, number, SENDING, self.owner)
+                            for number in numbers])
+
+    def process(self, batch_size=None):
+        """
+        Send one batch of pending orders
+        :return: number of orders taken from the queue and not put back for a later retry
+        """
+        orders = self._claim(batch_size or self.batch_size)
+        if not orders:
+            return 0
+        rejected = []
+        data = self.api._orders_xml(orders, str(next(self._acts)), rejected)
+        updates = [(str(order['number']), FAILED, None, None, f'invalid order: {e!r}') for order, e in rejected]
+        failed = {id(order) for order, _ in rejected}
+        valid = [order for order in orders if id(order) not in failed]
+        released = []
+        retried = 0
+        if valid:
+            try:
+                res = self.api.post_xml('new_order', xml_request=data)
+            except CircuitOpenError as e:
+                # refused before anything was sent, not an attempt
+                released = [str(order['number']) for order in valid]
+                self._release(released, f'circuit open: {e}')
+            except Exception as e:
+                updates += [(str(order['number']), UNCERTAIN, None, None, str(e)) for order in valid]
+            else:
+                for result in self.api._parse_new_orders(res, valid):
+                    if result.ok:
+                        updates.append((result.number, SENT, result.dispatch_number, None, result.msg))
+                    elif result.request_error:
+                        # nothing was created, e.g. ERR_AUTH, sent again until max_attempts
+                        updates.append((result.number, PENDING, None, result.error_code, result.msg))
+                        retried += 1
+                    elif result.error_code is not None:
+                        updates.append((result.number, FAILED, None, result.error_code, result.msg))
+                    else:
+                        updates.append((result.number, UNCERTAIN, None, None, 'no result in the response'))
+        self._update(updates, self.owner)
+        return len(orders) - len(released) - retried
+
+    def reconcile(self):
+        """
+        Look up the uncertain orders by Number, the ones CDEK has are sent, the ones it reports missing are sent again
+        :return: number of orders resolved
+        """
+        self._expire()
+        numbers = [row['number'] for row in
+                   self._db().execute('SELECT number FROM orders WHERE state = ?', (UNCERTAIN,))]
+        resolved = 0
+        for i in range(0, len(numbers), self.batch_size):
+            chunk = numbers[i:i + self.batch_size]
+            found = {}
+            missing = set()
+            try:
+                root = self.api.check_orders_status([{'order_number': n, 'dispatch_number': ''} for n in chunk])
+            except CdekAPIError as e:
+                if e.code not in NOT_FOUND_ERRORS:
+                    continue
+                # none of the chunk is at CDEK
+                missing.update(chunk)
+            except Exception:
+                # still unknown, try again later
+                continue
+            else:
+                for element in root.iter('Order'):
+                    if element.get('DispatchNumber') and not element.get('ErrorCode'):
+                        found[element.get('Number')] = element.get('DispatchNumber')
+                    elif element.get('ErrorCode') in NOT_FOUND_ERRORS:
+                        missing.add(element.get('Number'))
+            # an order the response says nothing certain about stays uncertain, it may be at CDEK
+            updates = [(number, SENT, found[number], None, 'reconciled') if number in found
+                       else (number, PENDING, None, None, 'not found at CDEK')
+                       for number in chunk if number in found or number in missing]
+            self._update(updates)
+            resolved += len(updates)
+        return resolved
+
+    def _scheduled_reconcile(self):
+        """
+        Reconcile when it is due, backing off while orders stay uncertain
+        """
+        if time.monotonic() < self._reconcile_at:
+            return
+        try:
+            self.reconcile()
+        finally:
+            if self._reconcile_delay is None or not self.stats.get(UNCERTAIN):
+                self._reconcile_delay = self.reconcile_interval
+            self._reconcile_at = time.monotonic() + self._reconcile_delay
+            self._reconcile_delay = min(self._reconcile_delay * 2, self.max_reconcile_interval)
+
+    def _worker(self, reconciler):
+        while not self._stop.is_set():
+            try:
+                if reconciler:
+                    self._scheduled_reconcile()
+                while self.process() and not self._stop.is_set():
+                    pass
+            except Exception as e:
+                # keep the worker alive, the orders stay in the queue
+                self.last_error = e
+            self._wake.wait(self.interval)
+            self._wake.clear()
+        self._local.db.close()
+        self._local.db = None
+
+    def start(self):
+        """
+        Send the queue from background threads
+        """
+        self._stop.clear()
+        for i in range(self.workers):
+            # the first worker alone looks up the uncertain orders
+            thread = threading.Thread(target=self._worker, args=(i == 0,), name=f'cdek-order-queue-{i}',
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def close(self):
+        self.stop()
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+    def drain(self, timeout=None):
+        """
+        Wait until no order is pending or being sent
+        :return: True if the queue drained in time
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.stats.get(PENDING, 0) + self.stats.get(SENDING, 0):
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            self._wake.set()
+            time.sleep(0.01)
+        return True
+
+    def get(self, number):
+        """
+        :return: dict of state, dispatch_number, error_code, msg, attempts or None
+        """
+        row = self._db().execute('SELECT state, dispatch_number, error_code, msg, attempts FROM orders '
+                                 'WHERE number = ?', (str(number),)).fetchone()
+        return dict(row) if row is not None else None
+
+    def dispatch_numbers(self):
+        """
+        :return: dict of Number -> DispatchNumber of the sent orders
+        """
+        return {row['number']: row['dispatch_number'] for row in
+                self._db().execute('SELECT number, dispatch_number FROM orders WHERE state = ?', (SENT,))}
+
+    @property
+    def stats(self):
+        return {row['state']: row['n'] for row in
+                self._db().execute('SELECT state, COUNT(*) AS n FROM orders GROUP BY state')}
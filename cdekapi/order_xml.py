@@ -0,0 +1,208 @@
+import datetime
+import re
+import xml.etree.ElementTree as ET
+
+# (xml attribute, order key, convert), convert is str or None for values that must already be strings
+ORDER_FIELDS = (
+    ('number', 'number', str),
+    ('sendcitycode', 'sender_city', str),
+    ('reccitycode', 'receiver_city', str),
+    ('tarifftypecode', 'tarifftypecode', str),
+    ('deliveryrecipientcost', 'deliveryrecipientcost', str),
+    ('recipientname', 'recipientname', str),
+    ('recepientemail', 'recepientemail', str),
+    ('phone', 'phone', str),
+)
+
+# optional, only the truthy ones are written
+ADDRESS_FIELDS = (
+    ('street', 'street', None),
+    ('house', 'house', str),
+    ('flat', 'flat', str),
+    ('pvzcode', 'pvzcode', None),
+)
+
+# number and barcode come first, they are the position of the package
+PACKAGE_FIELDS = (
+    ('weight', 'weight', str),
+    ('sizea', 'height', str),
+    ('sizeb', 'width', str),
+    ('sizec', 'length', str),
+)
+
+ITEM_FIELDS = (
+    ('amount', 'amount', str),
+    ('warekey', 'warekey', None),
+    ('cost', 'cost', str),
+    ('payment', 'payment', str),
+    ('weight', 'weight', str),
+    ('comment', 'comment', None),
+)
+
+STATUS_FIELDS = (
+    ('number', 'order_number', str),
+    ('dispatch_number', 'dispatch_number', str),
+)
+
+
+def _escape_table():
+    # the same escaping ElementTree applies to attribute values in this python version
+    table = []
+    for char in '&<>"\r\n\t':
+        escaped = ET.tostring(ET.Element('x', a=char), encoding='unicode')[len('<x a="'):-len('" />')]
+        if escaped != char:
+            table.append((char, escaped))
+    return table
+
+
+# '&' goes first so the other replacements are not escaped again
+ESCAPE = _escape_table()
+_special = re.compile('[' + ''.join(char for char, _ in ESCAPE) + ']')
+
+
+def escape_attrib(value):
+    """
+    :param value: str
+    :return: value escaped as ElementTree does it
+    """
+    try:
+        if _special.search(value) is None:
+            return value
+    except TypeError:
+        raise TypeError(f'cannot serialize {value!r} (type {type(value).__name__})') from None
+    for char, escaped in ESCAPE:
+        if char in value:
+            value = value.replace(char, escaped)
+    return value
+
+
+def _attributes(out, data, fields, optional=False):
+    for name, key, convert in fields:
+        value = data.get(key) if optional else data[key]
+        if optional and not value:
+            continue
+        if convert is not None:
+            value = convert(value)
+        out.append(f' {name}="{escape_attrib(value)}"')
+
+
+def write_order(out, order):
+    """
+    Append the <order> element of one order
+    :param out: list of str parts
+    :param order: see CdekApi.new_order
+    """
+    out.append('<order')
+    _attributes(out, order, ORDER_FIELDS)
+    out.append('><address')
+    _attributes(out, order['address'], ADDRESS_FIELDS, optional=True)
+    out.append(' />')
+    for number, package in enumerate(order['packages'], 1):
+        out.append(f'<package number="{number}" barcode="{number}"')
+        _attributes(out, package, PACKAGE_FIELDS)
+        items = package['items']
+        if not items:
+            out.append(' />')
+            continue
+        out.append('>')
+        for item in items:
+            out.append('<item')
+            _attributes(out, item, ITEM_FIELDS)
+            out.append(' />')
+        out.append('</package>')
+    out.append('</order>')
+
+
+def _document(tag, header, parts):
+    # ElementTree writes no xml declaration for utf-8
+    out = ['<', tag]
+    _attributes(out, header, tuple((name, name, None) for name in header))
+    if parts:
+        out.append('>')
+        out.extend(parts)
+        out.append(f'</{tag}>')
+    else:
+        out.append(' />')
+    return ''.join(out).encode('utf-8', 'xmlcharrefreplace')
+
+
+def orders_xml(account, secure, orders, number='1', rejected=None):
+    """
+    Serialize the deliveryrequest document of new_order/new_orders
+    :param account: cdek login
+    :param secure: cdek password
+    :param orders: list of orders, see CdekApi.new_order
+    :param number: act number
+    :param rejected: list collecting (order, exception) for orders that can not be serialized,
+        they are left out of the document; errors are raised if not given
+    :return: xml bytes, the same as ElementTree would write
+    """
+    parts = []
+    count = 0
+    for order in orders:
+        mark = len(parts)
+        try:
+            write_order(parts, order)
+            count += 1
+        except (KeyError, TypeError, AttributeError) as e:
+            if rejected is None:
+                raise
+            del parts[mark:]
+            rejected.append((order, e))
+    header = {
+        'account': account,
+        'secure': secure,
+        'date': orders[0].get('date', str(datetime.date.today())),
+        'number': str(number),
+        'ordercount': str(count),
+    }
+    return _document('deliveryrequest', header, parts)
+
+
+def status_xml(account, secure, orders):
+    """
+    Serialize the statusreport document of check_orders_status
+    :param orders: list of {order_number, dispatch_number}
+    :return: xml bytes
+    """
+    parts = []
+    for order in orders:
+        parts.append('<order')
+        _attributes(parts, order, STATUS_FIELDS)
+        parts.append(' />')
+    header = {'account': account, 'secure': secure, 'date': str(datetime.date.today())}
+    return _document('statusreport', header, parts)
+
+
+def _set(element, data, fields, optional=False):
+    for name, key, convert in fields:
+        value = data.get(key) if optional else data[key]
+        if optional and not value:
+            continue
+        element.set(name, value if convert is None else convert(value))
+
+
+def orders_tree(account, secure, orders, number='1'):
+    """
+    ElementTree build of the deliveryrequest document, the reference orders_xml output is checked against
+    :return: xml bytes
+    """
+    request = ET.Element('deliveryrequest')
+    request.set('account', account)
+    request.set('secure', secure)
+    request.set('date', orders[0].get('date', str(datetime.date.today())))
+    request.set('number', str(number))
+    for order in orders:
+        request_order = ET.SubElement(request, 'order')
+        _set(request_order, order, ORDER_FIELDS)
+        address = ET.SubElement(request_order, 'address')
+        _set(address, order['address'], ADDRESS_FIELDS, optional=True)
+        for position, order_package in enumerate(order['packages'], 1):
+            package = ET.SubElement(request_order, 'package')
+            package.set('number', str(position))
+            package.set('barcode', str(position))
+            _set(package, order_package, PACKAGE_FIELDS)
+            for package_item in order_package['items']:
+                _set(ET.SubElement(package, 'item'), package_item, ITEM_FIELDS)
+    request.set('ordercount', str(len(orders)))
+    return ET.tostring(request, encoding='utf-8')
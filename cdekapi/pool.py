@@ -0,0 +1,335 @@
+import itertools
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from cdekapi import CdekApi
+from cdekapi.bulk import run_bulk
+from cdekapi.exceptions import CdekAPIException, CdekAPIError, CdekAPIConnectionError, CircuitOpenError
+
+ROUND_ROBIN = 'round_robin'
+LEAST_LOADED = 'least_loaded'
+BY_CITY = 'by_city'
+
+# calculator code 2 and the ErrorCode of the integration API
+AUTH_ERRORS = frozenset((2, '2', 'ERR_AUTH'))
+
+
+def is_auth_error(error):
+    return isinstance(error, CdekAPIError) and error.code in AUTH_ERRORS
+
+
+def is_throttled(error):
+    """
+    True if the request was refused before CDEK handled it: HTTP 429 or an open circuit breaker
+    """
+    if isinstance(error, CircuitOpenError):
+        return True
+    return isinstance(error, CdekAPIConnectionError) and error.status_code == 429
+
+
+def refused_orders(results):
+    """
+    Error of a new_orders chunk CDEK created nothing of because of the account, None otherwise
+    :param results: list of OrderResult of the chunk
+    """
+    if any(result.ok for result in results):
+        return None
+    for result in results:
+        if is_throttled(result.error):
+            return result.error
+        if result.request_error and result.error_code in AUTH_ERRORS:
+            return CdekAPIError(result.msg, code=result.error_code)
+    return None
+
+
+class Account:
+    """
+    One CDEK contract of the pool
+    """
+
+    def __init__(self, api, name=None, cities=None):
+        """
+        :param api: CdekApi bound to the contract credentials, with its own transport and limiter
+        :param name: account name, the login by default
+        :param cities: sender City Ids served by the contract for the BY_CITY policy
+        """
+        self.api = api
+        self.name = name or api.login
+        self.cities = frozenset(cities or ())
+        self.active = 0
+        self.calls = 0
+        self.errors = 0
+        self.failovers = 0
+        self.disabled_until = 0.0
+        self.disabled_reason = None
+
+    @property
+    def available(self):
+        return self.disabled_until <= time.monotonic()
+
+    def disable(self, seconds, reason):
+        self.disabled_until = time.monotonic() + seconds
+        self.disabled_reason = reason
+
+    @property
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'failovers': self.failovers,
+            'active': self.active,
+            'available': self.available,
+            'disabled_reason': None if self.available else self.disabled_reason,
+            'limiter': self.api.limiter.stats,
+            'resilience': self.api.resilience.stats,
+        }
+
+
+class CdekApiPool:
+    """
+    Spreads the calls over several CDEK contracts, failing over on auth errors and throttling
+    """
+
+    def __init__(self, accounts, policy=ROUND_ROBIN, auth_cooldown=300.0, throttle_cooldown=5.0, max_owners=100000):
+        """
+        Create the pool
+        :param accounts: list of Account
+        :param policy: ROUND_ROBIN, LEAST_LOADED or BY_CITY
+        :param auth_cooldown: seconds an account is skipped after an auth error
+        :param throttle_cooldown: seconds an account is skipped after being throttled
+        :param max_owners: DispatchNumbers whose account is remembered, the oldest are forgotten first
+        """
+        if not accounts:
+            raise ValueError('CdekApiPool needs at least one account')
+        if policy not in (ROUND_ROBIN, LEAST_LOADED, BY_CITY):
+            raise ValueError(f'Unknown policy {policy!r}')
+        self.accounts = list(accounts)
+        self.by_name = {account.name: account for account in self.accounts}
+        self.policy = policy
+        self.auth_cooldown = auth_cooldown
+        self.throttle_cooldown = throttle_cooldown
+        self.max_owners = max_owners
+        self.owners = OrderedDict()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_credentials(cls, credentials, policy=ROUND_ROBIN, auth_cooldown=300.0, throttle_cooldown=5.0,
+                         max_owners=100000, **kwargs):
+        """
+        :param credentials: list of dicts with login, password and optional name, cities
+            and CdekApi keyword arguments (e.g. limiter) of the account
+        :param policy, auth_cooldown, throttle_cooldown, max_owners: see __init__
+        :param kwargs: CdekApi keyword arguments shared by all accounts, e.g. cache
+        """
+        accounts = []
+        for account in credentials:
+            account = dict(account)
+            name = account.pop('name', None)
+            cities = account.pop('cities', None)
+            api = CdekApi(account.pop('login'), account.pop('password'), **dict(kwargs, **account))
+            accounts.append(Account(api, name, cities))
+        return cls(accounts, policy, auth_cooldown, throttle_cooldown, max_owners)
+
+    def close(self):
+        for account in self.accounts:
+            account.api.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def candidates(self, sender_city_id=None, account=None):
+        """
+        Accounts in the order they are tried
+        :param sender_city_id: sender City Id of the call, used by BY_CITY
+        :param account: name of the account to use, no failover
+        :return: list of Account
+        """
+        if account is not None:
+            return [self.by_name[account]]
+        accounts = self.accounts
+        if self.policy == BY_CITY and sender_city_id is not None:
+            city = int(sender_city_id)
+            matching = [a for a in accounts if city in a.cities]
+            general = [a for a in accounts if not a.cities]
+            others = [a for a in accounts if a.cities and city not in a.cities]
+            accounts = matching + self._rotate(general) + others
+        elif self.policy == LEAST_LOADED:
+            accounts = sorted(accounts, key=lambda a: (a.active, a.calls))
+        else:
+            accounts = self._rotate(accounts)
+        available = [a for a in accounts if a.available]
+        # everything disabled, try anyway rather than fail without asking
+        return available or accounts
+
+    def _rotate(self, accounts):
+        if not accounts:
+            return accounts
+        shift = next(self._counter) % len(accounts)
+        return accounts[shift:] + accounts[:shift]
+
+    def call(self, name, *args, sender_city_id=None, account=None, **kwargs):
+        """
+        Call the CdekApi method on the routed account
+        :param name: CdekApi method name
+        :param sender_city_id: routing hint for BY_CITY
+        :param account: pin the call to the named account
+        :return: (Account, method result)
+        """
+        return self._call(lambda api: getattr(api, name)(*args, **kwargs), sender_city_id, account)
+
+    def _call(self, fn, sender_city_id=None, account=None, refused=None):
+        """
+        Call fn(api) on the routed accounts until one does not fail on an auth error or throttling
+        :param refused: function of the result returning such an error when it was not raised,
+            the last refused result is returned when no account is left
+        :return: (Account, fn result)
+        """
+        error = None
+        last = None
+        for candidate in self.candidates(sender_city_id, account):
+            with self._lock:
+                candidate.active += 1
+                candidate.calls += 1
+            try:
+                res = fn(candidate.api)
+            except CdekAPIException as e:
+                error, last = e, None
+            else:
+                error = refused(res) if refused else None
+                if error is None:
+                    return candidate, res
+                last = candidate, res
+            finally:
+                with self._lock:
+                    candidate.active -= 1
+            self._failover(candidate, error)
+        if last is not None:
+            return last
+        raise error
+
+    def _failover(self, candidate, error):
+        """
+        Disable the account after an auth error or throttling, any other error is raised
+        """
+        candidate.errors += 1
+        if is_auth_error(error):
+            candidate.disable(self.auth_cooldown, 'auth')
+        elif is_throttled(error):
+            candidate.disable(self.throttle_cooldown, 'throttled')
+        else:
+            raise error
+        candidate.failovers += 1
+
+    def calc_price(self, sender_city_id, receiver_city_id, goods, account=None, **kwargs):
+        return self.call('calc_price', sender_city_id, receiver_city_id, goods,
+                         sender_city_id=sender_city_id, account=account, **kwargs)[1]
+
+    def calc_prices(self, sender_city_id, receiver_city_id, goods, account=None, **kwargs):
+        return self.call('calc_prices', sender_city_id, receiver_city_id, goods,
+                         sender_city_id=sender_city_id, account=account, **kwargs)[1]
+
+    def calc_quote(self, sender_city_id, receiver_city_id, goods, account=None, **kwargs):
+        return self.call('calc_quote', sender_city_id, receiver_city_id, goods,
+                         sender_city_id=sender_city_id, account=account, **kwargs)[1]
+
+    def calc_quotes(self, sender_city_id, receiver_city_id, goods, account=None, **kwargs):
+        return self.call('calc_quotes', sender_city_id, receiver_city_id, goods,
+                         sender_city_id=sender_city_id, account=account, **kwargs)[1]
+
+    def calc_price_num(self, sender_city_id, receiver_city_id, goods, account=None, **kwargs):
+        return self.call('calc_price_num', sender_city_id, receiver_city_id, goods,
+                         sender_city_id=sender_city_id, account=account, **kwargs)[1]
+
+    def best_tariff(self, sender_city_id, receiver_city_id, goods, account=None, **kwargs):
+        return self.call('best_tariff', sender_city_id, receiver_city_id, goods,
+                         sender_city_id=sender_city_id, account=account, **kwargs)[1]
+
+    def calc_prices_bulk(self, specs, max_concurrency=8, progress=None, stats=None):
+        """
+        CdekApi.calc_prices_bulk with every spec routed on its own, spreading the load over the accounts
+        """
+        return run_bulk(CdekApi._bulk(self.calc_prices), specs, max_concurrency, progress, stats)
+
+    def get_pvz_list(self, city_id, np_allowed, account=None):
+        return self.call('get_pvz_list', city_id, np_allowed, account=account)[1]
+
+    def new_order(self, order, account=None):
+        """
+        Create the order on the routed account, remembered as the owner of its DispatchNumber
+        """
+        owner, res = self.call('new_order', order, sender_city_id=order.get('sender_city'), account=account)
+        if res[1]:
+            self._own(res[1], owner)
+        return res
+
+    def new_orders(self, orders, chunk_size=50, max_concurrency=4, account=None):
+        """
+        CdekApi.new_orders with every chunk routed on its own, spreading the orders over the accounts,
+        under BY_CITY a chunk only holds orders of one sender city
+        :return: list of OrderResult in the orders order
+        """
+        orders = list(orders)
+        groups = {}
+        for order in orders:
+            groups.setdefault(order.get('sender_city') if self.policy == BY_CITY else None, []).append(order)
+        chunks = [(city, same[i:i + chunk_size]) for city, same in groups.items()
+                  for i in range(0, len(same), chunk_size)]
+        results = {}
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = [executor.submit(CdekApi._bulk(self._submit_orders), chunk, city, account)
+                       for city, chunk in chunks]
+            for (_, chunk), future in zip(chunks, futures):
+                results.update(zip(map(id, chunk), future.result()))
+        return [results[id(order)] for order in orders]
+
+    def _submit_orders(self, orders, sender_city_id, account):
+        # a chunk refused for the account is sent again on the next one, nothing of it was created
+        owner, results = self._call(lambda api: api.new_orders(orders, chunk_size=len(orders), max_concurrency=1),
+                                    sender_city_id, account, refused_orders)
+        for result in results:
+            if result.ok:
+                self._own(result.dispatch_number, owner)
+        return results
+
+    def _own(self, dispatch_number, account):
+        with self._lock:
+            self.owners[str(dispatch_number)] = account.name
+            self.owners.move_to_end(str(dispatch_number))
+            while len(self.owners) > self.max_owners:
+                self.owners.popitem(last=False)
+
+    def check_orders_status(self, orders, account=None):
+        """
+        Ask each owner account for its orders, the routed one for orders of unknown owner
+        :return: StatusReport element holding the Order elements of every account asked,
+            see CdekApi.check_orders_status
+        """
+        groups = {}
+        for order in orders:
+            owner = account or self.owners.get(str(order['dispatch_number']))
+            groups.setdefault(owner, []).append(order)
+        report = None
+        for owner, same in groups.items():
+            root = self.call('check_orders_status', same, account=owner)[1]
+            if report is None:
+                report = root
+            else:
+                report.extend(root)
+        return report if report is not None else ET.Element('StatusReport')
+
+    @property
+    def stats(self):
+        accounts = {account.name: account.stats for account in self.accounts}
+        return {
+            'calls': sum(a['calls'] for a in accounts.values()),
+            'errors': sum(a['errors'] for a in accounts.values()),
+            'failovers': sum(a['failovers'] for a in accounts.values()),
+            'accounts': accounts,
+        }
@@ -0,0 +1,59 @@
+class PreparedQuote:
+    """
+    Calculator request with everything but goods filled in, for quoting one route many times
+    """
+
+    def __init__(self, api, sender_city_id, receiver_city_id, tariff_id=136, tariff_list=None, mode_id=None,
+                 currency='RUB', services=None, decimal_places=0):
+        """
+        :param api: CdekApi
+        :param decimal_places: price rounding
+        Other parameters are the ones of calc_price/calc_prices, tariff_list selects calc_prices
+        """
+        self.api = api
+        self.method = 'calc_prices' if tariff_list else 'calc_price'
+        self.decimal_places = decimal_places
+        self.template = api._quote_data(sender_city_id, receiver_city_id, None, None, tariff_id, tariff_list,
+                                        mode_id, currency, services)
+        self._date = None
+        self._signed = None
+
+    def data(self, goods, date_execute=None):
+        """
+        Signed request for the goods, the signed template is rebuilt only when dateExecute changes
+        :return: json data
+        """
+        date = self.api._date_execute(date_execute)
+        signed = self._signed
+        if date != self._date or signed is None:
+            signed = dict(self.template, dateExecute=date)
+            self.api._sign(signed)
+            self._date, self._signed = date, signed
+        data = dict(signed)
+        data['goods'] = goods
+        return data
+
+    def _quantized(self, goods, date_execute):
+        return self.api._quantized(self.method, self.data(goods, date_execute))
+
+    def _round(self, res):
+        if self.method == 'calc_prices':
+            return self.api._round_prices(res, self.decimal_places)
+        return self.api._round_price(res, self.decimal_places)
+
+    def __call__(self, goods, date_execute=None):
+        """
+        :param goods: calculator goods
+        :param date_execute: planned shipment date, tomorrow by default
+        :return: json result of calc_price or calc_prices
+        """
+        return self._round(self.api._cached_run(self.method, self._quantized(goods, date_execute)))
+
+
+class AsyncPreparedQuote(PreparedQuote):
+    """
+    PreparedQuote of AsyncCdekApi
+    """
+
+    async def __call__(self, goods, date_execute=None):
+        return self._round(await self.api._cached_run(self.method, self._quantized(goods, date_execute)))
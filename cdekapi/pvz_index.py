@@ -0,0 +1,209 @@
+import math
+import sqlite3
+import threading
+from hashlib import md5
+
+FIELDS = ('id', 'city_id', 'name', 'city', 'address', 'comment', 'note', 'phone',
+          'latitude', 'longitude', 'type', 'np_allowed')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pvz (
+    id TEXT PRIMARY KEY,
+    city_id INTEGER,
+    name TEXT,
+    city TEXT,
+    address TEXT,
+    comment TEXT,
+    note TEXT,
+    phone TEXT,
+    latitude REAL,
+    longitude REAL,
+    type TEXT,
+    np_allowed INTEGER,
+    cell_x INTEGER,
+    cell_y INTEGER,
+    digest TEXT
+);
+CREATE INDEX IF NOT EXISTS pvz_city ON pvz (city_id);
+CREATE INDEX IF NOT EXISTS pvz_filter ON pvz (np_allowed, type);
+CREATE INDEX IF NOT EXISTS pvz_cell ON pvz (cell_x, cell_y);
+"""
+
+EARTH_RADIUS = 6371.0
+
+
+def distance(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance, km
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+class PvzIndex:
+    """
+    Local SQLite store of pickup points with a grid spatial index
+
+    The stored points have their real latitude and longitude, unlike the get_pvz_list dicts.
+    """
+
+    def __init__(self, api, path=':memory:', cell_size=0.5):
+        """
+        Create the index
+        :param api: CdekApi used to download the pvz list
+        :param path: sqlite database file, in-memory by default
+        :param cell_size: grid cell size, degrees
+        """
+        self.api = api
+        self.cell_size = cell_size
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        if path != ':memory:':
+            self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    def _cell(self, latitude, longitude):
+        if latitude is None or longitude is None:
+            return None, None
+        return int(math.floor(latitude / self.cell_size)), int(math.floor(longitude / self.cell_size))
+
+    @staticmethod
+    def _row(pvz):
+        row = pvz.as_dict()
+        row['np_allowed'] = int(row['np_allowed'])
+        return row
+
+    def refresh(self, city_id=None):
+        """
+        Download the pvz list and write only the changed points
+        :param city_id: CDEK City Id, the whole list by default
+        :return: dict with added/updated/removed counts
+        """
+        # download outside the lock so lookups keep being served meanwhile
+        rows = [self._row(pvz) for pvz in self.api.iter_pvz(city_id)]
+        stats = {'added': 0, 'updated': 0, 'removed': 0}
+        with self._lock, self.db:
+            if city_id is None:
+                known = dict(self.db.execute('SELECT id, digest FROM pvz'))
+            else:
+                known = dict(self.db.execute('SELECT id, digest FROM pvz WHERE city_id = ?', (int(city_id),)))
+            for pvz in rows:
+                values = [pvz[field] for field in FIELDS]
+                digest = md5(repr(values).encode('utf-8')).hexdigest()
+                old = known.pop(pvz['id'], None)
+                if old == digest:
+                    continue
+                stats['updated' if old else 'added'] += 1
+                self.db.execute('INSERT OR REPLACE INTO pvz VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)',
+                                values + list(self._cell(pvz['latitude'], pvz['longitude'])) + [digest])
+            if known:
+                self.db.executemany('DELETE FROM pvz WHERE id = ?', [(code,) for code in known])
+                stats['removed'] = len(known)
+        return stats
+
+    def start(self, interval=3600, cities=None):
+        """
+        Refresh the index in a background thread
+        :param interval: seconds between refreshes
+        :param cities: list of City Ids to refresh, the whole list by default
+        """
+        def loop():
+            while not self._stop.is_set():
+                for city_id in cities or [None]:
+                    try:
+                        self.refresh(city_id)
+                    except Exception:
+                        # keep serving the previous data, try again on the next round
+                        pass
+                self._stop.wait(interval)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=loop, name='cdek-pvz-refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        self.db.close()
+
+    def _select(self, where='', params=()):
+        sql = f'SELECT {", ".join(FIELDS)} FROM pvz'
+        if where:
+            sql += f' WHERE {where}'
+        with self._lock:
+            return [dict(row) for row in self.db.execute(sql + ' ORDER BY id', params)]
+
+    def __len__(self):
+        with self._lock:
+            return self.db.execute('SELECT COUNT(*) FROM pvz').fetchone()[0]
+
+    def get(self, code):
+        """
+        :param code: pvz Code
+        :return: pvz dict or None
+        """
+        res = self._select('id = ?', (code,))
+        return res[0] if res else None
+
+    def by_city(self, city_id, np_allowed=None, pvz_type=None):
+        """
+        :param city_id: CDEK City Id
+        :param np_allowed: 1/0 AllowedCod filter
+        :param pvz_type: Type filter (PVZ, POSTOMAT)
+        :return: list of pvz dicts
+        """
+        where, params = self._filter(np_allowed, pvz_type)
+        return self._select(' AND '.join(['city_id = ?'] + where), [int(city_id)] + params)
+
+    def find(self, np_allowed=None, pvz_type=None):
+        where, params = self._filter(np_allowed, pvz_type)
+        return self._select(' AND '.join(where), params)
+
+    @staticmethod
+    def _filter(np_allowed, pvz_type):
+        where, params = [], []
+        if np_allowed is not None:
+            where.append('np_allowed = ?')
+            params.append(int(np_allowed))
+        if pvz_type is not None:
+            where.append('type = ?')
+            params.append(pvz_type)
+        return where, params
+
+    def nearest(self, latitude, longitude, n=5, np_allowed=None, pvz_type=None, max_rings=64):
+        """
+        Nearest points, the grid is searched ring by ring around the point
+        :param latitude: degrees
+        :param longitude: degrees
+        :param n: number of points
+        :return: list of (distance km, pvz dict)
+        """
+        cx, cy = self._cell(latitude, longitude)
+        where, params = self._filter(np_allowed, pvz_type)
+        found = []
+        for ring in range(max_rings + 1):
+            cond = ['cell_x BETWEEN ? AND ?', 'cell_y BETWEEN ? AND ?',
+                    'NOT (cell_x BETWEEN ? AND ? AND cell_y BETWEEN ? AND ?)'] + where
+            inner = ring - 1
+            rows = self._select(' AND '.join(cond),
+                                [cx - ring, cx + ring, cy - ring, cy + ring,
+                                 cx - inner, cx + inner, cy - inner, cy + inner] + params)
+            found.extend((distance(latitude, longitude, row['latitude'], row['longitude']), row) for row in rows)
+            found.sort(key=lambda item: item[0])
+            # everything outside the searched square is at least `ring` cells away,
+            # longitude degrees are measured on the most polar row of the square
+            polar = min(90.0, abs(latitude) + (ring + 1) * self.cell_size)
+            reach = min(distance(polar, 0, polar, ring * self.cell_size),
+                        distance(latitude, 0, latitude + ring * self.cell_size, 0))
+            if len(found) >= n and found[n - 1][0] <= reach:
+                break
+        return found[:n]
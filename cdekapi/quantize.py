@@ -0,0 +1,154 @@
+import math
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+from cdekapi.cache import request_key
+from cdekapi.eligibility import VOLUME_DIVISOR, goods_weight, tariffs_for_weight
+
+
+def round_up(value, step=None, buckets=None):
+    """
+    Smallest bucket not below the value
+    :param value: number or None
+    :param step: bucket width
+    :param buckets: ascending bucket bounds, values over the last one are rounded up to the step
+    :return: rounded value, None and 0 are kept
+    """
+    if not value:
+        return value
+    value = float(value)
+    if buckets:
+        i = bisect_left(buckets, value)
+        if i < len(buckets):
+            return buckets[i]
+    if not step:
+        return value
+    # the epsilon keeps values already on a bound, e.g. 0.3 with step 0.1, from moving up a bucket
+    res = math.ceil(value / step - 1e-9) * step
+    return int(res) if isinstance(step, int) else round(res, 9)
+
+
+def billable_weight(goods, volume_divisor=VOLUME_DIVISOR):
+    """
+    Weight CDEK charges for, the greater of the physical and the volumetric one of every place
+    :param goods: calculator goods
+    :return: kg
+    """
+    return sum(max(goods_weight([place], volume_divisor)) for place in goods)
+
+
+class Quantizer:
+    """
+    Rounds calculator goods up to weight and dimension buckets, so near-identical carts share one cached quote
+
+    The rounding only goes up, a quote is never below the one of the real goods. Goods whose bucket would cross
+    a calc_dictionaries weight restriction the real goods are under are left as they are.
+    """
+
+    def __init__(self, weight_step=0.1, dimension_step=5, weight_buckets=None, dimension_buckets=None,
+                 volume_step=0.001, aggregate=False, maxsize=10000):
+        """
+        :param weight_step: kg
+        :param dimension_step: cm
+        :param weight_buckets: ascending weight bounds used before weight_step, e.g. (0.5, 1, 2, 5)
+        :param dimension_buckets: ascending dimension bounds used before dimension_step
+        :param volume_step: m3, for {weight, volume} places and aggregate
+        :param aggregate: send the goods as one place of the total volume weighing their billable weight,
+            so the key no longer depends on how the cart is split into places
+        :param maxsize: number of request keys remembered for the hit rate stats
+        """
+        self.weight_step = weight_step
+        self.dimension_step = dimension_step
+        self.weight_buckets = sorted(weight_buckets) if weight_buckets else None
+        self.dimension_buckets = sorted(dimension_buckets) if dimension_buckets else None
+        self.volume_step = volume_step
+        self.aggregate = aggregate
+        self.maxsize = maxsize
+        self.requests = 0
+        self.hits = 0
+        self.raw_hits = 0
+        self.skipped = 0
+        self._seen = OrderedDict()
+        self._raw_seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def weight(self, value):
+        return round_up(value, self.weight_step, self.weight_buckets)
+
+    def dimension(self, value):
+        return round_up(value, self.dimension_step, self.dimension_buckets)
+
+    def _place(self, place):
+        res = dict(place)
+        res['weight'] = self.weight(place.get('weight'))
+        if place.get('volume'):
+            res['volume'] = round_up(place['volume'], self.volume_step)
+        else:
+            for name in ('length', 'width', 'height'):
+                if name in place:
+                    res[name] = self.dimension(place[name])
+        return res
+
+    def _aggregated(self, goods):
+        # the total physical weight is not enough, a light bulky place is charged by its volume on its own
+        weight = billable_weight(goods)
+        volume = 0.0
+        for place in goods:
+            if place.get('volume'):
+                volume += float(place['volume'])
+            else:
+                volume += (float(place.get('length') or 0) * float(place.get('width') or 0)
+                           * float(place.get('height') or 0) / 1000000)
+        return [{'weight': self.weight(weight), 'volume': round_up(volume, self.volume_step)}]
+
+    def quantize(self, goods):
+        """
+        :param goods: calculator goods
+        :return: goods rounded up to the buckets
+        """
+        res = self._aggregated(goods) if self.aggregate else [self._place(place) for place in goods]
+        if tariffs_for_weight(goods_weight(res)[0]) != tariffs_for_weight(goods_weight(goods)[0]):
+            return goods
+        return res
+
+    def _remember(self, seen, key):
+        hit = key in seen
+        seen[key] = True
+        seen.move_to_end(key)
+        if len(seen) > self.maxsize:
+            seen.popitem(last=False)
+        return hit
+
+    def apply(self, method, data):
+        """
+        Quantize the goods of a calculator request, counting the hits the buckets add
+        :param method: calc_price or calc_prices
+        :param data: json data built by CdekApi._quote_data
+        :return: data with the bucketed goods
+        """
+        goods = self.quantize(data['goods'])
+        res = dict(data, goods=goods)
+        with self._lock:
+            self.requests += 1
+            self.skipped += goods is data['goods']
+            self.raw_hits += self._remember(self._raw_seen, request_key(method, data))
+            self.hits += self._remember(self._seen, request_key(method, res))
+        return res
+
+    @property
+    def stats(self):
+        """
+        hit_rate is the share of requests whose bucketed key was already asked, raw_hit_rate the share an exact
+        key cache would hit, gain the difference
+        """
+        requests = self.requests or 1
+        return {
+            'requests': self.requests,
+            'skipped': self.skipped,
+            'distinct': len(self._seen),
+            'raw_distinct': len(self._raw_seen),
+            'hit_rate': self.hits / requests,
+            'raw_hit_rate': self.raw_hits / requests,
+            'gain': (self.hits - self.raw_hits) / requests,
+        }
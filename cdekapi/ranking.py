@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from cdekapi import calc_dictionaries
+from cdekapi.eligibility import filter_tariffs, is_no_delivery
+from cdekapi.exceptions import CdekAPIError
+from cdekapi.models import TariffQuote, Ranking
+
+OBJECTIVES = {
+    'price': lambda q: (q.price, q.period_max or 0, q.tariff_id),
+    'period': lambda q: (q.period_min or 0, q.period_max or 0, q.price, q.tariff_id),
+}
+
+
+class TariffRanker:
+    """
+    Picks the cheapest or fastest tariff of a route over calc_prices, rankings are cached per route
+    """
+
+    def __init__(self, api, chunk_size=4, max_concurrency=4, ttl=600, maxsize=10000):
+        """
+        :param api: CdekApi
+        :param chunk_size: tariffs per calc_prices request
+        :param max_concurrency: parallel calc_prices requests
+        :param ttl: seconds a route ranking is fresh
+        :param maxsize: rankings kept, the least recently used ones are dropped
+        """
+        self.api = api
+        self.chunk_size = chunk_size
+        self.max_concurrency = max_concurrency
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._routes = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def candidates(goods, delivery_type=None):
+        """
+        calc_dictionaries tariffs that may apply to the goods
+        """
+        tariff_list = [{'id': tariff_id} for tariff_id in calc_dictionaries.tariffs]
+        return filter_tariffs(tariff_list, goods, delivery_type)[0]
+
+    @staticmethod
+    def _key(sender_city_id, receiver_city_id, goods, delivery_type, kwargs):
+        if delivery_type is not None and not isinstance(delivery_type, int):
+            delivery_type = sorted(delivery_type)
+        return json.dumps([sender_city_id, receiver_city_id, goods, delivery_type, kwargs],
+                          sort_keys=True, default=str)
+
+    def _fetch(self, sender_city_id, receiver_city_id, goods, delivery_type, kwargs):
+        tariffs = self.candidates(goods, delivery_type)
+        chunks = [tariffs[i:i + self.chunk_size] for i in range(0, len(tariffs), self.chunk_size)]
+
+        def quote(chunk):
+            try:
+                res = self.api.calc_prices(sender_city_id, receiver_city_id, goods, tariff_list=chunk, **kwargs)
+            except CdekAPIError as e:
+                if not is_no_delivery(e):
+                    raise
+                # none of the chunk tariffs is available on the route
+                return []
+            return TariffQuote.list_from_json(res)
+
+        quotes = []
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            for chunk_quotes in executor.map(quote, chunks):
+                quotes.extend(q for q in chunk_quotes if q.status)
+        return time.time(), quotes
+
+    def _refresh(self, key, *args):
+        try:
+            entry = self._fetch(*args)
+            self._store(key, entry)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._routes[key] = entry
+            self._routes.move_to_end(key)
+            while len(self._routes) > self.maxsize:
+                self._routes.popitem(last=False)
+
+    def rank(self, sender_city_id, receiver_city_id, goods, objective='price', delivery_type=None,
+             provisional=False, limit=None, **kwargs):
+        """
+        :param objective: 'price' or 'period'
+        :param delivery_type: id of calc_dictionaries.delivery_types or a set of them
+        :param provisional: return an expired ranking at once and refresh it in the background
+        :param limit: keep only the first limit tariffs
+        :param kwargs: other calc_prices keyword arguments, decimal_places is 2 by default
+        :return: Ranking
+        """
+        if 'tariff_list' in kwargs:
+            raise ValueError('rank quotes the calc_dictionaries tariffs, narrow them with delivery_type')
+        order = OBJECTIVES[objective]
+        kwargs.setdefault('decimal_places', 2)
+        args = (sender_city_id, receiver_city_id, goods, delivery_type, kwargs)
+        key = self._key(*args)
+        with self._lock:
+            entry = self._routes.get(key)
+            if entry is not None:
+                self._routes.move_to_end(key)
+        stale = entry is not None and entry[0] + self.ttl <= time.time()
+        if entry is None or (stale and not provisional):
+            entry = self._fetch(*args)
+            self._store(key, entry)
+            stale = False
+        elif stale:
+            with self._lock:
+                start = key not in self._refreshing
+                self._refreshing.add(key)
+            if start:
+                threading.Thread(target=self._refresh, args=(key,) + args, daemon=True).start()
+        fetched, quotes = entry
+        return Ranking(sorted(quotes, key=order)[:limit], objective, fetched, stale)
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
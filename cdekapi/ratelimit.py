@@ -0,0 +1,233 @@
+import heapq
+import itertools
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+INTERACTIVE = 0
+BULK = 10
+
+_local = threading.local()
+
+
+def current_priority():
+    return getattr(_local, 'priority', INTERACTIVE)
+
+
+@contextmanager
+def priority(value):
+    """
+    Run the calls of the block with the given priority class, lower goes first
+    :param value: INTERACTIVE, BULK or any int
+    """
+    previous = current_priority()
+    _local.priority = value
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+class TokenBucket:
+    """
+    In-process token bucket
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: tokens per second
+        :param burst: bucket size, rate by default
+        """
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, reserve=0):
+        """
+        Take a token if there is one
+        :param reserve: tokens that must stay in the bucket after this one is taken
+        :return: 0 on success or seconds to wait for the next token
+        """
+        reserve = min(reserve, self.burst - 1)
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1 + reserve:
+                self.tokens -= 1
+                return 0
+            return (1 + reserve - self.tokens) / self.rate
+
+
+class SqliteTokenBucket:
+    """
+    Token bucket kept in a SQLite file, shared by every process using the same path and key
+    """
+
+    def __init__(self, path, key, rate, burst=None):
+        """
+        :param path: sqlite database file
+        :param key: bucket name
+        :param rate: tokens per second
+        :param burst: bucket size, rate by default
+        """
+        self.path = path
+        self.key = key
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self._local = threading.local()
+        with self._db() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return db
+
+    def take(self, reserve=0):
+        reserve = min(reserve, self.burst - 1)
+        db = self._db()
+        # BEGIN IMMEDIATE takes the write lock, so the read-modify-write is atomic across processes
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            row = db.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (self.key,)).fetchone()
+            tokens = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * self.rate)
+            wait = 0
+            if tokens >= 1 + reserve:
+                tokens -= 1
+            else:
+                wait = (1 + reserve - tokens) / self.rate
+            db.execute('INSERT OR REPLACE INTO bucket VALUES (?, ?, ?)', (self.key, tokens, now))
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        return wait
+
+
+class PriorityGate:
+    """
+    Concurrency cap admitting the waiters by priority, then in arrival order
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._waiters = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+
+    def acquire(self, prio=INTERACTIVE):
+        with self._cond:
+            entry = (prio, next(self._counter))
+            heapq.heappush(self._waiters, entry)
+            while self.active >= self.limit or self._waiters[0] != entry:
+                self._cond.wait()
+            heapq.heappop(self._waiters)
+            self.active += 1
+            self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+
+class EndpointLimit:
+    """
+    Rate and concurrency budget of one endpoint
+    """
+
+    def __init__(self, rate=None, burst=None, concurrency=None, bucket=None, reserve=0):
+        """
+        :param rate: requests per second, unlimited if None
+        :param burst: token bucket size
+        :param concurrency: requests in flight, unlimited if None
+        :param bucket: ready bucket (e.g. SqliteTokenBucket) instead of an in-process one
+        :param reserve: tokens only INTERACTIVE calls may take, so bulk jobs can not drain the bucket
+        """
+        self.bucket = bucket or (TokenBucket(rate, burst) if rate else None)
+        self.gate = PriorityGate(concurrency) if concurrency else None
+        self.reserve = reserve
+        self.throttled = 0
+        self.waited = 0.0
+
+    def acquire(self, prio=INTERACTIVE):
+        # the token is taken before the slot, a call waiting for tokens must not keep INTERACTIVE calls out
+        if self.bucket is not None:
+            reserve = self.reserve if prio > INTERACTIVE else 0
+            while True:
+                wait = self.bucket.take(reserve)
+                if not wait:
+                    break
+                self.throttled += 1
+                self.waited += wait
+                time.sleep(wait)
+        if self.gate is not None:
+            self.gate.acquire(prio)
+
+    def release(self):
+        if self.gate is not None:
+            self.gate.release()
+
+
+class RateLimiter:
+    """
+    Per-endpoint budgets keyed by the CdekApi.methods keys
+    """
+
+    def __init__(self, limits=None):
+        """
+        :param limits: dict of method -> EndpointLimit
+        """
+        self.limits = dict(limits or {})
+
+    @classmethod
+    def shared(cls, path, rates, concurrency=None, reserve=None):
+        """
+        Limiter whose token buckets live in a SQLite file, so that every worker process shares the budget
+        :param path: sqlite database file
+        :param rates: dict of method -> requests per second
+        :param concurrency: dict of method -> per-process requests in flight
+        :param reserve: dict of method -> tokens kept for INTERACTIVE calls
+        """
+        concurrency = concurrency or {}
+        reserve = reserve or {}
+        return cls({
+            method: EndpointLimit(bucket=SqliteTokenBucket(path, method, rate),
+                                  concurrency=concurrency.get(method), reserve=reserve.get(method, 0))
+            for method, rate in rates.items()
+        })
+
+    @contextmanager
+    def limit(self, method):
+        endpoint = self.limits.get(method)
+        if endpoint is None:
+            yield
+            return
+        endpoint.acquire(current_priority())
+        try:
+            yield
+        finally:
+            endpoint.release()
+
+    @property
+    def stats(self):
+        return {
+            method: {
+                'throttled': endpoint.throttled,
+                'waited': endpoint.waited,
+                'active': endpoint.gate.active if endpoint.gate else None,
+                'waiting': endpoint.gate.waiting if endpoint.gate else None,
+            }
+            for method, endpoint in self.limits.items()
+        }
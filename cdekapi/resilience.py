@@ -0,0 +1,208 @@
+import asyncio
+import random
+import threading
+import time
+from collections import Counter
+
+from cdekapi.exceptions import CdekAPIConnectionError, CircuitOpenError
+
+IDEMPOTENT = frozenset(('calc_price', 'calc_prices', 'pvz_list', 'status'))
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+
+class RetryPolicy:
+    """
+    Jittered exponential backoff
+    """
+
+    def __init__(self, retries=2, backoff=0.2, max_backoff=5.0, jitter=True):
+        """
+        :param retries: extra attempts after the first one
+        :param backoff: delay before the first retry, seconds
+        :param max_backoff: delay cap, seconds
+        :param jitter: pick the delay uniformly from [0, delay] (full jitter)
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+
+    def delay(self, attempt):
+        """
+        :param attempt: number of the failed attempt, from 0
+        :return: seconds to wait before the next one
+        """
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return random.uniform(0, delay) if self.jitter else delay
+
+
+class CircuitBreaker:
+    """
+    Fails fast after failure_threshold consecutive failures, probes again after reset_timeout
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        """
+        :return: True if a request may be sent now
+        """
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def release(self):
+        """
+        End a probe that gave no outcome, the next call probes again
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class Resilience:
+    """
+    Per-endpoint timeouts, retries of idempotent calls and circuit breakers
+    """
+
+    def __init__(self, retry=None, timeouts=None, failure_threshold=5, reset_timeout=30.0,
+                 idempotent=IDEMPOTENT):
+        """
+        :param retry: RetryPolicy, RetryPolicy() by default
+        :param timeouts: dict of method -> timeout passed to the transport
+        :param failure_threshold: consecutive failures that open a breaker
+        :param reset_timeout: seconds before an open breaker lets a probe through
+        :param idempotent: methods that are retried
+        """
+        self.retry = retry or RetryPolicy()
+        self.timeouts = timeouts or {}
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.idempotent = idempotent
+        self.breakers = {}
+        self.retry_counts = Counter()
+        self._lock = threading.Lock()
+
+    def breaker(self, method):
+        with self._lock:
+            if method not in self.breakers:
+                self.breakers[method] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self.breakers[method]
+
+    @property
+    def stats(self):
+        return {
+            method: {'state': breaker.state, 'failures': breaker.failures, 'retries': self.retry_counts[method]}
+            for method, breaker in self.breakers.items()
+        }
+
+    def _attempts(self, method):
+        return 1 + (self.retry.retries if method in self.idempotent else 0)
+
+    def _timeout(self, method, kwargs):
+        if kwargs.get('timeout') is None and method in self.timeouts:
+            kwargs['timeout'] = self.timeouts[method]
+        return kwargs
+
+    def _outcome(self, breaker, response, error):
+        """
+        :return: True if the attempt failed and may be retried
+        """
+        if error is None and response.status_code not in RETRY_STATUSES:
+            breaker.record_success()
+            return False
+        breaker.record_failure()
+        return True
+
+    def call(self, method, send, errors, **kwargs):
+        """
+        :param method: key of CdekApi.methods
+        :param send: function(**kwargs) returning a response
+        :param errors: network exceptions of the transport
+        :return: response
+        """
+        breaker = self.breaker(method)
+        attempts = self._attempts(method)
+        self._timeout(method, kwargs)
+        for attempt in range(attempts):
+            if not breaker.allow():
+                raise CircuitOpenError(method)
+            response, error = None, None
+            try:
+                response = send(**kwargs)
+            except errors as e:
+                error = e
+            except BaseException:
+                # cancelled or failed outside the transport, e.g. in the rate limiter
+                breaker.release()
+                raise
+            if not self._outcome(breaker, response, error) or attempt + 1 == attempts:
+                break
+            if response is not None:
+                response.close()
+            self.retry_counts[method] += 1
+            time.sleep(self.retry.delay(attempt))
+        if error is not None:
+            raise CdekAPIConnectionError(error) from error
+        return response
+
+    async def acall(self, method, send, errors, **kwargs):
+        """
+        Same as call for a coroutine function send
+        """
+        breaker = self.breaker(method)
+        attempts = self._attempts(method)
+        self._timeout(method, kwargs)
+        for attempt in range(attempts):
+            if not breaker.allow():
+                raise CircuitOpenError(method)
+            response, error = None, None
+            try:
+                response = await send(**kwargs)
+            except errors as e:
+                error = e
+            except BaseException:
+                # cancelled or failed outside the transport, e.g. in the rate limiter
+                breaker.release()
+                raise
+            if not self._outcome(breaker, response, error) or attempt + 1 == attempts:
+                break
+            self.retry_counts[method] += 1
+            await asyncio.sleep(self.retry.delay(attempt))
+        if error is not None:
+            raise CdekAPIConnectionError(error) from error
+        return response
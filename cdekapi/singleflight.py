@@ -0,0 +1,118 @@
+import asyncio
+import copy
+import threading
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error', 'followers')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    Identical calls made while one is in flight wait for it and share its outcome
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        :param key: hashable identity of the call
+        :param fn: function to call if no identical call is in flight
+        :return: fn result, followers get a deep copy of it
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                call.followers += 1
+                self.coalesced += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            if call.error is None and call.followers:
+                # the caller is free to change its result, followers copy a snapshot
+                call.result = copy.deepcopy(result)
+            call.event.set()
+        return result
+
+    @property
+    def stats(self):
+        return {'calls': self.calls, 'coalesced': self.coalesced}
+
+
+# result of a cancelled leader, none of its followers was cancelled
+_TAKE_OVER = object()
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines of one event loop
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._followers = {}
+
+    async def do(self, key, fn, *args, **kwargs):
+        """
+        :param key: hashable identity of the call
+        :param fn: coroutine function to await if no identical call is in flight
+        :return: fn result, followers get a deep copy of it
+        """
+        future = self._calls.get(key)
+        while future is not None:
+            self.coalesced += 1
+            self._followers[key] += 1
+            result = await asyncio.shield(future)
+            if result is not _TAKE_OVER:
+                return copy.deepcopy(result)
+            # the leader was cancelled, the first follower to wake up makes the call for the others
+            self.coalesced -= 1
+            future = self._calls.get(key)
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        self._followers[key] = 0
+        self.calls += 1
+        try:
+            result = await fn(*args, **kwargs)
+            future.set_result(copy.deepcopy(result) if self._followers[key] else None)
+            return result
+        except asyncio.CancelledError:
+            future.set_result(_TAKE_OVER)
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # mark it retrieved when nobody was waiting
+            future.exception()
+            raise
+        finally:
+            del self._calls[key]
+            del self._followers[key]
+
+    @property
+    def stats(self):
+        return {'calls': self.calls, 'coalesced': self.coalesced}
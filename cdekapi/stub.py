@@ -0,0 +1,93 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from cdekapi import CdekApi
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes, Nagle would hold the body for the delayed ACK
+    disable_nagle_algorithm = True
+
+    def handle_stub(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        path = urlparse(self.path).path
+        if self.server.record:
+            self.server.calls.append((self.command, self.path, body))
+            self.server.peers.add(self.client_address)
+        route = self.server.routes.get(path)
+        if route is None:
+            status, content_type, payload = 404, 'text/plain', b'not found'
+        else:
+            status, content_type, payload = route(self, body) if callable(route) else route
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = handle_stub
+    do_POST = handle_stub
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer:
+    """
+    Local CDEK replacement serving canned responses over keep-alive HTTP/1.1, for the tests and the benchmarks
+    """
+
+    def __init__(self, routes=None, port=0, record=True):
+        """
+        Start serving in a background thread
+        :param routes: dict of path -> (status, content type, payload) or function(handler, body) returning it
+        :param port: 0 picks a free one
+        :param record: keep the requests in calls and the client addresses in peers
+        """
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.routes = routes if routes is not None else self.default_routes()
+        self.httpd.record = record
+        self.httpd.calls = []
+        self.httpd.peers = set()
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def default_routes(self):
+        return {}
+
+    @property
+    def routes(self):
+        return self.httpd.routes
+
+    @property
+    def calls(self):
+        return self.httpd.calls
+
+    @property
+    def peers(self):
+        return self.httpd.peers
+
+    def api(self, cls=CdekApi, **kwargs):
+        """
+        :return: client of the cls sending every method to the stub
+        """
+        api = cls('login', 'password', **kwargs)
+        host, port = self.httpd.server_address
+        api.methods = {key: f'http://{host}:{port}/{key}' for key in api.methods}
+        return api
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
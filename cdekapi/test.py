@@ -1,9 +1,85 @@
 import unittest
+import asyncio
 import datetime
+import os
+import tempfile
+import json
+import sqlite3
+import sys
+import threading
+import time
+import tracemalloc
 import xml.etree.ElementTree as ET
 import uuid
+from hashlib import md5
+from types import SimpleNamespace
+from urllib.parse import parse_qs
 
-from cdekapi import CdekApi, CdekAPIError
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from cdekapi import CdekApi, CdekAPIError, CdekAPIConnectionError, CircuitOpenError, CdekAPIValidationError
+from cdekapi.stub import StubServer as BaseStubServer
+from cdekapi.transport import HttpTransport
+from cdekapi.aio import AsyncCdekApi
+from cdekapi.cache import QuoteCache, MemoryBackend, CacheBackend
+from cdekapi.bulk import BulkStats, run_bulk
+from cdekapi.singleflight import AsyncSingleFlight
+from cdekapi.pvz_index import PvzIndex
+from cdekapi.disk_cache import PvzDiskCache
+from cdekapi.order_xml import orders_xml, orders_tree
+from cdekapi.order_queue import OrderQueue
+from cdekapi.pool import CdekApiPool, Account, BY_CITY, LEAST_LOADED
+from cdekapi.warmup import Warmer, WarmupScheduler, QuoteSnapshot, load_specs, specs_from_cache
+from cdekapi.ranking import TariffRanker
+from cdekapi.quantize import Quantizer, round_up, billable_weight
+from cdekapi.models import Quote, TariffQuote, Pvz, Order
+from cdekapi.tracking import StatusTracker
+from cdekapi.resilience import Resilience, RetryPolicy, CircuitBreaker
+from cdekapi import eligibility
+from cdekapi.instrumentation import Instrumentation, HistogramCollector, Hook, NOOP_SPAN
+from cdekapi.codec import get_codec, available_codecs, JsonCodec, StdlibCodec
+from cdekapi.ratelimit import RateLimiter, EndpointLimit, TokenBucket, SqliteTokenBucket, PriorityGate, priority, BULK
+
+
+CALC_PRICE_RESPONSE = {
+    'result': {
+        'price': '1050.5',
+        'deliveryPeriodMin': 1,
+        'deliveryPeriodMax': 2,
+        'deliveryDateMin': '2020-01-02',
+        'deliveryDateMax': '2020-01-03',
+        'tariffId': 136,
+        'priceByCurrency': 1050.5,
+        'currency': 'RUB',
+    }
+}
+
+PVZ_XML = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<PvzList>'
+    '<Pvz Code="NSK1" Name="Академгородок" CityCode="270" City="Новосибирск" '
+    'Address="Ильича, 6" AddressComment="" Note="" Phone="+7383" '
+    'coordX="83.1" coodrY="54.8" Type="PVZ" AllowedCod="1"/>'
+    '<Pvz Code="NSK2" Name="Центр" CityCode="270" City="Новосибирск" '
+    'Address="Ленина, 1" AddressComment="" Note="" Phone="+7383" '
+    'coordX="82.9" coodrY="55.0" Type="POSTOMAT" AllowedCod="0"/>'
+    '</PvzList>'
+)
+
+
+class StubServer(BaseStubServer):
+    """
+    Stub answering calc_price and pvz_list by default
+    """
+
+    def default_routes(self):
+        return {
+            '/calc_price': (200, 'application/json', json.dumps(CALC_PRICE_RESPONSE)),
+            '/pvz_list': (200, 'application/xml', PVZ_XML),
+        }
 
 
 class PostTest(unittest.TestCase):
@@ -254,5 +330,1560 @@ class OrderTest(unittest.TestCase):
         self.assertEqual('По указанным параметрам заказов не найдено', e.exception.args[0])
 
 
+class TransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubServer()
+        self.api = self.stub.api()
+
+    def tearDown(self):
+        self.api.close()
+        self.stub.stop()
+
+    def test_keep_alive(self):
+        for _ in range(3):
+            self.api.run('calc_price', {'dateExecute': '2020-1-1'})
+            self.api.get_xml('pvz_list', cityid=270)
+        self.assertEqual(len(self.stub.calls), 6)
+        self.assertEqual(len(self.stub.peers), 1)
+
+    def test_no_keep_alive(self):
+        api = self.stub.api(transport=HttpTransport(keep_alive=False))
+        for _ in range(2):
+            api.run('calc_price', {'dateExecute': '2020-1-1'})
+        self.assertEqual(len(self.stub.peers), 2)
+
+    def test_signature(self):
+        self.api.run('calc_price', {'dateExecute': '2020-1-1'})
+        data = json.loads(self.stub.calls[0][2])
+        self.assertEqual(data['authLogin'], 'login')
+        self.assertEqual(len(data['secure']), 32)
+
+    def test_connection_error(self):
+        with self.assertRaises(CdekAPIConnectionError):
+            self.api.post_xml('new_order', xml_request=b'<x/>')
+
+
+class CacheTest(unittest.TestCase):
+    goods = [{'weight': 0.3, 'length': 10, 'width': 7, 'height': 5}]
+
+    def setUp(self):
+        self.stub = StubServer()
+        self.cache = QuoteCache(maxsize=2)
+        self.api = self.stub.api(cache=self.cache)
+
+    def tearDown(self):
+        self.api.close()
+        self.stub.stop()
+
+    def test_hit(self):
+        res = self.api.calc_price(44, 137, self.goods, decimal_places=1)
+        res2 = self.api.calc_price(44, 137, self.goods)
+        self.assertEqual(res['result']['price'], 1050.5)
+        self.assertEqual(res2['result']['price'], 1050.0)
+        self.assertEqual(len(self.stub.calls), 1)
+        self.assertEqual(self.cache.stats['hits'], 1)
+        self.assertEqual(self.cache.stats['misses'], 1)
+
+    def test_incomplete_backend(self):
+        class NoLen(CacheBackend):
+            get = set = delete = clear = MemoryBackend.get
+
+        with self.assertRaises(TypeError):
+            NoLen()
+
+    def test_key_ignores_auth(self):
+        data = {'dateExecute': '2020-1-1', 'goods': []}
+        key = QuoteCache.key('calc_price', data)
+        data.update(authLogin='x', secure='y')
+        self.assertEqual(QuoteCache.key('calc_price', data), key)
+
+    def test_lru(self):
+        for receiver in (137, 138, 139, 137):
+            self.api.calc_price(44, receiver, self.goods)
+        self.assertEqual(len(self.stub.calls), 4)
+        self.assertEqual(self.cache.backend.evictions, 2)
+
+    def test_demand_threads(self):
+        cache = QuoteCache(maxsize=50)
+        errors = []
+
+        def lookups(n):
+            try:
+                for i in range(3000):
+                    cache.get('calc_price', {'n': n, 'i': i % 500})
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=lookups, args=(n,)) for n in range(4)]
+        interval = sys.getswitchinterval()
+        # switch threads often, so hot() and the pruning are interrupted mid-iteration
+        sys.setswitchinterval(1e-6)
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                cache.hot(10)
+        finally:
+            for thread in threads:
+                thread.join()
+            sys.setswitchinterval(interval)
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(cache.demand), 100)
+
+    def test_expiry(self):
+        backend = MemoryBackend()
+        backend.set('a', 1, 0)
+        self.assertIsNone(backend.get('a'))
+        self.assertLessEqual(QuoteCache(ttl=10 ** 6).expires(), time.time() + 86400)
+
+
+CALC_PRICES_RESPONSE = {
+    'result': [
+        {'status': True, 'tariffId': 136, 'result': {'price': '300', 'deliveryPeriodMin': 2,
+                                                     'deliveryPeriodMax': 3}},
+        {'status': False, 'tariffId': 1, 'result': {'errors': {'code': 3, 'message': 'no'}}},
+    ]
+}
+
+
+def calc_prices_route(handler, body):
+    data = json.loads(body)
+    if data['receiverCityId'] == 0:
+        return 200, 'application/json', json.dumps({'error': [{'code': 3, 'text': 'no route'}]})
+    return 200, 'application/json', json.dumps(CALC_PRICES_RESPONSE)
+
+
+class BulkTest(unittest.TestCase):
+    goods = [{'weight': 0.3, 'length': 10, 'width': 7, 'height': 5}]
+
+    def setUp(self):
+        self.stub = StubServer()
+        self.stub.routes['/calc_prices'] = calc_prices_route
+        self.api = self.stub.api()
+
+    def tearDown(self):
+        self.api.close()
+        self.stub.stop()
+
+    def test_bulk(self):
+        specs = [{'sender_city_id': 44, 'receiver_city_id': city, 'goods': self.goods,
+                  'tariff_list': [{'id': 136}, {'id': 1}]} for city in (137, 138, 0, 137)]
+        stats = BulkStats()
+        seen = []
+        res = list(self.api.calc_prices_bulk(specs, max_concurrency=3, stats=stats,
+                                             progress=lambda s: seen.append(s.done)))
+        self.assertEqual(len(res), 4)
+        self.assertEqual(len(self.stub.calls), 3)
+        self.assertEqual(stats.unique, 3)
+        self.assertEqual(stats.errors, 1)
+        self.assertEqual(seen, [1, 2, 3])
+        failed = [r for r in res if not r.ok]
+        self.assertEqual(failed[0].error.args[0]['error'][0]['code'], 3)
+        self.assertEqual([r for r in res if r.ok][0].result['result'][0]['result']['price'], 300.0)
+
+    def test_stop_early(self):
+        calls = []
+
+        def call(n):
+            calls.append(n)
+            time.sleep(0.01)
+
+        results = run_bulk(call, [{'n': n} for n in range(20)], max_concurrency=1)
+        next(results)
+        results.close()
+        self.assertLess(len(calls), 20)
+
+
+class IterPvzTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubServer()
+        self.api = self.stub.api()
+
+    def tearDown(self):
+        self.api.close()
+        self.stub.stop()
+
+    def test_iter_pvz(self):
+        res = list(self.api.iter_pvz(270, np_allowed=1, chunk_size=64))
+        self.assertEqual([p.id for p in res], ['NSK1', 'NSK2'])
+        self.assertEqual(res[0].name, 'Академгородок')
+        self.assertEqual(res[0].city_id, 270)
+        self.assertEqual((res[0].latitude, res[0].longitude), (54.8, 83.1))
+        self.assertIs(res[0].np_allowed, True)
+        self.assertTrue(self.stub.calls[0][1].endswith('?cityid=270&allowedcod=1'))
+
+    def test_as_pvz_dict(self):
+        records = [p.as_pvz_dict() for p in self.api.iter_pvz(270, np_allowed=1)]
+        self.assertEqual(records, self.api.get_pvz_list(270, 1))
+
+    def test_flat_memory(self):
+        point = PVZ_XML[PVZ_XML.index('<Pvz '):PVZ_XML.index('/>') + 2]
+        xml = ('<PvzList>' + point * 20000 + '</PvzList>').encode('utf-8')
+        self.stub.routes['/pvz_list'] = (200, 'application/xml', xml)
+        tracemalloc.start()
+        count = sum(1 for _ in self.api.iter_pvz())
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.assertEqual(count, 20000)
+        self.assertLess(peak, len(xml) / 4)
+
+
+class PvzDiskCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.stub = StubServer()
+
+    def tearDown(self):
+        self.stub.stop()
+        self.dir.cleanup()
+
+    def api(self, **kwargs):
+        return self.stub.api(pvz_cache=PvzDiskCache(self.dir.name, **kwargs))
+
+    def test_shared_snapshot(self):
+        with self.api() as api:
+            res = api.get_pvz_list(270, 1)
+        self.assertEqual([p['id'] for p in res], ['NSK1', 'NSK2'])
+        # a new worker starts from the disk snapshot
+        with self.api() as api:
+            self.assertEqual(api.get_pvz_list(270, 1), res)
+            self.assertEqual(api.pvz_cache.stats['hits'], 1)
+        self.assertEqual(len(self.stub.calls), 1)
+
+    def test_stale_refresh(self):
+        with self.api(max_age=0) as api:
+            api.get_pvz_list(270, 1)
+            mtime = os.stat(api.pvz_cache.path(('pvz_list', 270, 1))).st_mtime
+            time.sleep(0.01)
+            self.assertEqual(len(api.get_pvz_list(270, 1)), 2)
+            for _ in range(100):
+                if api.pvz_cache.stats['refreshes'] == 2:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(len(self.stub.calls), 2)
+            self.assertGreater(os.stat(api.pvz_cache.path(('pvz_list', 270, 1))).st_mtime, mtime)
+
+    def test_stale_if_error(self):
+        with self.api(max_age=0, stale_ttl=0) as api:
+            res = api.get_pvz_list(270, None)
+            self.stub.routes['/pvz_list'] = (500, 'text/plain', 'down')
+            self.assertEqual(api.get_pvz_list(270, None), res)
+            self.assertEqual(api.pvz_cache.stats['errors'], 1)
+            self.assertFalse(os.path.exists(api.pvz_cache.path(('pvz_list', 270, None)) + '.lock'))
+
+
+class ModelsTest(unittest.TestCase):
+
+    def test_quote(self):
+        quote = Quote.from_json(CALC_PRICE_RESPONSE['result'])
+        self.assertEqual(quote.price, 1050.5)
+        self.assertEqual(quote.period_max, 2)
+        self.assertEqual(quote['deliveryPeriodMin'], 1)
+        self.assertEqual(dict(quote)['tariffId'], 136)
+        self.assertFalse(hasattr(quote, '__dict__'))
+
+    def test_tariff_quotes(self):
+        ok, failed = TariffQuote.list_from_json(CALC_PRICES_RESPONSE)
+        self.assertTrue(ok.status)
+        self.assertEqual((ok.tariff_id, ok.price, ok.period_min), (136, 300.0, 2))
+        self.assertFalse(failed.status)
+        self.assertEqual((failed.tariff_id, failed.price, failed.error_code), (1, None, 3))
+
+    def test_pvz(self):
+        pvz = Pvz.from_attrib(ET.fromstring(PVZ_XML)[1].attrib)
+        self.assertEqual((pvz.latitude, pvz.longitude, pvz.np_allowed), (55.0, 82.9, False))
+        self.assertEqual(pvz.get('name'), 'Центр')
+        self.assertEqual(set(pvz), set(Pvz.__slots__))
+
+
+class PvzIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubServer()
+        self.api = self.stub.api()
+        self.index = PvzIndex(self.api, cell_size=0.1)
+
+    def tearDown(self):
+        self.index.close()
+        self.api.close()
+        self.stub.stop()
+
+    def test_queries(self):
+        self.assertEqual(self.index.refresh(), {'added': 2, 'updated': 0, 'removed': 0})
+        self.assertEqual(self.index.get('NSK1')['name'], 'Академгородок')
+        self.assertEqual(len(self.index.by_city(270)), 2)
+        self.assertEqual([p['id'] for p in self.index.by_city(270, np_allowed=1)], ['NSK1'])
+        self.assertEqual([p['id'] for p in self.index.find(pvz_type='POSTOMAT')], ['NSK2'])
+        self.assertEqual((self.index.get('NSK1')['latitude'], self.index.get('NSK1')['longitude']), (54.8, 83.1))
+        res = self.index.nearest(55.05, 82.95, n=2)
+        self.assertEqual([p['id'] for d, p in res], ['NSK2', 'NSK1'])
+        self.assertLess(res[0][0], res[1][0])
+
+    def test_nearest_distance(self):
+        # A is 0.3 degrees east (19.1 km), B 0.25 degrees north (27.8 km) of the query point
+        self.stub.routes['/pvz_list'] = (200, 'application/xml', PVZ_XML.replace(
+            'coordX="83.1" coodrY="54.8"', 'coordX="83.3" coodrY="55.0"').replace(
+            'coordX="82.9" coodrY="55.0"', 'coordX="83.0" coodrY="55.25"'))
+        self.index.refresh()
+        res = self.index.nearest(55.0, 83.0, n=2)
+        self.assertEqual([p['id'] for d, p in res], ['NSK1', 'NSK2'])
+        self.assertAlmostEqual(res[0][0], 19.1, delta=0.1)
+        self.assertAlmostEqual(res[1][0], 27.8, delta=0.1)
+
+    def test_incremental(self):
+        self.index.refresh()
+        self.assertEqual(self.index.refresh(), {'added': 0, 'updated': 0, 'removed': 0})
+        self.stub.routes['/pvz_list'] = (200, 'application/xml',
+                                         PVZ_XML.replace('Центр', 'Вокзал').replace(
+                                             '<Pvz Code="NSK1"', '<Pvz Code="NSK3"'))
+        self.assertEqual(self.index.refresh(), {'added': 1, 'updated': 1, 'removed': 1})
+        self.assertIsNone(self.index.get('NSK1'))
+
+    def test_background(self):
+        self.index.start(interval=60, cities=[270])
+        for _ in range(100):
+            if len(self.index):
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(self.index), 2)
+        self.assertIn('cityid=270', self.stub.calls[0][1])
+
+
+NEW_ORDER_RESPONSE = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<response><Order Number="1" DispatchNumber="1105070470" Msg="ok"/></response>'
+)
+
+
+def make_order(number):
+    return {
+        'number': number, 'sender_city': 44, 'receiver_city': 137, 'tarifftypecode': 136,
+        'deliveryrecipientcost': 0, 'recipientname': 'Иванов', 'recepientemail': 'a@a.ru',
+        'phone': '5566656595', 'address': {'pvzcode': 'SPB10'},
+        'packages': [{'weight': 100, 'length': 40, 'width': 30, 'height': 30, 'items': [
+            {'amount': 1, 'warekey': 'АРТ', 'cost': 1000, 'payment': 0, 'weight': 100, 'comment': ''}
+        ]}],
+    }
+
+
+def new_orders_route(handler, body):
+    request = ET.fromstring(parse_qs(body.decode('utf-8'))['xml_request'][0])
+    response = ET.Element('response')
+    for order in request.iter('order'):
+        number = order.get('number')
+        if number.startswith('bad'):
+            ET.SubElement(response, 'Order', Number=number, ErrorCode='ERR_INVALID', Msg='bad order')
+        else:
+            ET.SubElement(response, 'Order', Number=number, DispatchNumber='D' + number)
+    ET.SubElement(response, 'Order', Msg=f'Добавлено заказов {request.get("ordercount")}')
+    return 200, 'application/xml', ET.tostring(response, encoding='utf-8')
+
+
+class OrderXmlTest(unittest.TestCase):
+
+    def test_same_as_element_tree(self):
+        order = make_order('1')
+        order['recipientname'] = 'Иванов & "сын" <ООО>\r\n\t'
+        order['packages'].append({'weight': 1, 'length': 1, 'width': 2, 'height': 3, 'items': []})
+        pvz = dict(make_order('2'), address={'pvzcode': 'NSK1'}, packages=[])
+        orders = [order, pvz]
+        self.assertEqual(orders_xml('login', 'pass&word', orders, 5), orders_tree('login', 'pass&word', orders, 5))
+        self.assertIn(b'recipientname="\xd0\x98\xd0\xb2\xd0\xb0\xd0\xbd\xd0\xbe\xd0\xb2 &amp; &quot;',
+                      orders_xml('login', 'password', orders))
+
+    def test_not_a_string(self):
+        order = make_order('1')
+        order['packages'][0]['items'][0]['warekey'] = 7
+        with self.assertRaises(TypeError):
+            orders_xml('login', 'password', [order])
+        rejected = []
+        res = ET.fromstring(orders_xml('login', 'password', [order, make_order('2')], rejected=rejected))
+        self.assertEqual(res.get('ordercount'), '1')
+        self.assertEqual([o.get('number') for o in res], ['2'])
+        self.assertIs(rejected[0][0], order)
+
+
+class OrderModelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubServer()
+        self.stub.routes['/new_order'] = new_orders_route
+        self.api = self.stub.api()
+
+    def tearDown(self):
+        self.api.close()
+        self.stub.stop()
+
+    def test_same_document(self):
+        order = make_order('1')
+        order['address'] = {'street': 'Ленина', 'house': 1, 'flat': 2}
+        model = Order.from_dict(order)
+        self.assertEqual(model.problems(), [])
+        self.assertEqual(dict(model)['address'], order['address'])
+        self.assertEqual(self.api._order_xml(model), self.api._order_xml(order))
+
+    def test_all_problems(self):
+        order = make_order('1')
+        del order['phone']
+        order['address'] = {'street': 'Ленина'}
+        order['tarifftypecode'] = 59
+        order['packages'][0]['weight'] = 6000
+        order['packages'][0]['items'][0].update(amount=0, weight=7000, warekey=None)
+        problems = Order.from_dict(order).problems()
+        self.assertEqual(problems, [
+            'phone: required',
+            'address: street and house or pvzcode required',
+            'packages[0].items[0].warekey: required',
+            'packages[0].items[0].amount: 0 is less than 1',
+            'tarifftypecode: 6 kg exceeds the 5 kg restriction of tariff 59',
+        ])
+        order['packages'][0]['items'][0].update(amount=1)
+        self.assertIn('packages[0].weight: 6000 g is less than the 7000 g of its items',
+                      Order.from_dict(order).problems())
+
+    def test_malformed_values(self):
+        order = make_order('1')
+        order['tarifftypecode'] = 'nan'
+        order['packages'][0]['items'][0]['amount'] = 'inf'
+        order['packages'][0]['items'].append(None)
+        order['packages'].append('box')
+        self.assertEqual(Order.from_dict(order).problems(), [
+            "tarifftypecode: 'nan' is not a finite number",
+            "packages[0].items[0].amount: 'inf' is not a finite number",
+            'packages[0].items[1]: must be a mapping',
+            'packages[1]: must be a mapping',
+        ])
+        order['tarifftypecode'] = float('inf')
+        self.assertIn('tarifftypecode: inf is not a finite number', Order.from_dict(order).problems())
+
+    def test_rejected_locally(self):
+        bad = Order.from_dict(dict(make_order('2'), packages=[]))
+        with self.assertRaises(CdekAPIValidationError) as e:
+            self.api.new_order(bad)
+        self.assertEqual(e.exception.problems, ['packages: at least one package required'])
+        res = self.api.new_orders([Order.from_dict(make_order('1')), bad])
+        self.assertEqual([r.ok for r in res], [True, False])
+        self.assertEqual(res[1].msg, 'packages: at least one package required')
+        self.assertEqual(len(self.stub.calls), 1)
+
+
+def status_by_number_route(known):
+    def route(handler, body):
+        request = ET.fromstring(parse_qs(body.decode('utf-8'))['xml_request'][0])
+        response = ET.Element('StatusReport')
+        for order in request.iter('order'):
+            number = order.get('number')
+            if number in known:
+                ET.SubElement(response, 'Order', Number=number, DispatchNumber=known[number])
+            else:
+                ET.SubElement(response, 'Order', Number=number, ErrorCode='ERR_ORDER_NOTFIND')
+        return 200, 'application/xml', ET.tostring(response, encoding='unicode')
+    return route
+
+
+class OrderQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'orders.db')
+        self.stub = StubServer()
+        self.stub.routes['/new_order'] = new_orders_route
+        self.api = self.stub.api()
+        self.queue = OrderQueue(self.api, self.path, batch_size=10, interval=0.05)
+
+    def tearDown(self):
+        self.queue.close()
+        self.api.close()
+        self.stub.stop()
+        self.dir.cleanup()
+
+    def sent_numbers(self):
+        return [order.get('number') for call in self.stub.calls if call[1] == '/new_order'
+                for order in ET.fromstring(parse_qs(call[2].decode('utf-8'))['xml_request'][0])]
+
+    def test_process(self):
+        self.assertEqual(self.queue.enqueue_many([make_order('1'), make_order('bad2'), make_order('1')]), 2)
+        self.assertFalse(self.queue.enqueue(make_order('1')))
+        self.assertEqual(self.queue.process(), 2)
+        self.assertEqual(self.queue.dispatch_numbers(), {'1': 'D1'})
+        self.assertEqual(self.queue.get('bad2')['error_code'], 'ERR_INVALID')
+        self.assertEqual(self.queue.stats, {'sent': 1, 'failed': 1})
+        self.assertEqual(self.queue.process(), 0)
+
+    def test_restart_reconciles(self):
+        self.queue.enqueue_many([make_order('1'), make_order('2')])
+        # crash after the orders were taken for sending, the lease has run out by the restart
+        self.queue.lease_timeout = -1
+        self.queue._claim(10)
+        self.queue.close()
+        self.queue = OrderQueue(self.api, self.path, batch_size=10)
+        self.assertEqual(self.queue.stats, {'uncertain': 2})
+        self.stub.routes['/status'] = status_by_number_route({'1': 'D1'})
+        self.assertEqual(self.queue.reconcile(), 2)
+        self.assertEqual(self.queue.get('1')['state'], 'sent')
+        self.assertEqual(self.queue.get('2')['state'], 'pending')
+        self.queue.process()
+        self.assertEqual(self.sent_numbers(), ['2'])
+        self.assertEqual(self.queue.dispatch_numbers(), {'1': 'D1', '2': 'D2'})
+
+    def test_none_found(self):
+        self.queue.enqueue_many([make_order('1'), make_order('2')])
+        self.queue.lease_timeout = -1
+        self.queue._claim(10)
+        self.stub.routes['/status'] = (200, 'application/xml',
+                                       '<StatusReport ErrorCode="ERR_ORDERS_NOT_FOUND" '
+                                       'Msg="По указанным параметрам заказов не найдено"/>')
+        self.assertEqual(self.queue.reconcile(), 2)
+        self.assertEqual(self.queue.stats, {'pending': 2})
+        self.queue.process()
+        self.assertEqual(self.queue.dispatch_numbers(), {'1': 'D1', '2': 'D2'})
+
+    def test_other_error_stays_uncertain(self):
+        self.queue.enqueue(make_order('1'))
+        self.queue.lease_timeout = -1
+        self.queue._claim(10)
+        self.stub.routes['/status'] = (200, 'application/xml', '<StatusReport ErrorCode="ERR_AUTH" Msg="auth"/>')
+        self.assertEqual(self.queue.reconcile(), 0)
+        self.assertEqual(self.queue.get('1')['state'], 'uncertain')
+
+    def test_shared_database(self):
+        self.queue.enqueue_many([make_order('1'), make_order('2')])
+        self.queue._claim(1)
+        # another process opening the file leaves the batch being sent alone
+        other = OrderQueue(self.api, self.path, batch_size=10)
+        try:
+            self.assertEqual(other.reconcile(), 0)
+            self.assertEqual(other.stats, {'sending': 1, 'pending': 1})
+            self.assertEqual(other.process(), 1)
+            self.assertEqual(self.sent_numbers(), ['2'])
+        finally:
+            other.close()
+
+    def test_request_error(self):
+        self.stub.routes['/new_order'] = (200, 'application/xml',
+                                          '<response><Order ErrorCode="ERR_AUTH" Msg="auth"/></response>')
+        self.queue.max_attempts = 2
+        self.queue.enqueue_many([make_order('1'), make_order('2')])
+        self.assertEqual(self.queue.process(), 0)
+        self.assertEqual(self.queue.stats, {'pending': 2})
+        self.assertEqual(self.queue.get('1')['error_code'], 'ERR_AUTH')
+        # backing off
+        self.assertEqual(self.queue.process(), 0)
+        self.assertEqual(len(self.sent_numbers()), 2)
+        self.queue.retry_delay = 0
+        self.queue._db().execute('UPDATE orders SET not_before = 0')
+        self.queue.process()
+        self.assertEqual(self.queue.stats, {'failed': 2})
+        self.stub.routes['/new_order'] = new_orders_route
+        self.queue.enqueue(make_order('bad3'))
+        self.queue.process()
+        self.assertEqual(self.queue.get('bad3')['state'], 'failed')
+
+    def test_circuit_open(self):
+        breaker = self.api.resilience.breaker('new_order')
+        while breaker.state != CircuitBreaker.OPEN:
+            breaker.record_failure()
+        self.queue.enqueue(make_order('1'))
+        self.assertEqual(self.queue.process(), 0)
+        self.assertEqual(self.queue.process(), 0)
+        self.assertEqual(self.queue.get('1')['state'], 'pending')
+        self.assertEqual(self.queue.get('1')['attempts'], 0)
+        self.assertEqual(self.stub.calls, [])
+
+    def test_uncertain_lookup(self):
+        self.queue.enqueue_many([make_order('1'), make_order('2'), make_order('3')])
+        self.queue.lease_timeout = -1
+        self.queue._claim(10)
+        self.stub.routes['/status'] = (200, 'application/xml',
+                                       '<StatusReport><Order Number="1" ErrorCode="ERR_ORDER_NOTFIND"/>'
+                                       '<Order Number="2" ErrorCode="ERR_UNKNOWN"/></StatusReport>')
+        self.assertEqual(self.queue.reconcile(), 1)
+        self.assertEqual(self.queue.stats, {'pending': 1, 'uncertain': 2})
+        self.assertEqual(self.queue.get('1')['state'], 'pending')
+
+    def test_expired_sender(self):
+        self.queue.enqueue(make_order('1'))
+        self.queue.lease_timeout = -1
+        self.queue._claim(10)
+        self.stub.routes['/status'] = status_by_number_route({})
+        other = OrderQueue(self.api, self.path, batch_size=10)
+        try:
+            other.reconcile()
+            other.process()
+        finally:
+            other.close()
+        # the first sender comes back after its lease ran out
+        self.queue._update([('1', 'failed', None, 'ERR_X', 'late')], self.queue.owner)
+        self.assertEqual(self.queue.get('1')['state'], 'sent')
+        self.assertEqual(self.queue.dispatch_numbers(), {'1': 'D1'})
+
+    def test_network_error_is_uncertain(self):
+        self.stub.routes['/new_order'] = (500, 'text/plain', 'down')
+        self.queue.enqueue(make_order('1'))
+        self.queue.process()
+        self.assertEqual(self.queue.get('1')['state'], 'uncertain')
+        self.stub.routes['/status'] = (500, 'text/plain', 'down')
+        self.assertEqual(self.queue.reconcile(), 0)
+        self.assertEqual(self.queue.get('1')['state'], 'uncertain')
+
+    def test_background_reconcile_backs_off(self):
+        self.queue.enqueue(make_order('1'))
+        self.queue.lease_timeout = -1
+        self.queue._claim(10)
+        self.stub.routes['/status'] = (200, 'application/xml',
+                                       '<StatusReport><Order Number="1" ErrorCode="ERR_UNKNOWN"/></StatusReport>')
+        self.queue.interval = 0.01
+        self.queue.reconcile_interval = 0.05
+        self.queue.max_reconcile_interval = 0.2
+        self.queue.start()
+        time.sleep(0.5)
+        self.queue.stop()
+        lookups = sum(1 for call in self.stub.calls if call[1] == '/status')
+        # 0, 0.05, 0.15 and 0.35 seconds in, not every interval in every worker
+        self.assertGreaterEqual(lookups, 2)
+        self.assertLessEqual(lookups, 5)
+        self.assertEqual(self.queue.get('1')['state'], 'uncertain')
+
+    def test_background(self):
+        self.queue.start()
+        self.queue.enqueue_many([make_order(str(i)) for i in range(25)])
+        self.assertTrue(self.queue.drain(timeout=10))
+        self.assertEqual(self.queue.stats, {'sent': 25})
+        self.assertEqual(sorted(self.sent_numbers(), key=int), [str(i) for i in range(25)])
+
+
+class NewOrdersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubServer()
+        self.stub.routes['/new_order'] = new_orders_route
+        self.api = self.stub.api()
+
+    def tearDown(self):
+        self.api.close()
+        self.stub.stop()
+
+    def test_new_orders(self):
+        orders = [make_order(str(i)) for i in range(10)]
+        orders[3]['number'] = 'bad3'
+        del orders[7]['packages']
+        res = self.api.new_orders(orders, chunk_size=4)
+        self.assertEqual(len(self.stub.calls), 3)
+        self.assertEqual([r.number for r in res], [str(o['number']) for o in orders])
+        self.assertEqual([r.ok for r in res], [True] * 3 + [False] + [True] * 3 + [False] + [True] * 2)
+        self.assertEqual(res[0].dispatch_number, 'D0')
+        self.assertEqual((res[3].error_code, res[3].msg), ('ERR_INVALID', 'bad order'))
+        self.assertIn('invalid order', res[7].msg)
+
+    def test_chunk_failure(self):
+        self.stub.routes['/new_order'] = (500, 'text/plain', 'down')
+        res = self.api.new_orders([make_order('1'), make_order('2')])
+        self.assertEqual([r.ok for r in res], [False, False])
+        self.assertEqual(res[0].msg, 'down')
+
+
+class StatusTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.codes = {}
+        self.stub = StubServer()
+        self.stub.routes['/status'] = self.status_route
+        self.api = self.stub.api()
+        self.orders = [{'order_number': str(i), 'dispatch_number': str(1000 + i)} for i in range(5)]
+
+    def tearDown(self):
+        self.api.close()
+        self.stub.stop()
+
+    def status_route(self, handler, body):
+        request = ET.fromstring(parse_qs(body.decode('utf-8'))['xml_request'][0])
+        response = ET.Element('StatusReport')
+        for order in request.iter('order'):
+            dispatch_number = order.get('dispatch_number')
+            element = ET.SubElement(response, 'Order', Number=order.get('number'), DispatchNumber=dispatch_number)
+            code = self.codes.get(dispatch_number, 1)
+            ET.SubElement(element, 'Status', Date=f'2020-01-0{code}T10:00:00', Code=str(code),
+                          Description='Создан' if code == 1 else 'Принят на склад', CityCode='44')
+        return 200, 'application/xml', ET.tostring(response, encoding='utf-8')
+
+    def test_poll(self):
+        changes = []
+        tracker = StatusTracker(self.api, chunk_size=2, on_change=lambda s, p: changes.append((s, p)))
+        first = list(tracker.poll(self.orders))
+        self.assertEqual(len(self.stub.calls), 3)
+        self.assertEqual([s.code for s in first], [1] * 5)
+        self.assertEqual(first[0].city_code, 44)
+        self.assertEqual(list(tracker.poll(self.orders)), [])
+        self.codes['1003'] = 3
+        second = list(tracker.poll(self.orders))
+        self.assertEqual([(s.dispatch_number, s.code) for s in second], [('1003', 3)])
+        self.assertEqual(changes[-1][1].code, 1)
+        self.assertEqual(len(changes), 6)
+
+    def test_chunk_error(self):
+        tracker = StatusTracker(self.api, chunk_size=2)
+        self.stub.routes['/status'] = (200, 'application/xml', '<StatusReport ErrorCode="ERR" Msg="no"/>')
+        self.assertEqual(list(tracker.poll(self.orders)), [])
+        self.assertEqual(len(tracker.errors), 3)
+
+    def test_pool(self):
+        accounts = []
+        for login in ('a', 'b'):
+            api = self.stub.api()
+            api.login = login
+            accounts.append(Account(api))
+        with CdekApiPool(accounts) as pool:
+            pool.owners.update({'1000': 'a', '1001': 'b', '1002': 'a'})
+            statuses = list(StatusTracker(pool, chunk_size=5).poll(self.orders))
+        self.assertEqual(sorted(s.dispatch_number for s in statuses), [str(1000 + i) for i in range(5)])
+        requests = [ET.fromstring(parse_qs(call[2].decode('utf-8'))['xml_request'][0]) for call in self.stub.calls]
+        self.assertEqual(len(requests), 3)
+        self.assertEqual({r.get('account') for r in requests}, {'a', 'b'})
+
+
+class ResilienceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.failures = 0
+        self.stub = StubServer()
+        self.stub.routes['/calc_price'] = self.flaky_route
+        self.resilience = Resilience(RetryPolicy(retries=2, backoff=0), failure_threshold=3, reset_timeout=60)
+        self.api = self.stub.api(resilience=self.resilience)
+
+    def tearDown(self):
+        self.api.close()
+        self.stub.stop()
+
+    def flaky_route(self, handler, body):
+        if self.failures:
+            self.failures -= 1
+            return 503, 'text/plain', 'busy'
+        return 200, 'application/json', json.dumps(CALC_PRICE_RESPONSE)
+
+    def test_retry(self):
+        self.failures = 2
+        res = self.api.run('calc_price', {'dateExecute': '2020-1-1'})
+        self.assertEqual(res['result']['tariffId'], 136)
+        self.assertEqual(len(self.stub.calls), 3)
+        self.assertEqual(self.resilience.stats['calc_price'], {'state': 'closed', 'failures': 0, 'retries': 2})
+
+    def test_breaker(self):
+        self.failures = 10
+        with self.assertRaises(CdekAPIConnectionError):
+            self.api.run('calc_price', {'dateExecute': '2020-1-1'})
+        self.assertEqual(self.resilience.breakers['calc_price'].state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.api.run('calc_price', {'dateExecute': '2020-1-1'})
+        self.assertEqual(len(self.stub.calls), 3)
+
+    def test_half_open(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_probe_without_outcome(self):
+        resilience = Resilience(failure_threshold=1, reset_timeout=0)
+        resilience.breaker('calc_price').record_failure()
+
+        def broken(**kwargs):
+            raise sqlite3.OperationalError('database is locked')
+
+        async def hang(**kwargs):
+            await asyncio.sleep(10)
+
+        with self.assertRaises(sqlite3.OperationalError):
+            resilience.call('calc_price', broken, ())
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(asyncio.wait_for(resilience.acall('calc_price', hang, ()), 0.01))
+        self.assertEqual(resilience.breakers['calc_price'].state, CircuitBreaker.HALF_OPEN)
+        res = resilience.call('calc_price', lambda **kwargs: SimpleNamespace(status_code=200), ())
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(resilience.breakers['calc_price'].state, CircuitBreaker.CLOSED)
+
+    def test_not_idempotent(self):
+        self.stub.routes['/new_order'] = (503, 'text/plain', 'busy')
+        with self.assertRaises(CdekAPIConnectionError):
+            self.api.post_xml('new_order', xml_request=b'<x/>')
+        self.assertEqual(len(self.stub.calls), 1)
+
+    def test_network_error(self):
+        self.api.methods['calc_price'] = 'http://127.0.0.1:1/calc_price'
+        with self.assertRaises(CdekAPIConnectionError):
+            self.api.run('calc_price', {'dateExecute': '2020-1-1'})
+        self.assertEqual(self.resilience.retry_counts['calc_price'], 2)
+
+
+class EligibilityTest(unittest.TestCase):
+    goods = [{'weight': 8, 'length': 50, 'width': 40, 'height': 30}]
+
+    def setUp(self):
+        self.stub = StubServer()
+        self.stub.routes['/calc_prices'] = calc_prices_route
+        self.api = self.stub.api()
+
+    def tearDown(self):
+        self.api.close()
+        self.stub.stop()
+
+    def test_weight(self):
+        self.assertEqual(eligibility.goods_weight(self.goods), (8.0, 12.0))
+        self.assertIn(59, eligibility.tariffs_for_weight(5))
+        self.assertNotIn(59, eligibility.tariffs_for_weight(8))
+        self.assertIn(291, eligibility.tariffs_for_weight(8))
+
+    def test_filter(self):
+        tariffs = [{'id': 136}, {'id': 59}, {'id': 137}, {'id': 1000}]
+        kept, dropped = eligibility.filter_tariffs(tariffs, self.goods, eligibility.WAREHOUSE)
+        self.assertEqual(kept, [{'id': 136}, {'id': 1000}])
+        self.assertEqual(set(dropped), {59, 137})
+        self.assertIn('restriction', dropped[59])
+        kept, dropped = eligibility.filter_tariffs(tariffs, self.goods, use_volumetric=True)
+        self.assertEqual(set(dropped), {59})
+
+    def test_calc_prices(self):
+        res = self.api.calc_prices(44, 137, self.goods, tariff_list=[{'id': 136}, {'id': 59}], prefilter=True)
+        self.assertEqual(json.loads(self.stub.calls[0][2])['tariffList'], [{'id': 136}])
+        self.assertEqual(list(res['dropped']), [59])
+        self.assertEqual(res['result'][-1]['tariffId'], 59)
+
+    def test_nothing_left(self):
+        res = self.api.calc_prices(44, 137, self.goods, tariff_id=59, prefilter=True)
+        self.assertEqual(self.stub.calls, [])
+        self.assertFalse(res['result'][0]['status'])
+        with self.assertRaises(CdekAPIError) as e:
+            self.api.calc_price(44, 137, self.goods, tariff_list=[{'id': 59}], prefilter=True)
+        self.assertEqual(e.exception.args[0]['error'][0]['code'], 3)
+
+
+def tariff_list_route(handler, body):
+    data = json.loads(body)
+    result = []
+    for tariff in data['tariffList']:
+        tariff_id = tariff['id']
+        if tariff_id == 10:
+            result.append({'status': False, 'tariffId': tariff_id,
+                           'result': {'errors': {'code': 3, 'message': 'no'}}})
+        else:
+            result.append({'status': True, 'tariffId': tariff_id,
+                           'result': {'price': str(tariff_id * 10), 'deliveryPeriodMin': 1000 // tariff_id,
+                                      'deliveryPeriodMax': 1000 // tariff_id + 1, 'tariffId': tariff_id}})
+    return 200, 'application/json', json.dumps({'result': result})
+
+
+class BestTariffTest(unittest.TestCase):
+    goods = [{'weight': 2, 'length': 10, 'width': 10, 'height': 10}]
+
+    def setUp(self):
+        self.stub = StubServer()
+        self.stub.routes['/calc_prices'] = tariff_list_route
+        self.api = self.stub.api()
+
+    def tearDown(self):
+        self.api.close()
+        self.stub.stop()
+
+    def test_objectives(self):
+        res = self.api.best_tariff(44, 137, self.goods)
+        self.assertEqual(res.best.tariff_id, 1)
+        # tariff 7 is over its weight restriction, 10 is refused by the calculator
+        self.assertEqual(len(res), len(self.api.dicts.tariffs) - 2)
+        self.assertEqual(len(self.stub.calls), 4)
+        fastest = self.api.best_tariff(44, 137, self.goods, objective='period', limit=2)
+        self.assertEqual([q.tariff_id for q in fastest], [291, 293])
+        self.assertEqual(len(self.stub.calls), 4)
+
+    def test_delivery_type(self):
+        res = self.api.best_tariff(44, 137, self.goods, delivery_type=eligibility.WAREHOUSE)
+        self.assertEqual(res.best.tariff_id, 136)
+        self.assertTrue(all(self.api.dicts.tariffs[q.tariff_id]['delivery type'] in (2, 4) for q in res))
+
+    def test_errors(self):
+        self.stub.routes['/calc_prices'] = (200, 'application/json',
+                                            json.dumps({'error': [{'code': 2, 'text': 'auth failed'}]}))
+        for _ in range(2):
+            with self.assertRaises(CdekAPIError) as e:
+                self.api.best_tariff(44, 137, self.goods)
+            self.assertEqual(e.exception.code, 2)
+        self.assertEqual(len(self.stub.calls), 8)
+        self.stub.routes['/calc_prices'] = (200, 'application/json',
+                                            json.dumps({'error': [{'code': 3, 'text': 'no route'}]}))
+        self.assertIsNone(self.api.best_tariff(44, 137, self.goods).best)
+
+    def test_calc_prices_arguments(self):
+        self.assertEqual(self.api.best_tariff(44, 137, self.goods, decimal_places=0).best.price, 10)
+        with self.assertRaises(ValueError):
+            self.api.best_tariff(44, 137, self.goods, tariff_list=[{'id': 136}])
+
+    def test_lru(self):
+        self.api.ranker.maxsize = 1
+        for receiver in (137, 138, 137):
+            self.api.best_tariff(44, receiver, self.goods)
+        self.assertEqual(len(self.api.ranker._routes), 1)
+        self.assertEqual(len(self.stub.calls), 12)
+
+    def test_provisional(self):
+        self.api.ranker.ttl = 0
+        self.api.best_tariff(44, 137, self.goods)
+        calls = len(self.stub.calls)
+        res = self.api.best_tariff(44, 137, self.goods, provisional=True)
+        self.assertTrue(res.provisional)
+        self.assertEqual(res.best.tariff_id, 1)
+        for _ in range(100):
+            if len(self.stub.calls) == calls * 2 and not self.api.ranker._refreshing:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(self.stub.calls), calls * 2)
+
+
+class SingleFlightTest(unittest.TestCase):
+    goods = [{'weight': 0.3, 'length': 10, 'width': 7, 'height': 5}]
+
+    def setUp(self):
+        self.stub = StubServer()
+        self.stub.routes['/calc_price'] = self.slow_route
+        self.payload = json.dumps(CALC_PRICE_RESPONSE)
+        self.api = self.stub.api()
+
+    def tearDown(self):
+        self.api.close()
+        self.stub.stop()
+
+    def slow_route(self, handler, body):
+        time.sleep(0.2)
+        return 200, 'application/json', self.payload
+
+    def call_concurrently(self, fn, count=5):
+        results = [None] * count
+
+        def worker(i):
+            try:
+                results[i] = fn()
+            except Exception as e:
+                results[i] = e
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_calc_price(self):
+        res = self.call_concurrently(lambda: self.api.calc_price(44, 137, self.goods))
+        self.assertEqual(len(self.stub.calls), 1)
+        self.assertEqual([r['result']['price'] for r in res], [1050.0] * 5)
+        self.assertEqual(len({id(r) for r in res}), 5)
+        self.assertEqual(self.api.singleflight.stats, {'calls': 1, 'coalesced': 4})
+
+    def test_shared_error(self):
+        self.payload = json.dumps({'error': [{'code': 3, 'text': 'no route'}]})
+        res = self.call_concurrently(lambda: self.api.calc_price(44, 137, self.goods))
+        self.assertEqual(len(self.stub.calls), 1)
+        self.assertTrue(all(isinstance(r, CdekAPIError) for r in res))
+
+    def test_different_calls(self):
+        self.call_concurrently(lambda: self.api.calc_price(44, 137, self.goods), 2)
+        self.call_concurrently(lambda: self.api.calc_price(44, 138, self.goods), 2)
+        self.assertEqual(len(self.stub.calls), 2)
+
+
+class RateLimitTest(unittest.TestCase):
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=100, burst=2)
+        self.assertEqual(bucket.take(), 0)
+        self.assertEqual(bucket.take(), 0)
+        self.assertGreater(bucket.take(), 0)
+
+    def test_reserve(self):
+        bucket = TokenBucket(rate=1, burst=3)
+        self.assertEqual(bucket.take(reserve=2), 0)
+        self.assertGreater(bucket.take(reserve=2), 0)
+        self.assertEqual(bucket.take(), 0)
+
+    def test_bucket_error_releases_slot(self):
+        class LockedBucket:
+            def take(self, reserve=0):
+                raise sqlite3.OperationalError('database is locked')
+
+        limiter = RateLimiter({'calc_price': EndpointLimit(concurrency=1, bucket=LockedBucket())})
+        for _ in range(2):
+            with self.assertRaises(sqlite3.OperationalError):
+                with limiter.limit('calc_price'):
+                    pass
+        self.assertEqual(limiter.stats['calc_price']['active'], 0)
+
+    def test_shared_bucket(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'budget.sqlite')
+            first = SqliteTokenBucket(path, 'calc_price', rate=1, burst=2)
+            second = SqliteTokenBucket(path, 'calc_price', rate=1, burst=2)
+            self.assertEqual(first.take(), 0)
+            self.assertEqual(second.take(), 0)
+            self.assertGreater(first.take(), 0)
+            self.assertEqual(SqliteTokenBucket(path, 'status', rate=1).take(), 0)
+
+    def test_priority_gate(self):
+        gate = PriorityGate(1)
+        gate.acquire()
+        order = []
+
+        def worker(prio):
+            gate.acquire(prio)
+            order.append(prio)
+            gate.release()
+
+        threads = []
+        for prio in (BULK, BULK, 0):
+            threads.append(threading.Thread(target=worker, args=(prio,)))
+            threads[-1].start()
+            while gate.waiting < len(threads):
+                time.sleep(0.001)
+        gate.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [0, BULK, BULK])
+
+    def test_interactive_passes_waiting_bulk(self):
+        limit = EndpointLimit(rate=5, burst=2, concurrency=2, reserve=1)
+        limiter = RateLimiter({'calc_price': limit})
+
+        def bulk():
+            with priority(BULK):
+                with limiter.limit('calc_price'):
+                    pass
+
+        threads = [threading.Thread(target=bulk) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        while limit.throttled < 2:
+            time.sleep(0.001)
+        started = time.monotonic()
+        with limiter.limit('calc_price'):
+            self.assertLess(time.monotonic() - started, 0.1)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(limiter.stats['calc_price']['active'], 0)
+
+    def test_api_rate(self):
+        stub = StubServer()
+        limiter = RateLimiter({'calc_price': EndpointLimit(rate=20, burst=1, concurrency=2)})
+        api = stub.api(limiter=limiter)
+        try:
+            started = time.monotonic()
+            with priority(BULK):
+                for _ in range(4):
+                    api.run('calc_price', {'dateExecute': '2020-1-1'})
+            self.assertGreaterEqual(time.monotonic() - started, 0.14)
+            self.assertEqual(limiter.stats['calc_price']['throttled'], 3)
+            self.assertEqual(limiter.stats['calc_price']['active'], 0)
+        finally:
+            api.close()
+            stub.stop()
+
+
+class InstrumentationTest(unittest.TestCase):
+    goods = [{'weight': 0.3, 'length': 10, 'width': 7, 'height': 5}]
+
+    def setUp(self):
+        self.stub = StubServer()
+        self.stub.routes['/new_order'] = new_orders_route
+        self.collector = HistogramCollector()
+        self.spans = []
+        hook = Hook()
+        hook.on_end = self.spans.append
+        self.api = self.stub.api(instrumentation=Instrumentation([self.collector, hook]),
+                                 cache=QuoteCache())
+
+    def tearDown(self):
+        self.api.close()
+        self.stub.stop()
+
+    def test_run(self):
+        self.api.calc_price(44, 137, self.goods)
+        self.api.calc_price(44, 137, self.goods)
+        span = self.spans[0]
+        self.assertEqual(span.name, 'run')
+        self.assertEqual(set(span.phases), {'encode', 'upstream', 'ttfb', 'decode'})
+        self.assertEqual(span.attributes['status_code'], 200)
+        self.assertGreater(span.attributes['response_bytes'], 0)
+        counters = self.collector.snapshot()['counters']
+        self.assertEqual(counters['cache.hit=True.method=calc_price'], 1)
+        self.assertEqual(counters['cache.hit=False.method=calc_price'], 1)
+        self.assertEqual(counters['run.calc_price.status.200'], 1)
+        histograms = self.collector.snapshot()['histograms']
+        self.assertEqual(histograms['run.calc_price.total']['count'], 1)
+        self.assertEqual(histograms['run.calc_price.upstream']['count'], 1)
+        self.stub.routes['/calc_prices'] = calc_prices_route
+        self.api.calc_prices(44, 137, self.goods, tariff_list=[{'id': 136}])
+        self.assertEqual(self.collector.snapshot()['histograms']['run.calc_prices.total']['count'], 1)
+
+    def test_error_code(self):
+        self.stub.routes['/calc_price'] = (200, 'application/json',
+                                           json.dumps({'error': [{'code': 3, 'text': 'no'}]}))
+        with self.assertRaises(CdekAPIError):
+            self.api.calc_price(44, 137, self.goods)
+        self.assertEqual(self.spans[0].attributes['error_code'], 3)
+        self.assertEqual(self.spans[0].attributes['error_text'], self.api.dicts.errors[3])
+        self.assertEqual(self.collector.snapshot()['counters']['run.calc_price.exception.CdekAPIError'], 1)
+
+    def test_new_order(self):
+        self.api.new_order(make_order('1'))
+        names = [span.name for span in self.spans]
+        self.assertEqual(names, ['post_xml', 'new_order'])
+        self.assertEqual(set(self.spans[1].phases), {'build', 'parse'})
+        histogram = self.collector.histograms[('new_order', 'build')]
+        self.assertEqual(histogram.count, 1)
+        self.assertIsNotNone(histogram.quantile(0.5))
+
+    def test_noop(self):
+        api = self.stub.api()
+        self.assertEqual(api.instrumentation.hooks, [])
+        with api.instrumentation.span('run', method='calc_price') as span:
+            self.assertIs(span, NOOP_SPAN)
+            span.set('status_code', 200)
+            with span.phase('upstream'):
+                pass
+        api.calc_price(44, 137, self.goods)
+        api.close()
+        # the hooks of the instrumented client saw none of it
+        self.assertEqual(self.spans, [])
+        self.assertEqual(self.collector.snapshot(), {'histograms': {}, 'counters': {}})
+
+
+class CodecTest(unittest.TestCase):
+    data = {'version': '1.0', 'goods': [{'weight': 0.3}], 'comment': 'Новосибирск'}
+
+    def test_codecs(self):
+        for name in available_codecs():
+            codec = get_codec(name)
+            body = codec.dumps(self.data)
+            self.assertIsInstance(body, bytes)
+            self.assertIn('Новосибирск'.encode('utf-8'), body)
+            self.assertEqual(codec.loads(body), self.data)
+            self.assertEqual(json.loads(body), self.data)
+
+    def test_get_codec(self):
+        self.assertEqual(get_codec().name, available_codecs()[0])
+        codec = StdlibCodec()
+        self.assertIs(get_codec(codec), codec)
+        with self.assertRaises(ValueError):
+            get_codec('yaml')
+
+    def test_incomplete_codec(self):
+        class DumpsOnly(JsonCodec):
+            def dumps(self, data):
+                return b''
+
+        with self.assertRaises(TypeError):
+            DumpsOnly()
+
+    def test_client_codec(self):
+        stub = StubServer()
+        try:
+            with stub.api(codec='json') as api:
+                self.assertEqual(api.codec.name, 'json')
+                res = api.calc_price(44, 137, [{'weight': 0.3, 'length': 10, 'width': 7, 'height': 5}])
+            self.assertEqual(res['result']['price'], 1050)
+            self.assertEqual(json.loads(stub.calls[0][2])['senderCityId'], 44)
+        finally:
+            stub.stop()
+
+
+class PreparedQuoteTest(unittest.TestCase):
+    goods = [{'weight': 0.3, 'length': 10, 'width': 7, 'height': 5}]
+
+    def setUp(self):
+        self.stub = StubServer()
+        self.stub.routes['/calc_prices'] = calc_prices_route
+        self.api = self.stub.api()
+
+    def tearDown(self):
+        self.api.close()
+        self.stub.stop()
+
+    def test_same_request(self):
+        tariffs = [{'id': 136}, {'id': 137}]
+        quote = self.api.prepare_quote(44, 137, tariff_list=tariffs, services=[{'id': 2, 'param': 1000}])
+        prepared = quote(self.goods)
+        plain = self.api.calc_prices(44, 137, self.goods, tariff_list=tariffs, services=[{'id': 2, 'param': 1000}])
+        self.assertEqual(prepared, plain)
+        first, second = (json.loads(call[2]) for call in self.stub.calls)
+        self.assertEqual(first, second)
+
+    def test_signature(self):
+        quote = self.api.prepare_quote(44, 137, decimal_places=2)
+        self.assertEqual(quote(self.goods)['result']['price'], 1050.5)
+        quote(self.goods, datetime.date(2020, 1, 2))
+        first, second = (json.loads(call[2]) for call in self.stub.calls)
+        self.assertEqual(first['tariffId'], 136)
+        self.assertEqual(second['dateExecute'], '2020-1-2')
+        self.assertEqual(second['secure'], md5(b'2020-1-2&password').hexdigest())
+        self.assertNotEqual(first['secure'], second['secure'])
+
+
+def accounts_route(handler, body):
+    login = json.loads(body)['authLogin']
+    if login == 'expired':
+        return 200, 'application/json', json.dumps({'error': [{'code': 2, 'text': 'auth'}]})
+    if login == 'busy':
+        return 429, 'application/json', '{}'
+    return 200, 'application/json', json.dumps(CALC_PRICE_RESPONSE)
+
+
+class PoolTest(unittest.TestCase):
+    goods = [{'weight': 0.3, 'length': 10, 'width': 7, 'height': 5}]
+
+    def setUp(self):
+        self.stub = StubServer()
+        self.stub.routes['/calc_price'] = accounts_route
+        self.stub.routes['/new_order'] = (200, 'application/xml', NEW_ORDER_RESPONSE)
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def pool(self, logins, cities=None, **kwargs):
+        accounts = []
+        for login in logins:
+            api = self.stub.api(resilience=Resilience(retry=RetryPolicy(retries=0)))
+            api.login = login
+            accounts.append(Account(api, cities=(cities or {}).get(login)))
+        return CdekApiPool(accounts, **kwargs)
+
+    def logins(self):
+        return [json.loads(call[2])['authLogin'] for call in self.stub.calls if call[1] == '/calc_price']
+
+    def test_failover(self):
+        with self.pool(['expired', 'busy', 'good']) as pool:
+            for _ in range(3):
+                self.assertEqual(pool.calc_price(44, 137, self.goods)['result']['price'], 1050)
+            stats = pool.stats
+        self.assertEqual(self.logins(), ['expired', 'busy', 'good', 'good', 'good'])
+        self.assertEqual(stats['failovers'], 2)
+        self.assertEqual(stats['accounts']['expired']['disabled_reason'], 'auth')
+        self.assertEqual(stats['accounts']['busy']['disabled_reason'], 'throttled')
+
+    def test_all_failing(self):
+        with self.pool(['expired']) as pool:
+            with self.assertRaises(CdekAPIError) as e:
+                pool.calc_price(44, 137, self.goods)
+        self.assertEqual(e.exception.code, 2)
+
+    def test_by_city(self):
+        with self.pool(['msk', 'main'], cities={'msk': [44]}, policy=BY_CITY) as pool:
+            pool.calc_price(44, 137, self.goods)
+            pool.calc_price(137, 44, self.goods)
+        self.assertEqual(self.logins(), ['msk', 'main'])
+
+    def test_least_loaded(self):
+        with self.pool(['a', 'b'], policy=LEAST_LOADED) as pool:
+            pool.calc_price(44, 137, self.goods, account='a')
+            pool.calc_price(44, 137, self.goods)
+        self.assertEqual(self.logins(), ['a', 'b'])
+
+    def test_order_owner(self):
+        with self.pool(['a', 'b']) as pool:
+            pool.calc_price(44, 137, self.goods)
+            self.assertEqual(pool.new_order(make_order('1')), ('1', '1105070470'))
+        self.assertEqual(pool.owners, {'1105070470': 'b'})
+
+    def test_new_orders(self):
+        self.stub.routes['/new_order'] = new_orders_route
+        orders = [make_order(str(i)) for i in range(5)]
+        orders[4]['number'] = 'bad4'
+        with self.pool(['a', 'b'], max_owners=3) as pool:
+            res = pool.new_orders(orders, chunk_size=2, max_concurrency=1)
+        self.assertEqual([r.ok for r in res], [True] * 4 + [False])
+        accounts = [ET.fromstring(parse_qs(call[2].decode('utf-8'))['xml_request'][0]).get('account')
+                    for call in self.stub.calls]
+        self.assertEqual(accounts, ['a', 'b', 'a'])
+        self.assertEqual(pool.owners, {'D1': 'a', 'D2': 'b', 'D3': 'b'})
+
+    def test_new_orders_failover(self):
+        def route(handler, body):
+            request = ET.fromstring(parse_qs(body.decode('utf-8'))['xml_request'][0])
+            if request.get('account') == 'expired':
+                return 200, 'application/xml', '<response><Order ErrorCode="ERR_AUTH" Msg="auth"/></response>'
+            if request.get('account') == 'busy':
+                return 429, 'text/plain', 'busy'
+            return new_orders_route(handler, body)
+        self.stub.routes['/new_order'] = route
+        with self.pool(['expired', 'busy', 'good']) as pool:
+            res = pool.new_orders([make_order('1'), make_order('bad2')])
+            stats = pool.stats
+        self.assertEqual([r.ok for r in res], [True, False])
+        self.assertEqual(res[1].error_code, 'ERR_INVALID')
+        self.assertEqual(stats['failovers'], 2)
+        self.assertEqual(stats['accounts']['expired']['disabled_reason'], 'auth')
+        self.assertEqual(stats['accounts']['busy']['disabled_reason'], 'throttled')
+        self.assertEqual(pool.owners, {'D1': 'good'})
+        # no account left, the refusal is kept on the results
+        with self.pool(['expired']) as pool:
+            res = pool.new_orders([make_order('1')])
+        self.assertEqual((res[0].error_code, res[0].request_error), ('ERR_AUTH', True))
+
+    def test_from_credentials(self):
+        pool = CdekApiPool.from_credentials([{'login': 'a', 'password': 'p'}], auth_cooldown=10,
+                                            throttle_cooldown=1, max_owners=5, test_mode=True)
+        with pool:
+            self.assertEqual((pool.auth_cooldown, pool.throttle_cooldown, pool.max_owners), (10, 1, 5))
+
+
+def tariff_prices_route(handler, body):
+    data = json.loads(body)
+    if data['receiverCityId'] == 0:
+        return 200, 'application/json', json.dumps({'error': [{'code': 3, 'text': 'no route'}]})
+    if data['receiverCityId'] == 1:
+        return 200, 'application/json', json.dumps({'error': [{'code': 2, 'text': 'auth'}]})
+    result = [{'status': True, 'tariffId': t['id'],
+               'result': {'price': str(t['id'] * 10), 'deliveryPeriodMin': 1, 'deliveryPeriodMax': 2}}
+              for t in data['tariffList']]
+    return 200, 'application/json', json.dumps({'result': result})
+
+
+class WarmupTest(unittest.TestCase):
+    goods = [{'weight': 1, 'length': 20, 'width': 20, 'height': 10}]
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.stub = StubServer()
+        self.stub.routes['/calc_prices'] = tariff_prices_route
+        self.api = self.stub.api()
+        self.tariffs = TariffRanker.candidates(self.goods)
+        self.chunks = -(-len(self.tariffs) // 4)
+
+    def tearDown(self):
+        self.api.close()
+        self.stub.stop()
+        self.dir.cleanup()
+
+    def specs(self, routes):
+        path = os.path.join(self.dir.name, 'routes.json')
+        with open(path, 'w') as f:
+            json.dump({'routes': routes, 'parcels': [self.goods]}, f)
+        return load_specs(path)
+
+    def test_snapshot(self):
+        snapshot = Warmer(self.api, self.specs([[44, 137], [44, 0]])).run()
+        self.assertEqual(len(self.stub.calls), 2 * self.chunks)
+        path = os.path.join(self.dir.name, 'quotes.snapshot')
+        snapshot.save(path)
+        snapshot = QuoteSnapshot.load(path)
+        self.assertTrue(snapshot.current)
+        quotes = snapshot.quotes(44, 137, self.goods)
+        self.assertEqual(len(quotes), len(self.tariffs))
+        self.assertEqual(quotes[0].price, min(t['id'] for t in self.tariffs) * 10)
+        self.assertEqual(snapshot.quote(44, 137, self.goods, 136).price, 1360)
+        self.assertEqual(snapshot.quotes(44, 0, self.goods), [])
+        self.assertIsNone(snapshot.quotes(44, 138, self.goods))
+
+    def test_errors(self):
+        warmer = Warmer(self.api, self.specs([[44, 0], [44, 1]]))
+        snapshot = warmer.run()
+        self.assertEqual(snapshot.quotes(44, 0, self.goods), [])
+        self.assertIsNone(snapshot.quotes(44, 1, self.goods))
+        self.assertEqual(warmer.last_stats['failed'], 1)
+
+    def test_budget(self):
+        warmer = Warmer(self.api, self.specs([[44, 137], [44, 138]]), budget=self.chunks + 1)
+        snapshot = warmer.run()
+        self.assertEqual(len(self.stub.calls), self.chunks)
+        self.assertEqual(len(snapshot), 1)
+        self.assertEqual(warmer.last_stats['routes'], 1)
+
+    def test_specs_from_cache(self):
+        cache = QuoteCache()
+        self.api.cache = cache
+        for receiver in (138, 137, 137):
+            self.api.calc_prices(44, receiver, self.goods, tariff_list=[{'id': 136}])
+        self.api.calc_prices(44, 137, self.goods, tariff_list=[{'id': 137}])
+        specs = specs_from_cache(cache)
+        self.assertEqual([spec['receiver_city_id'] for spec in specs], [137, 138])
+        self.assertEqual(specs[0]['goods'], self.goods)
+
+    def test_next_run(self):
+        scheduler = WarmupScheduler(Warmer(self.api, []), os.path.join(self.dir.name, 'quotes.snapshot'),
+                                    times=('07:00', '16:30'))
+        now = datetime.datetime(2026, 10, 17, 6, 0)
+        self.assertEqual(scheduler.next_run(now), datetime.datetime(2026, 10, 17, 7, 0))
+        self.assertEqual(scheduler.next_run(now.replace(hour=17)), datetime.datetime(2026, 10, 18, 0, 1))
+        scheduler.rollover = False
+        self.assertEqual(scheduler.next_run(now.replace(hour=17)), datetime.datetime(2026, 10, 18, 7, 0))
+
+
+class QuantizeTest(unittest.TestCase):
+    goods = [{'weight': 0.31, 'length': 12, 'width': 7, 'height': 5}]
+
+    def test_round_up(self):
+        self.assertEqual(round_up(0.31, 0.1), 0.4)
+        self.assertEqual(round_up(0.3, 0.1), 0.3)
+        self.assertEqual(round_up(12, 5), 15)
+        self.assertEqual(round_up(10, 5), 10)
+        self.assertEqual(round_up(0.7, 1, (0.5, 1, 2)), 1)
+        self.assertEqual(round_up(2.2, 1, (0.5, 1, 2)), 3)
+        self.assertIsNone(round_up(None, 1))
+
+    def test_never_lower(self):
+        quantizer = Quantizer(weight_step=0.5, dimension_step=10)
+        for aggregate in (False, True):
+            quantizer.aggregate = aggregate
+            for weight, size in ((0.31, 12), (1.2, 40), (2, 10)):
+                goods = [{'weight': weight, 'length': size, 'width': 7, 'height': 5}, {'weight': 0.1, 'volume': 0.002}]
+                res = quantizer.quantize(goods)
+                if aggregate and weight == 1.2:
+                    # one place weighing the billable 1.6 kg would lose the tariffs limited to 1.5 kg
+                    self.assertIs(res, goods)
+                else:
+                    self.assertEqual(len(res), 1 if aggregate else 2)
+                for raw, bucket in zip(eligibility.goods_weight(goods), eligibility.goods_weight(res)):
+                    self.assertGreaterEqual(bucket, raw - 1e-9)
+                self.assertGreaterEqual(billable_weight(res), billable_weight(goods) - 1e-9)
+
+    def test_aggregate_bulky(self):
+        goods = [{'weight': 10, 'length': 10, 'width': 10, 'height': 10},
+                 {'weight': 0.1, 'length': 50, 'width': 50, 'height': 40}]
+        self.assertAlmostEqual(billable_weight(goods), 30)
+        res = Quantizer(aggregate=True).quantize(goods)
+        self.assertEqual(len(res), 1)
+        self.assertGreaterEqual(billable_weight(res), 30)
+
+    def test_weight_restriction(self):
+        goods = [{'weight': 4.3, 'length': 10, 'width': 10, 'height': 10}]
+        self.assertIs(Quantizer(weight_buckets=(6,)).quantize(goods), goods)
+        self.assertEqual(Quantizer(weight_step=1).quantize(goods)[0]['weight'], 5)
+
+    def test_calc_price(self):
+        stub = StubServer()
+        quantizer = Quantizer()
+        api = stub.api(cache=QuoteCache(), quantizer=quantizer)
+        try:
+            api.calc_price(44, 137, self.goods)
+            api.calc_price(44, 137, [dict(self.goods[0], weight=0.35, length=14)])
+            api.calc_price(44, 137, self.goods, quantize=False)
+            self.assertEqual(len(stub.calls), 2)
+            self.assertEqual(json.loads(stub.calls[0][2])['goods'],
+                             [{'weight': 0.4, 'length': 15, 'width': 10, 'height': 5}])
+            self.assertEqual(quantizer.stats['requests'], 2)
+            self.assertEqual(quantizer.stats['gain'], 0.5)
+        finally:
+            api.close()
+            stub.stop()
+
+
+@unittest.skipIf(aiohttp is None, 'AsyncCdekApi requires aiohttp')
+class AsyncTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.stub = StubServer()
+        self.stub.routes['/new_order'] = (200, 'application/xml', NEW_ORDER_RESPONSE)
+        self.api = self.stub.api(cls=AsyncCdekApi)
+
+    async def asyncTearDown(self):
+        await self.api.close()
+        self.stub.stop()
+
+    async def test_calc_price_concurrent(self):
+        goods = [{'weight': 0.3, 'length': 10, 'width': 7, 'height': 5}]
+        res = await asyncio.gather(*[self.api.calc_price(44, 137, goods) for _ in range(10)])
+        self.assertEqual([r['result']['price'] for r in res], [1050.0] * 10)
+        self.assertEqual(await self.api.calc_price_num(44, 137, goods), 1050)
+
+    async def test_get_pvz_list(self):
+        res = await self.api.get_pvz_list(270, 1)
+        self.assertEqual(res[0]['name'], 'Академгородок')
+
+    async def test_coalescing(self):
+        res = await asyncio.gather(*[self.api.get_pvz_list(270, 1) for _ in range(5)])
+        self.assertEqual(len(self.stub.calls), 1)
+        self.assertEqual([r[1]['id'] for r in res], ['NSK2'] * 5)
+        self.assertEqual(self.api.singleflight.stats, {'calls': 1, 'coalesced': 4})
+
+    async def test_singleflight_leader_cancelled(self):
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def slow():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return len(calls)
+
+        leader = asyncio.create_task(flight.do('k', slow))
+        await asyncio.sleep(0)
+        followers = [asyncio.create_task(flight.do('k', slow)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        self.assertEqual(await asyncio.gather(*followers), [2, 2, 2])
+        self.assertTrue(leader.cancelled())
+        self.assertEqual(flight.stats, {'calls': 2, 'coalesced': 2})
+
+    async def test_new_order(self):
+        order = {
+            'number': '1', 'sender_city': 44, 'receiver_city': 137, 'tarifftypecode': 136,
+            'deliveryrecipientcost': 0, 'recipientname': 'Иванов', 'recepientemail': 'a@a.ru',
+            'phone': '5566656595', 'address': {'pvzcode': 'SPB10'}, 'packages': [],
+        }
+        self.assertEqual(await self.api.new_order(order), ('1', '1105070470'))
+        self.assertIn(b'xml_request=', self.stub.calls[0][2])
+
+    async def test_new_orders(self):
+        self.stub.routes['/new_order'] = new_orders_route
+        res = await self.api.new_orders([make_order(str(i)) for i in range(5)] + [make_order('bad')], chunk_size=2)
+        self.assertEqual([r.dispatch_number for r in res], ['D0', 'D1', 'D2', 'D3', 'D4', None])
+        self.assertEqual(len(self.stub.calls), 3)
+
+    async def test_calc_prices_bulk(self):
+        self.stub.routes['/calc_prices'] = calc_prices_route
+        goods = [{'weight': 0.3, 'length': 10, 'width': 7, 'height': 5}]
+        specs = [{'sender_city_id': 44, 'receiver_city_id': r, 'goods': goods} for r in (137, 0, 137)]
+        results = [r async for r in self.api.calc_prices_bulk(specs)]
+        self.assertEqual(sorted(r.ok for r in results), [False, True, True])
+        self.assertEqual(len(self.stub.calls), 2)
+
+    async def test_sync_only(self):
+        self.assertFalse(hasattr(self.api, 'best_tariff'))
+        self.assertFalse(hasattr(self.api, 'iter_pvz'))
+        self.assertFalse(hasattr(self.api, 'ranker'))
+        with self.assertRaises(TypeError):
+            with self.api:
+                pass
+
+    async def test_prepare_quote(self):
+        quote = self.api.prepare_quote(44, 137)
+        res = await quote([{'weight': 0.3, 'length': 10, 'width': 7, 'height': 5}])
+        self.assertEqual(res['result']['price'], 1050)
+
+    async def test_pvz_disk_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.api.pvz_cache = PvzDiskCache(directory)
+            first = await self.api.get_pvz_list(270, 1)
+            self.assertEqual(await self.api.get_pvz_list(270, 1), first)
+            self.assertEqual(self.api.pvz_cache.stats, {'hits': 1, 'misses': 1, 'refreshes': 1, 'errors': 0})
+
+    async def test_pvz_disk_cache_off_loop(self):
+        threads = []
+
+        class Cache(PvzDiskCache):
+            def load(self, key):
+                threads.append(threading.get_ident())
+                return super().load(key)
+
+            def store(self, key, data):
+                threads.append(threading.get_ident())
+                super().store(key, data)
+
+        with tempfile.TemporaryDirectory() as directory:
+            self.api.pvz_cache = Cache(directory)
+            await self.api.get_pvz_list(270, 1)
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.get_ident(), threads)
+
+
 if __name__ == '__main__': 
     unittest.main()
@@ -0,0 +1,72 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cdekapi.models import OrderStatus
+from cdekapi.ratelimit import BULK, priority
+
+
+class StatusTracker:
+    """
+    Polls order statuses in chunks and reports only the changed ones
+    """
+
+    def __init__(self, api, chunk_size=200, max_concurrency=4, on_change=None):
+        """
+        Create the tracker
+        :param api: CdekApi
+        :param chunk_size: orders per status_report_h.php request
+        :param max_concurrency: parallel requests
+        :param on_change: callback(status, previous) for every changed status, previous is None for new orders
+        """
+        self.api = api
+        self.chunk_size = chunk_size
+        self.max_concurrency = max_concurrency
+        self.on_change = on_change
+        self.last_seen = {}
+        self.errors = []
+        self._lock = threading.Lock()
+
+    def _fetch_chunk(self, chunk):
+        try:
+            with priority(BULK):
+                root = self.api.check_orders_status(chunk)
+        except Exception as e:
+            with self._lock:
+                self.errors.append((chunk, e))
+            return []
+        return [OrderStatus.from_element(order) for order in root.iter('Order')]
+
+    def fetch(self, orders):
+        """
+        Current statuses of the orders
+        :param orders: list of {order_number, dispatch_number}, see check_orders_status
+        :return: generator of OrderStatus, failed chunks are collected in self.errors
+        """
+        orders = list(orders)
+        self.errors = []
+        chunks = [orders[i:i + self.chunk_size] for i in range(0, len(orders), self.chunk_size)]
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            for statuses in executor.map(self._fetch_chunk, chunks):
+                yield from statuses
+
+    def poll(self, orders):
+        """
+        Fetch the statuses and keep the ones that differ from the last seen
+        :param orders: list of {order_number, dispatch_number}
+        :return: generator of changed OrderStatus
+        """
+        for status in self.fetch(orders):
+            previous = self.last_seen.get(status.dispatch_number)
+            if previous is not None and (previous.code, previous.date) == (status.code, status.date):
+                continue
+            self.last_seen[status.dispatch_number] = status
+            if self.on_change:
+                self.on_change(status, previous)
+            yield status
+
+    def forget(self, dispatch_numbers):
+        """
+        Stop keeping state for delivered or cancelled orders
+        """
+        for dispatch_number in dispatch_numbers:
+            self.last_seen.pop(str(dispatch_number), None)
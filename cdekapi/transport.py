@@ -0,0 +1,58 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HttpTransport:
+    """
+    Pooled keep-alive HTTP transport used by CdekApi for every endpoint
+    """
+    errors = (requests.RequestException,)
+
+    def __init__(self,
+                 pool_connections=4,
+                 pool_maxsize=16,
+                 timeout=(5, 30),
+                 keep_alive=True,
+                 pool_block=False,
+                 session=None):
+        """
+        Create the transport
+        :param pool_connections: number of per-host pools to keep
+        :param pool_maxsize: max connections kept open per host
+        :param timeout: default (connect, read) timeout, seconds
+        :param keep_alive: reuse connections between calls
+        :param pool_block: wait for a free connection instead of opening an extra one
+        :param session: ready requests.Session to use instead of a new one
+        """
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize,
+                              pool_block=pool_block)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+    def request(self, http_method, url, timeout=None, **kwargs):
+        """
+        Send the request through the pool
+        :param http_method: GET/POST
+        :param url: full url
+        :param timeout: per-call timeout, defaults to the transport one
+        :param kwargs: requests keyword arguments
+        :return: requests.Response
+        """
+        return self.session.request(http_method, url,
+                                    timeout=timeout or self.timeout,
+                                    **kwargs)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,317 @@
+import datetime
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+
+from cdekapi import CdekApi
+from cdekapi.bulk import BulkStats
+from cdekapi.codec import get_codec
+from cdekapi.eligibility import is_no_delivery
+from cdekapi.exceptions import CdekAPIError
+from cdekapi.models import TariffQuote
+from cdekapi.ranking import TariffRanker
+
+MAGIC = b'CDEKQTE1'
+
+SPEC_FIELDS = ('sender_city_id', 'receiver_city_id', 'goods', 'services', 'currency')
+
+# snapshot row of an available tariff
+ROW_FIELDS = ('tariff_id', 'price', 'period_min', 'period_max', 'date_min', 'date_max')
+
+
+def route_key(sender_city_id, receiver_city_id, goods, services=None, currency='RUB'):
+    """
+    Snapshot key of a route and parcel
+    """
+    return json.dumps([int(sender_city_id), int(receiver_city_id), goods, services or None, currency],
+                      sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+
+
+def _spec(spec):
+    return {
+        'sender_city_id': int(spec['sender_city_id']),
+        'receiver_city_id': int(spec['receiver_city_id']),
+        'goods': spec['goods'],
+        'services': spec.get('services') or None,
+        'currency': spec.get('currency') or 'RUB',
+    }
+
+
+def load_specs(path):
+    """
+    Read the routes to warm up from a json file, either a list of specs
+        [{"sender_city_id": 44, "receiver_city_id": 137, "goods": [...]}, ...]
+    or routes by parcels, every route is warmed up for every parcel
+        {"routes": [[44, 137], ...], "parcels": [[{"weight": 1, ...}], ...]}
+    :return: list of {sender_city_id, receiver_city_id, goods, services, currency}, hottest first
+    """
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = [{'sender_city_id': sender, 'receiver_city_id': receiver, 'goods': goods}
+                for sender, receiver in data['routes'] for goods in data['parcels']]
+    return [_spec(spec) for spec in data]
+
+
+def specs_from_cache(cache, limit=500):
+    """
+    The most requested routes and parcels of a QuoteCache, whatever the tariffs and dateExecute asked
+    :param cache: QuoteCache
+    :param limit: number of specs
+    :return: list of specs, hottest first
+    """
+    counts = {}
+    specs = {}
+    for method, data, count in cache.hot():
+        if method not in ('calc_price', 'calc_prices'):
+            continue
+        spec = _spec({'sender_city_id': data['senderCityId'], 'receiver_city_id': data['receiverCityId'],
+                      'goods': data['goods'], 'services': data.get('services'), 'currency': data.get('currency')})
+        key = route_key(**spec)
+        specs.setdefault(key, spec)
+        counts[key] = counts.get(key, 0) + count
+    return [specs[key] for key in sorted(counts, key=counts.get, reverse=True)[:limit]]
+
+
+class QuoteSnapshot:
+    """
+    Precomputed calc_prices results of the hot routes for one dateExecute
+    """
+
+    def __init__(self, date_execute, routes=None, created=None):
+        """
+        :param date_execute: dateExecute the quotes were computed for
+        :param routes: route_key -> list of rows, see ROW_FIELDS
+        """
+        self.date_execute = date_execute
+        self.routes = routes if routes is not None else {}
+        self.created = created or time.time()
+
+    def add(self, spec, quotes):
+        """
+        :param spec: load_specs item
+        :param quotes: TariffQuote list, the unavailable ones are left out
+        """
+        rows = self.routes.setdefault(route_key(**spec), [])
+        rows.extend([getattr(q, name) for name in ROW_FIELDS] for q in quotes if q.status)
+
+    @property
+    def current(self):
+        """
+        False once the default dateExecute has moved on
+        """
+        return self.date_execute == CdekApi._date_execute()
+
+    def quotes(self, sender_city_id, receiver_city_id, goods, services=None, currency='RUB'):
+        """
+        :return: list of available TariffQuote, cheapest first, or None if the route was not warmed up
+        """
+        rows = self.routes.get(route_key(sender_city_id, receiver_city_id, goods, services, currency))
+        if rows is None:
+            return None
+        quotes = [TariffQuote(status=True, currency=currency, **dict(zip(ROW_FIELDS, row))) for row in rows]
+        return sorted(quotes, key=lambda q: (q.price, q.tariff_id))
+
+    def quote(self, sender_city_id, receiver_city_id, goods, tariff_id=136, services=None, currency='RUB'):
+        """
+        :return: TariffQuote of the tariff or None
+        """
+        for quote in self.quotes(sender_city_id, receiver_city_id, goods, services, currency) or ():
+            if quote.tariff_id == tariff_id:
+                return quote
+        return None
+
+    def __len__(self):
+        return len(self.routes)
+
+    def save(self, path, codec=None, level=9):
+        """
+        Write the snapshot atomically
+        """
+        payload = get_codec(codec).dumps({'date_execute': self.date_execute, 'created': self.created,
+                                          'routes': self.routes})
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(MAGIC)
+                f.write(zlib.compress(payload, level))
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    @classmethod
+    def load(cls, path, codec=None):
+        """
+        :return: QuoteSnapshot, ValueError if the file is not a snapshot
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        if not data.startswith(MAGIC):
+            raise ValueError(f'{path} is not a quote snapshot')
+        data = get_codec(codec).loads(zlib.decompress(data[len(MAGIC):]))
+        return cls(data['date_execute'], data['routes'], data['created'])
+
+
+class Warmer:
+    """
+    Precomputes calc_prices of the hot routes over the calc_dictionaries tariffs within a request budget
+    """
+
+    def __init__(self, api, specs, budget=1000, chunk_size=4, max_concurrency=4):
+        """
+        :param api: CdekApi or CdekApiPool
+        :param specs: list of specs hottest first, or a function returning it, see load_specs and specs_from_cache
+        :param budget: calc_prices requests per run, the colder routes that do not fit are left out
+        :param chunk_size: tariffs per calc_prices request
+        :param max_concurrency: parallel requests
+        """
+        self.api = api
+        self.specs = specs
+        self.budget = budget
+        self.chunk_size = chunk_size
+        self.max_concurrency = max_concurrency
+        self.last_stats = None
+
+    def plan(self, date_execute=None):
+        """
+        :return: (specs that fit the budget, calc_prices keyword arguments of their requests)
+        """
+        specs = self.specs() if callable(self.specs) else self.specs
+        planned = []
+        requests = []
+        for spec in specs:
+            tariffs = TariffRanker.candidates(spec['goods'])
+            chunks = [tariffs[i:i + self.chunk_size] for i in range(0, len(tariffs), self.chunk_size)]
+            # a route is warmed up whole or not at all, a partial one would miss the cheapest tariff
+            if len(requests) + len(chunks) > self.budget:
+                break
+            planned.append(spec)
+            requests += [dict(spec, tariff_list=chunk, date_execute=date_execute, decimal_places=2)
+                         for chunk in chunks]
+        return planned, requests
+
+    def run(self, date_execute=None):
+        """
+        :param date_execute: datetime.date, the default dateExecute by default
+        :return: QuoteSnapshot of the routes whose every request succeeded
+        """
+        planned, requests = self.plan(date_execute)
+        snapshot = QuoteSnapshot(CdekApi._date_execute(date_execute))
+        quotes = {route_key(**spec): [] for spec in planned}
+        failed = set()
+        stats = BulkStats()
+        for result in self.api.calc_prices_bulk(requests, self.max_concurrency, stats=stats):
+            key = route_key(**{name: result.spec[name] for name in SPEC_FIELDS})
+            if result.ok:
+                quotes[key].extend(TariffQuote.list_from_json(result.result))
+            elif not (isinstance(result.error, CdekAPIError) and is_no_delivery(result.error)):
+                # the route is not known to have no tariff, it is asked again on the next run
+                failed.add(key)
+        for spec in planned:
+            key = route_key(**spec)
+            if key not in failed:
+                snapshot.add(spec, quotes[key])
+        self.last_stats = dict(stats.as_dict(), routes=len(snapshot), failed=len(failed))
+        return snapshot
+
+
+class WarmupScheduler:
+    """
+    Runs the Warmer before the peak hours and right after midnight, when the default dateExecute moves on,
+    writing the snapshot the request handlers load
+    """
+
+    def __init__(self, warmer, path, times=('07:00',), rollover=True, rollover_delay=60, retry=300,
+                 on_snapshot=None):
+        """
+        :param warmer: Warmer
+        :param path: snapshot file
+        :param times: local 'HH:MM' times of the runs before the peaks
+        :param rollover: also run rollover_delay seconds after midnight
+        :param retry: seconds before a failed run is retried
+        :param on_snapshot: callback(QuoteSnapshot) after every run, e.g. to swap it into the handlers
+        """
+        self.warmer = warmer
+        self.path = path
+        self.times = [datetime.time(*map(int, t.split(':'))) for t in times]
+        self.rollover = rollover
+        self.rollover_delay = rollover_delay
+        self.retry = retry
+        self.on_snapshot = on_snapshot
+        self.runs = 0
+        self.errors = 0
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def next_run(self, now=None):
+        """
+        :param now: datetime.datetime, local
+        :return: datetime.datetime of the next run
+        """
+        now = now or datetime.datetime.now()
+        candidates = []
+        for day in (now.date(), now.date() + datetime.timedelta(days=1)):
+            candidates += [datetime.datetime.combine(day, t) for t in self.times]
+            if self.rollover:
+                candidates.append(datetime.datetime.combine(day, datetime.time())
+                                  + datetime.timedelta(seconds=self.rollover_delay))
+        return min(c for c in candidates if c > now)
+
+    def run_once(self):
+        """
+        Warm up and write the snapshot
+        :return: QuoteSnapshot
+        """
+        snapshot = self.warmer.run()
+        snapshot.save(self.path)
+        self.runs += 1
+        if self.on_snapshot:
+            self.on_snapshot(snapshot)
+        return snapshot
+
+    def _loop(self, initial):
+        delay = 0 if initial else None
+        while not self._stop.is_set():
+            if delay is None:
+                delay = (self.next_run() - datetime.datetime.now()).total_seconds()
+            if self._stop.wait(max(delay, 0)):
+                break
+            try:
+                self.run_once()
+                delay = None
+            except Exception as e:
+                # keep the previous snapshot, try again soon
+                self.errors += 1
+                self.last_error = e
+                delay = self.retry
+
+    def start(self, initial=True):
+        """
+        Run in a background thread
+        :param initial: warm up at once if the snapshot file is missing or of another dateExecute
+        """
+        initial = initial and not self._current()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(initial,), name='cdek-warmup', daemon=True)
+        self._thread.start()
+
+    def _current(self):
+        try:
+            return QuoteSnapshot.load(self.path).current
+        except (OSError, ValueError, zlib.error):
+            return False
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def stats(self):
+        return {'runs': self.runs, 'errors': self.errors, 'warmer': self.warmer.last_stats}
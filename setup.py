@@ -8,4 +8,5 @@ setup(name='cdekapi',
       author_email='olegaleksandrovich@ya.ru',
       license='MIT',
       packages=['cdekapi'],
-      zip_safe=False, install_requires=['requests'])
+      zip_safe=False, install_requires=['requests'],
+      extras_require={'async': ['aiohttp'], 'fast': ['orjson']})